@@ -1,56 +1,90 @@
-from typing import List, Dict, Union
+import json
+import os
+from typing import List, Dict, Union, Iterator
 
-import pandas as pd
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from typing_extensions import Tuple
 
-from src.service.final_response_generator import generate_final_response
+from src.service.course_catalog import get_catalog_store
+from src.service.final_response_generator import generate_final_response, stream_final_response
 from src.service.query_generator import generate_potential_query
 from src.service.relative_search import CourseReranker
 from src.service.relative_search_bi_encoder import CourseRerankerWithFieldMapping
+from src.service.relative_search_two_stage import TwoStageCourseRanker
+from src.service.response_cache import FinalResponseCache
 from src.types.chat_types import ChatRequest, Message, ChatResponse
+from src.types.ranked_courses import RankedCourses
 
 MAX_RETRY = 3
-USE_CROSS_ENCODER = False
+# Retrieval mode:
+# - 'bi_encoder': Precomputed field embeddings (fast)
+# - 'cross_encoder': CrossEncoder over the whole catalog (slow)
+# - 'two_stage': Bi-encoder picks the top TWO_STAGE_CANDIDATE_K candidates, the cross-encoder reranks them
+RETRIEVAL_MODE = 'bi_encoder'
+TWO_STAGE_CANDIDATE_K = 100
+EMBEDDINGS_DIR = 'backend/src/data/field_embeddings'
+# Number of top ranked courses shown to the LLM in the final response prompt
+FINAL_RESPONSE_TOP_K = 10
 
 app = Flask(__name__)
 # Enable CORS (Which allows the frontend to send requests to this server)
 CORS(app)
 
-if USE_CROSS_ENCODER:
+if RETRIEVAL_MODE == 'cross_encoder':
     # Initialize and use the reranker with CrossEncoder
     ranker = CourseReranker()
+elif RETRIEVAL_MODE == 'two_stage':
+    # Initialize and use the bi-encoder for candidates and the CrossEncoder for reranking
+    ranker = TwoStageCourseRanker(
+        bi_encoder=CourseRerankerWithFieldMapping(embeddings_dir=EMBEDDINGS_DIR),
+        cross_encoder=CourseReranker(),
+        candidate_k=TWO_STAGE_CANDIDATE_K,
+    )
 else:
     # Initialize and use the reranker with precomputed embeddings
-    ranker = CourseRerankerWithFieldMapping(embeddings_file='backend/src/data/precomputed_field_embeddings.pt')
+    ranker = CourseRerankerWithFieldMapping(embeddings_dir=EMBEDDINGS_DIR)
 
+# Load the course catalog once at startup, it is reloaded only when the file changes. The default path is the
+# store the rankers use, independent of the working directory
+catalog_store = get_catalog_store()
+catalog_store.get()
 
-def main_pipeline(
+# Cache of final responses. Near-duplicate lookups reuse the bi-encoder model to embed the last user message and
+# are enabled by setting FINAL_RESPONSE_CACHE_SIMILARITY (e.g. 0.95)
+similarity_threshold = os.getenv('FINAL_RESPONSE_CACHE_SIMILARITY')
+final_response_cache = FinalResponseCache(
+    max_size=int(os.getenv('FINAL_RESPONSE_CACHE_SIZE', '512')),
+    embed_fn=(lambda text: ranker.encode_queries([text])[text]) if hasattr(ranker, 'encode_queries') else None,
+    similarity_threshold=float(similarity_threshold) if similarity_threshold else None,
+    min_top_k_overlap=float(os.getenv('FINAL_RESPONSE_CACHE_MIN_OVERLAP', '0.8')),
+)
+
+
+def retrieve_courses(
     messages: List['Message'],
-    _semesters: str, # TODO: Use for different semester support
-    _current_selected_course_ids: List[str], # TODO: Use for additional support suggestions
-    generate_final_response_at_end: bool = True,
-) -> Tuple[Union[Dict[str, str], None], List[str]]:
+    course_ranker=None,
+) -> Tuple[Dict[str, str], RankedCourses, List[str], str]:
     """
-    Main pipeline for the chatbot.
+    Convert the conversation to a structured query and rank the courses with it.
 
     Args:
         messages (List[Message]): The list of messages in the conversation.
-        _semesters (str): The selected semesters.
-        _current_selected_course_ids (List[str]): The selected course IDs.
-        generate_final_response_at_end (bool): Whether to generate the final response at the end.
+        course_ranker: The ranker used for retrieval. Defaults to the ranker selected by RETRIEVAL_MODE.
 
     Returns:
-        Tuple[Dict[str, str], List[str]]: The final response and ranked course IDs.
-        The response is a dictionary with 'response' key when successful. Otherwise, it will contain an 'error' key.
+        Tuple[Dict[str, str], RankedCourses, List[str], str]: The query for retrieval, the ranked courses,
+        the ranked course IDs and the version of the catalog they were scored against.
     """
     retry = 0
 
-    courses_df = pd.read_csv('backend/src/data/courses.csv')
-    scored_courses_df = None
+    if course_ranker is None:
+        course_ranker = ranker
+
+    catalog = catalog_store.get()
+    scored_courses = None
     query_for_retrival = None
-    ranked_course_ids = courses_df['id'].tolist()
+    ranked_course_ids = catalog.catalog.ids.tolist()
 
     while retry < MAX_RETRY:
         # Generate query for retrieval
@@ -60,27 +94,93 @@ def main_pipeline(
 
         # Get retrieval result
         print('=== Retrieval ===')
-        scored_courses_df = ranker.score_courses(query_for_retrival, courses_df)
+        print(f"Catalog version: {catalog.version[:12]}")
+        scored_courses = course_ranker.score_courses(query_for_retrival, catalog.catalog)
         print("=====================")
 
-        ranked_course_ids: List[str] = scored_courses_df['id'].tolist()
+        ranked_course_ids: List[str] = scored_courses.ranked_ids()
 
         # Break if response is satisfactory
         # TODO: Add more conditions for check performance
         break
 
+    # The ranker may have scored another catalog than the current one, e.g. the catalog its embeddings belong to
+    catalog_version = scored_courses.catalog.version if scored_courses is not None else catalog.version
+    return query_for_retrival, scored_courses, ranked_course_ids, catalog_version
+
+
+def get_last_user_message(messages: List['Message']) -> str:
+    """
+    Get the content of the last message sent by the user.
+    """
+    return [msg for msg in messages if msg.role == 'user'][-1].content
+
+
+def generate_final_response_with_cache(
+    scored_courses: RankedCourses,
+    query_for_retrival: Dict[str, str],
+    last_user_message: str,
+    catalog_version: str,
+) -> Dict[str, str]:
+    """
+    Generate the final response, reusing a cached response for the same query and retrieved courses.
+    """
+    top_k_ids = scored_courses.ranked_ids(FINAL_RESPONSE_TOP_K)
+    cached_response = final_response_cache.get(query_for_retrival, top_k_ids, last_user_message, catalog_version)
+    if cached_response is not None:
+        print(f"Final response cache hit: {final_response_cache.stats()}")
+        return cached_response
+
+    top_courses = scored_courses.top_records(FINAL_RESPONSE_TOP_K)
+    final_response = generate_final_response(top_courses, query_for_retrival, last_user_message)
+    final_response_cache.put(query_for_retrival, top_k_ids, last_user_message, final_response, catalog_version)
+    return final_response
+
+
+def main_pipeline(
+    messages: List['Message'],
+    _semesters: str, # TODO: Use for different semester support
+    _current_selected_course_ids: List[str], # TODO: Use for additional support suggestions
+    generate_final_response_at_end: bool = True,
+    course_ranker=None,
+) -> Tuple[Union[Dict[str, str], None], List[str]]:
+    """
+    Main pipeline for the chatbot.
+
+    Args:
+        messages (List[Message]): The list of messages in the conversation.
+        _semesters (str): The selected semesters.
+        _current_selected_course_ids (List[str]): The selected course IDs.
+        generate_final_response_at_end (bool): Whether to generate the final response at the end.
+        course_ranker: The ranker used for retrieval. Defaults to the ranker selected by RETRIEVAL_MODE.
+
+    Returns:
+        Tuple[Dict[str, str], List[str]]: The final response and ranked course IDs.
+        The response is a dictionary with 'response' key when successful. Otherwise, it will contain an 'error' key.
+    """
+    query_for_retrival, scored_courses, ranked_course_ids, catalog_version = retrieve_courses(messages, course_ranker)
+
     final_response = None
     # Generate final response
     if generate_final_response_at_end:
         # Argument generation
-        last_user_message = [msg for msg in messages if msg.role == 'user'][-1].content
+        last_user_message = get_last_user_message(messages)
         print('=== Generate Final Response ===')
-        final_response = generate_final_response(scored_courses_df, query_for_retrival, last_user_message)
+        final_response = generate_final_response_with_cache(
+            scored_courses, query_for_retrival, last_user_message, catalog_version
+        )
         print("=====================")
 
     return final_response, ranked_course_ids
 
 
+def format_sse(event: str, data: Dict) -> str:
+    """
+    Format a Server-Sent Event with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 @app.route('/chat', methods=['POST'])
 def chat() -> Response:
     data: ChatRequest = ChatRequest.from_dict(request.json)
@@ -104,5 +204,60 @@ def chat() -> Response:
     return jsonify(response.to_dict())
 
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream() -> Response:
+    """
+    Streaming version of `/chat` using Server-Sent Events.
+
+    The ranked course IDs are sent as the first `rankedCourseIds` event right after retrieval, followed by one
+    `token` event per generated chunk of the final response, and a closing `done` event with the full response.
+    An `error` event is sent instead if the final response cannot be generated.
+    """
+    data: ChatRequest = ChatRequest.from_dict(request.json)
+    messages: List[Message] = data.messages
+
+    # Debugging
+    print("=== Received data (stream) ===")
+    print(f"semesters: {data.semesters}")
+    [print(f"role: {msg.role}, content: {msg.content}") for msg in messages]
+    print(f"currentSelectedCourseId: {data.current_selected_course_id}")
+    print("=====================")
+
+    query_for_retrival, scored_courses, ranked_course_ids, catalog_version = retrieve_courses(messages)
+    last_user_message = get_last_user_message(messages)
+    top_k_ids = scored_courses.ranked_ids(FINAL_RESPONSE_TOP_K)
+
+    def generate() -> Iterator[str]:
+        yield format_sse('rankedCourseIds', {'rankedCourseIds': ranked_course_ids})
+
+        cached_response = final_response_cache.get(query_for_retrival, top_k_ids, last_user_message, catalog_version)
+        if cached_response is not None:
+            print(f"Final response cache hit: {final_response_cache.stats()}")
+            yield format_sse('token', {'token': cached_response['response']})
+            yield format_sse('done', cached_response)
+            return
+
+        print('=== Stream Final Response ===')
+        response_chunks = []
+        top_courses = scored_courses.top_records(FINAL_RESPONSE_TOP_K)
+        for chunk in stream_final_response(top_courses, query_for_retrival, last_user_message):
+            if 'error' in chunk:
+                yield format_sse('error', chunk)
+                return
+            response_chunks.append(chunk['token'])
+            yield format_sse('token', chunk)
+        print("=====================")
+
+        final_response = {'response': ''.join(response_chunks)}
+        final_response_cache.put(query_for_retrival, top_k_ids, last_user_message, final_response, catalog_version)
+        yield format_sse('done', final_response)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
 if __name__ == '__main__':
     app.run(debug=True)
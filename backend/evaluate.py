@@ -1,18 +1,41 @@
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import argparse
+import json
 import os
 import sys
+import threading
+import time
 import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
 from tqdm import tqdm
 from contextlib import contextmanager
 
+import app
 from app import main_pipeline
+from src.service.query_generator import (
+    QUERY_MODEL, QueryGenerationError, build_query_cache_key, read_system_prompt, request_potential_query,
+)
+from src.service.ranking_metrics import (
+    bootstrap_confidence_intervals, build_ranking_matrix, build_relevance_matrix, compute_ranking_metrics,
+)
+from src.service.relative_search import CourseReranker
+from src.service.relative_search_bi_encoder import CourseRerankerWithFieldMapping
+from src.service.relative_search_two_stage import TwoStageCourseRanker
 from src.types.chat_types import Message
+from src.types.course_catalog import CourseCatalog
 
 # Load environment variables
 load_dotenv()
 
+RECORDED_QUERIES_FORMAT_VERSION = 1
+DEFAULT_RECORDED_QUERIES_FILE = "backend/src/data/recorded_queries.json"
+# Bootstrap resamples of the query-level metrics behind the confidence interval of each average
+BOOTSTRAP_RESAMPLES = 1000
+BOOTSTRAP_CONFIDENCE = 0.95
+
+
 @contextmanager
 def suppress_stdout():
     with open(os.devnull, 'w') as devnull:
@@ -23,13 +46,213 @@ def suppress_stdout():
         finally:
             sys.stdout = old_stdout
 
+
+class TimedRanker:
+    """
+    Wrap a ranker to measure the latency of its `score_courses` calls, i.e. the retrieval latency without the
+    query generation.
+    """
+
+    def __init__(self, ranker):
+        self.ranker = ranker
+        self.last_latency: Optional[float] = None
+
+    def score_courses(self, *args, **kwargs):
+        start = time.perf_counter()
+        scored_courses = self.ranker.score_courses(*args, **kwargs)
+        self.last_latency = time.perf_counter() - start
+        return scored_courses
+
+
+class RecordedQueries:
+    """
+    Structured queries of the evaluation set, recorded once from the query generation LLM and replayed by later
+    runs, so an evaluation only exercises retrieval and can be reproduced offline.
+
+    The file maps every evaluation query to its structured query and to the query cache key of the conversation
+    (model, system prompt and tool schema). Recordings made with another model or prompt are still replayed,
+    but reported as stale.
+    """
+
+    def __init__(self, path: str = DEFAULT_RECORDED_QUERIES_FILE, model: str = QUERY_MODEL):
+        """
+        Args:
+            path (str): The JSON file of the recorded queries, created on the first recording.
+            model (str): The query generation model.
+        """
+        self.path = path
+        self.model = model
+        self.system_prompt = read_system_prompt()
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                recording = json.load(f)
+            if recording.get('format_version') != RECORDED_QUERIES_FORMAT_VERSION:
+                raise ValueError(f"Unsupported recorded queries format {recording.get('format_version')} in {path}")
+            self.entries = recording['entries']
+
+    @staticmethod
+    def build_messages(query: str) -> List[Message]:
+        return [Message(role="user", content=query)]
+
+    def key_of(self, query: str) -> str:
+        return build_query_cache_key(self.build_messages(query), self.model, self.system_prompt)
+
+    def get(self, query: str) -> Optional[Dict[str, Any]]:
+        entry = self.entries.get(query)
+        return None if entry is None else entry['query']
+
+    def put(self, query: str, search_query: Dict[str, Any]):
+        with self._lock:
+            self.entries[query] = {'query': search_query, 'key': self.key_of(query)}
+
+    def missing(self, queries: Sequence[str]) -> List[str]:
+        return [query for query in dict.fromkeys(queries) if query not in self.entries]
+
+    def stale(self, queries: Sequence[str]) -> List[str]:
+        """
+        Get the recorded queries generated with another model, system prompt or tool schema.
+        """
+        return [query for query in dict.fromkeys(queries)
+                if query in self.entries and self.entries[query]['key'] != self.key_of(query)]
+
+    def save(self):
+        """
+        Atomically write the recorded queries.
+        """
+        with self._lock:
+            recording = {
+                'format_version': RECORDED_QUERIES_FORMAT_VERSION,
+                'model': self.model,
+                'entries': dict(self.entries),
+            }
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(recording, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def record(self, queries: Sequence[str], workers: int = 4, save_every: int = 20) -> List[str]:
+        """
+        Generate and record the structured queries, a few LLM calls at a time. Failed queries are not recorded.
+
+        Args:
+            queries (Sequence[str]): The evaluation queries to record.
+            workers (int): Number of concurrent LLM calls.
+            save_every (int): Save the file after this many recorded queries, so an interrupted run keeps them.
+
+        Returns:
+            List[str]: The queries that could not be recorded.
+        """
+        failures: List[Tuple[str, str]] = []
+
+        def generate(query: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+            try:
+                return query, request_potential_query(self.build_messages(query), self.model)
+            except QueryGenerationError as e:
+                failures.append((query, str(e)))
+                return query, None
+
+        recorded = 0
+        queries = list(dict.fromkeys(queries))
+        with suppress_stdout(), ThreadPoolExecutor(max_workers=workers) as executor:
+            for query, search_query in tqdm(executor.map(generate, queries), total=len(queries),
+                                            desc="Recording queries"):
+                if search_query is None:
+                    continue
+                self.put(query, search_query)
+                recorded += 1
+                if recorded % save_every == 0:
+                    self.save()
+        self.save()
+
+        print(f"Recorded {recorded} of {len(queries)} queries to {self.path}")
+        for query, error in failures[:10]:
+            print(f"Warning: Failed to record {query}: {error}")
+        return [query for query, _ in failures]
+
+
+def compute_query_level_metrics(
+    queries: Sequence[str],
+    ground_truths: Sequence[Iterable[str]],
+    rankings: Sequence[np.ndarray],
+    latencies: Sequence[float],
+    catalog: CourseCatalog,
+    k_values: List[int],
+) -> pd.DataFrame:
+    """
+    Compute the query-level metrics of all queries at once with the vectorized ranking metrics.
+
+    Args:
+        queries (Sequence[str]): The evaluation queries.
+        ground_truths (Sequence[Iterable[str]]): The relevant course IDs of every query.
+        rankings (Sequence[np.ndarray]): The catalog rows of the ranked courses of every query, best first.
+        latencies (Sequence[float]): The retrieval latency of every query, in seconds.
+        catalog (CourseCatalog): The catalog the rankings refer to.
+        k_values (List[int]): The cutoffs of Hit@K, Recall@K and nDCG@K.
+
+    Returns:
+        pd.DataFrame: One row per query with its ground truth size, latency, Hit@K, AP, Recall@K, nDCG@K and
+        reciprocal rank (RR).
+    """
+    # Relevance is decided by course ID, so a row whose ID is listed again in the catalog counts as that ID
+    canonical_rows = catalog.rows_of(catalog.ids.tolist())
+    ranked_rows = build_ranking_matrix(rankings)
+    ranked_rows = np.where(ranked_rows >= 0, canonical_rows[ranked_rows], -1)
+
+    ground_truths = [set(ground_truth) for ground_truth in ground_truths]
+    relevance = build_relevance_matrix([catalog.rows_of(ground_truth) for ground_truth in ground_truths],
+                                       len(catalog))
+    # Relevant courses missing from the catalog still count in the ground truth size
+    num_relevant = np.array([len(ground_truth) for ground_truth in ground_truths], dtype=np.int64)
+    metrics = compute_ranking_metrics(ranked_rows, relevance, k_values, num_relevant)
+
+    query_results_df = pd.DataFrame({
+        "query": list(queries),
+        "ground_truth_size": num_relevant,
+        "retrieval_latency_ms": np.asarray(latencies, dtype=np.float64) * 1000,
+    })
+    for column in [f"Hit@{k}" for k in k_values] + ["AP"] + [f"Recall@{k}" for k in k_values] \
+            + [f"nDCG@{k}" for k in k_values] + ["RR"]:
+        query_results_df[column] = metrics[column]
+    return query_results_df
+
+
+def aggregate_metrics(query_results_df: pd.DataFrame, k_values: List[int]) -> Dict[str, Any]:
+    """
+    Aggregate the query-level metrics into their averages (Average Hit@K, MAP, MRR, ...), the bootstrap
+    confidence interval of each average and the retrieval latency percentiles.
+    """
+    # MAP is the mean of AP across all queries, MRR the mean of the reciprocal ranks
+    names = {f"Hit@{k}": f"Average Hit@{k}" for k in k_values}
+    names["AP"] = "MAP"
+    names.update({f"Recall@{k}": f"Average Recall@{k}" for k in k_values})
+    names.update({f"nDCG@{k}": f"Average nDCG@{k}" for k in k_values})
+    names["RR"] = "MRR"
+
+    intervals = bootstrap_confidence_intervals(query_results_df[list(names)], BOOTSTRAP_RESAMPLES,
+                                               BOOTSTRAP_CONFIDENCE)
+    metrics = {name: query_results_df[column].mean() for column, name in names.items()}
+    latencies = query_results_df["retrieval_latency_ms"]
+    metrics["Mean retrieval latency (ms)"] = latencies.mean()
+    metrics["P50 retrieval latency (ms)"] = np.percentile(latencies, 50)
+    metrics["P95 retrieval latency (ms)"] = np.percentile(latencies, 95)
+    for column, name in names.items():
+        metrics[f"{name} {BOOTSTRAP_CONFIDENCE:.0%} CI"] = \
+            f"[{intervals.at[column, 'low']:.4f}, {intervals.at[column, 'high']:.4f}]"
+    return metrics
+
+
 def evaluate_pipeline_with_map(
     queries_ground_truth_df: pd.DataFrame,
     pipeline: callable,
-    k_values: List[int] = None
+    k_values: List[int] = None,
+    course_ranker=None,
 ):
     """
-    Evaluate the retrieval pipeline using Hit@K and MAP.
+    Evaluate the retrieval pipeline using Hit@K, Recall@K, nDCG@K, MRR and MAP.
 
     Args:
         queries_ground_truth_df (pd.DataFrame):
@@ -43,24 +266,24 @@ def evaluate_pipeline_with_map(
                 _current_selected_course_ids: list
             and returns a tuple: (_, ranked_course_ids)
         k_values (List[int]):
-            A list of cutoff values for computing Hit@K. Default: [5, 10, 20]
+            A list of cutoff values for computing Hit@K, Recall@K and nDCG@K. Default: [5, 10, 20]
+        course_ranker:
+            The ranker passed to the pipeline. Defaults to the ranker of the app.
 
     Returns:
-        metrics (dict): Aggregated metrics including Average Hit@K and MAP.
+        metrics (dict): Aggregated metrics including Average Hit@K, MAP, MRR, their confidence intervals and the
+            retrieval latency.
         query_results_df (pd.DataFrame): Query-level metrics.
     """
 
     if k_values is None:
         k_values = [5, 10, 20]
 
-    hit_at_k = {k: [] for k in k_values}
-    average_precisions = []
-    query_results = []
+    rankings, latencies = [], []
 
-    for _, row in tqdm(queries_ground_truth_df.iterrows(), total=len(queries_ground_truth_df), desc="Evaluating"):
-        query = row["query"]
-        ground_truth = set(row["relative_courses_id"])  # Relevant course IDs
+    timed_ranker = TimedRanker(course_ranker if course_ranker is not None else app.ranker)
 
+    for query in tqdm(queries_ground_truth_df["query"], total=len(queries_ground_truth_df), desc="Evaluating"):
         # Suppress pipeline output
         with suppress_stdout():
             _, ranked_course_ids = pipeline(
@@ -69,60 +292,193 @@ def evaluate_pipeline_with_map(
                 _current_selected_course_ids=[],
                 # In evaluation, we only need the ranked course IDs, which are not required for Argument Generation
                 generate_final_response_at_end=False,
+                course_ranker=timed_ranker,
             )
 
-        # Determine the relevance of each retrieved course
-        relevance = [1 if course_id in ground_truth else 0 for course_id in ranked_course_ids]
-
-        # Compute Hit@K
-        query_metrics = {"query": query, "ground_truth_size": len(ground_truth)}
-        for k in k_values:
-            top_k_relevance = relevance[:k]
-            query_metrics[f"Hit@{k}"] = 1 if sum(top_k_relevance) > 0 else 0
-            hit_at_k[k].append(query_metrics[f"Hit@{k}"])
-
-        # Compute Average Precision for this query
-        if len(ground_truth) > 0:
-            precision_values = []
-            num_relevant_retrieved = 0
-            for rank, rel in enumerate(relevance, start=1):
-                if rel == 1:
-                    num_relevant_retrieved += 1
-                    precision_values.append(num_relevant_retrieved / rank)
-            average_precision = np.mean(precision_values) if precision_values else 0.0
+        rankings.append(ranked_course_ids)
+        latencies.append(timed_ranker.last_latency)
+
+    catalog = app.catalog_store.get().catalog
+    query_results_df = compute_query_level_metrics(
+        queries_ground_truth_df["query"].tolist(), queries_ground_truth_df["relative_courses_id"].tolist(),
+        [catalog.rows_of(ranked_course_ids) for ranked_course_ids in rankings], latencies, catalog, k_values,
+    )
+    return aggregate_metrics(query_results_df, k_values), query_results_df
+
+
+def evaluate_ranker_with_recorded_queries(
+    queries_ground_truth_df: pd.DataFrame,
+    recorded_queries: RecordedQueries,
+    course_ranker,
+    k_values: List[int] = None,
+    workers: int = 4,
+):
+    """
+    Evaluate a ranker on the recorded structured queries, without any LLM call, running several queries
+    concurrently.
+
+    Args:
+        queries_ground_truth_df (pd.DataFrame): The evaluation set, see `evaluate_pipeline_with_map`.
+        recorded_queries (RecordedQueries): The structured query of every evaluation query.
+        course_ranker: The ranker to evaluate.
+        k_values (List[int]): A list of cutoff values for computing Hit@K, Recall@K and nDCG@K. Default: [5, 10, 20]
+        workers (int): Number of queries scored concurrently. The latencies of concurrent queries include the
+            contention between them, use 1 to measure the latency of a single request.
+
+    Returns:
+        metrics (dict): Aggregated metrics including Average Hit@K, MAP, MRR, their confidence intervals, the
+            retrieval latency and throughput.
+        query_results_df (pd.DataFrame): Query-level metrics, in the order of the evaluation set.
+    """
+    if k_values is None:
+        k_values = [5, 10, 20]
+
+    # Every query is scored against the same catalog snapshot
+    catalog = app.catalog_store.get().catalog
+
+    def retrieve(query: str) -> Tuple[np.ndarray, float]:
+        start = time.perf_counter()
+        scored_courses = course_ranker.score_courses(recorded_queries.get(query), catalog)
+        latency = time.perf_counter() - start
+        return scored_courses.top_rows(), latency
+
+    queries = queries_ground_truth_df["query"].tolist()
+    start = time.perf_counter()
+    with suppress_stdout(), ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(tqdm(executor.map(retrieve, queries), total=len(queries), desc="Evaluating"))
+    wall_time = time.perf_counter() - start
+
+    query_results_df = compute_query_level_metrics(
+        queries, queries_ground_truth_df["relative_courses_id"].tolist(), [rows for rows, _ in results],
+        [latency for _, latency in results], catalog, k_values,
+    )
+    metrics = aggregate_metrics(query_results_df, k_values)
+    metrics["Throughput (queries/s)"] = len(queries) / wall_time if wall_time > 0 else float('nan')
+    return metrics, query_results_df
+
+
+def build_rankers(modes: List[str], candidate_k_values: List[int]):
+    """
+    Build the rankers to compare, reusing the models already loaded by the app.
+
+    Returns:
+        List[Tuple[str, Any]]: The name of each configuration and its ranker.
+    """
+    if isinstance(app.ranker, TwoStageCourseRanker):
+        bi_encoder, cross_encoder = app.ranker.bi_encoder, app.ranker.cross_encoder
+    elif isinstance(app.ranker, CourseReranker):
+        bi_encoder, cross_encoder = None, app.ranker
+    else:
+        bi_encoder, cross_encoder = app.ranker, None
+
+    if bi_encoder is None and any(mode != 'cross_encoder' for mode in modes):
+        bi_encoder = CourseRerankerWithFieldMapping(app.EMBEDDINGS_DIR)
+    rankers = []
+    for mode in modes:
+        if mode == 'bi_encoder':
+            rankers.append(('bi_encoder', bi_encoder))
+            continue
+
+        if cross_encoder is None:
+            cross_encoder = app.ranker.cross_encoder if isinstance(app.ranker, TwoStageCourseRanker) \
+                else CourseReranker()
+        if mode == 'cross_encoder':
+            rankers.append(('cross_encoder', cross_encoder))
+        elif mode == 'two_stage':
+            for candidate_k in candidate_k_values:
+                rankers.append((f'two_stage_k{candidate_k}',
+                                TwoStageCourseRanker(bi_encoder, cross_encoder, candidate_k=candidate_k)))
         else:
-            average_precision = 0.0
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+    return rankers
 
-        query_metrics["AP"] = average_precision
-        average_precisions.append(average_precision)
-        query_results.append(query_metrics)
 
-    # Aggregate results
-    metrics = {
-        f"Average Hit@{k}": np.mean(hit_at_k[k]) for k in k_values
-    }
-    # MAP is the mean of AP across all queries
-    metrics["MAP"] = np.mean(average_precisions)
+def prepare_recorded_queries(queries: List[str], path: str, rerecord: bool, workers: int) -> RecordedQueries:
+    """
+    Load the recorded queries and record the missing ones (or all of them when `rerecord` is set).
+    Exits if some queries are still missing, e.g. without API key.
+    """
+    recorded_queries = RecordedQueries(path)
+    to_record = list(dict.fromkeys(queries)) if rerecord else recorded_queries.missing(queries)
+    if to_record:
+        print(f"Recording {len(to_record)} queries with {recorded_queries.model}...")
+        recorded_queries.record(to_record, workers=workers)
 
-    return metrics, pd.DataFrame(query_results)
+    missing = recorded_queries.missing(queries)
+    if missing:
+        print(f"Error: {len(missing)} queries have no recorded structured query, set GROQ_API_KEY and rerun to "
+              f"record them. A server set with LLM_BASE_URL needs a GROQ_API_KEY as well, e.g. GROQ_API_KEY=fake "
+              f"for scripts/fake_llm_server.py")
+        sys.exit(1)
+    stale = recorded_queries.stale(queries)
+    if stale:
+        print(f"Warning: {len(stale)} recorded queries were generated with another model or system prompt, "
+              f"rerun with --queries record to refresh them")
+    return recorded_queries
 
 
-# Load ground truth data
-queries_ground_truth = pd.read_csv("backend/src/data/query_target_label_with_tags.csv",
-                                   converters={"relative_courses_id": eval})
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate the retrieval quality and latency of the rankers.")
+    parser.add_argument("--rankers", nargs="+", default=["bi_encoder"],
+                        choices=["bi_encoder", "cross_encoder", "two_stage"],
+                        help="The rankers to evaluate.")
+    parser.add_argument("--candidate-k", nargs="+", type=int, default=[app.TWO_STAGE_CANDIDATE_K],
+                        help="The numbers of bi-encoder candidates reranked by the two-stage ranker.")
+    parser.add_argument("--queries", default="replay", choices=["replay", "record", "live"],
+                        help="replay: score the recorded structured queries, recording only the missing ones. "
+                             "record: regenerate and record every structured query, then replay them. "
+                             "live: run the full pipeline with a query generation call per query.")
+    parser.add_argument("--recorded-queries", default=DEFAULT_RECORDED_QUERIES_FILE,
+                        help="File of the recorded structured queries.")
+    parser.add_argument("--workers", type=int, default=4, help="Number of queries scored concurrently.")
+    parser.add_argument("--record-workers", type=int, default=4, help="Number of concurrent LLM calls.")
+    parser.add_argument("--limit", type=int, default=0, help="Only evaluate the first N queries.")
+    args = parser.parse_args()
 
-# Evaluate pipeline
-evaluate_metrics, query_metrics_df = evaluate_pipeline_with_map(
-    queries_ground_truth_df=queries_ground_truth,
-    pipeline=main_pipeline,
-    k_values=[5, 10, 20]
-)
+    # Load ground truth data
+    queries_ground_truth = pd.read_csv("backend/src/data/query_target_label_with_tags.csv",
+                                       converters={"relative_courses_id": eval})
+    if args.limit > 0:
+        queries_ground_truth = queries_ground_truth.head(args.limit)
+
+    recorded = None
+    if args.queries != "live":
+        recorded = prepare_recorded_queries(queries_ground_truth["query"].tolist(), args.recorded_queries,
+                                            rerecord=args.queries == "record", workers=args.record_workers)
+
+    # Every ranker is evaluated on the same structured queries (recorded, or cached by the query generator)
+    comparison = {}
+    for ranker_name, course_ranker in build_rankers(args.rankers, args.candidate_k):
+        # Evaluate pipeline
+        if recorded is None:
+            evaluate_metrics, query_metrics_df = evaluate_pipeline_with_map(
+                queries_ground_truth_df=queries_ground_truth,
+                pipeline=main_pipeline,
+                k_values=[5, 10, 20],
+                course_ranker=course_ranker,
+            )
+        else:
+            evaluate_metrics, query_metrics_df = evaluate_ranker_with_recorded_queries(
+                queries_ground_truth_df=queries_ground_truth,
+                recorded_queries=recorded,
+                course_ranker=course_ranker,
+                k_values=[5, 10, 20],
+                workers=args.workers,
+            )
+        comparison[ranker_name] = evaluate_metrics
+
+        # Print evaluation results
+        print(f"Evaluation Results ({ranker_name}):")
+        for metric, value in evaluate_metrics.items():
+            print(f"{metric}: {value}")
 
-# Print evaluation results
-print("Evaluation Results:")
-for metric, value in evaluate_metrics.items():
-    print(f"{metric}: {value}")
+        # Save query-level metrics for analysis
+        suffix = "" if ranker_name == "bi_encoder" else f"_{ranker_name}"
+        output_file = f"backend/src/data/query_level_metrics{suffix}.csv"
+        query_metrics_df.to_csv(output_file, index=False)
+        print(f"Query-level metrics saved to '{os.path.basename(output_file)}'.")
 
-# Save query-level metrics for analysis
-query_metrics_df.to_csv("backend/src/data/query_level_metrics.csv", index=False)
-print("Query-level metrics saved to 'query_level_metrics.csv'.")
+    if len(comparison) > 1:
+        print("\nComparison of the rankers:")
+        comparison_df = pd.DataFrame.from_dict(comparison, orient="index")
+        print(comparison_df.select_dtypes("number").to_string(float_format=lambda value: f"{value:.4f}"))
@@ -1,48 +1,424 @@
 import asyncio
+import multiprocessing
+import os
+import random
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import urlsplit, urlunsplit
+
 import aiohttp
 import pandas as pd
 from tqdm import tqdm
-from bs4 import BeautifulSoup
+
+from backend.scripts.api.http_cache import CachedPage, HttpCache
+from backend.scripts.api.outline_parser import parse_outline_page
 
 # Enable progress bar for DataFrame operations
 tqdm.pandas()
 
-async def extract_course_details(course_url: str, progress_bar: tqdm) -> dict:
+# Status codes worth retrying: request timeout, rate limit and server errors
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+EMPTY_DETAILS = {"syllabus": "", "objectives": ""}
+
+DEFAULT_CACHE_PATH = 'backend/src/data/outline_cache.sqlite'
+
+# Bump when `parse_course_details` changes, so the parsed results stored in the HTTP cache are not reused
+PARSER_VERSION = '1'
+
+
+class CrawlFailure:
+    """
+    A URL that could not be fetched, after all retries.
     """
-    Extract course syllabus and objectives from the given URL asynchronously.
 
-    Args:
-        course_url (str): The URL of the webpage.
-        progress_bar (tqdm): Shared progress bar instance.
+    def __init__(self, url: str, reason: str, attempts: int):
+        self.url = url
+        self.reason = reason
+        self.attempts = attempts
 
-    Returns:
-        dict: A dictionary containing the syllabus and objectives.
+    def __str__(self):
+        return f"CrawlFailure(url={self.url}, reason={self.reason}, attempts={self.attempts})"
+
+
+class FetchedPage:
+    """
+    A successful response: 200 with a body, or 304 Not Modified to a conditional request.
+    """
+
+    def __init__(
+        self,
+        status: int,
+        body: bytes,
+        etag: Optional[str],
+        last_modified: Optional[str],
+        charset: Optional[str] = None,
+    ):
+        self.status = status
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        # The charset of the Content-Type header, the body is decoded with it
+        self.charset = charset
+
+
+class PendingPage:
+    """
+    A page waiting to be parsed, with its charset and the response to store in the cache once it is parsed.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        body: bytes,
+        charset: Optional[str] = None,
+        response: Optional[FetchedPage] = None,
+    ):
+        self.url = url
+        self.body = body
+        self.charset = charset
+        self.response = response
+
+
+class CourseCrawler:
     """
-    async with aiohttp.ClientSession() as session:
+    Crawler of the course outline pages.
+
+    All requests share one pooled session with a per-host connection limit, a fixed number of workers bounds the
+    requests in flight, every request has a timeout and transient errors are retried with jittered exponential
+    backoff. URLs that still fail are recorded and summarized at the end of a crawl instead of silently becoming
+    empty syllabi.
+
+    With an HTTP cache, pages fetched within the cache TTL are not requested at all, older pages are revalidated
+    with conditional requests and the parsed results of unchanged pages are reused. A page that cannot be fetched
+    falls back to its stored copy; it is reported in `stale_pages`, not as a failure.
+
+    Parsing is CPU bound and is kept off the event loop: the fetch workers push the raw pages onto a bounded queue
+    and a pool of parser processes extracts the details with the targeted extractor of `outline_parser`, falling
+    back to BeautifulSoup. The queue bound holds the fetchers back when the parsers cannot keep up. If the pool
+    breaks (e.g. a parser process is killed), the remaining pages are parsed in the event loop.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 16,
+        limit_per_host: int = 8,
+        timeout: float = 20.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        base_url: Optional[str] = None,
+        cache: Optional[HttpCache] = None,
+        parse_workers: int = 2,
+        parse_queue_size: int = 64,
+    ):
+        """
+        Args:
+            max_concurrency (int): Number of workers, i.e. maximum number of requests in flight.
+            limit_per_host (int): Maximum number of open connections per host.
+            timeout (float): Total timeout of a single request in seconds.
+            max_retries (int): Number of retries of a request after a transient error.
+            backoff_base (float): Base delay of the exponential backoff in seconds.
+            backoff_max (float): Maximum delay between two attempts in seconds.
+            base_url (Optional[str]): Scheme and host replacing the ones of the course URLs, e.g. the address of a
+                local stand-in server.
+            cache (Optional[HttpCache]): Persistent cache of the pages and their parsed results.
+            parse_workers (int): Number of parser processes, 0 parses in the event loop.
+            parse_queue_size (int): Maximum number of fetched pages waiting to be parsed.
+        """
+        self.max_concurrency = max_concurrency
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.base_url = base_url
+        self.cache = cache
+        self.parse_workers = parse_workers
+        self.parse_queue_size = parse_queue_size
+        self.failures: List[CrawlFailure] = []
+        # Pages that could not be fetched but were served from the cache
+        self.stale_pages: List[CrawlFailure] = []
+        # Parsed pages that could not be stored in the cache
+        self.cache_write_errors = 0
+        # Set when the parser processes died, the remaining pages are parsed in the event loop
+        self.parse_pool_broken = False
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """
+        Get the delay before the next attempt, "full jitter" exponential backoff.
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def resolve_url(self, url: str) -> str:
+        """
+        Point the URL to the configured base URL, if any.
+        """
+        if not self.base_url:
+            return url
+        base = urlsplit(self.base_url)
+        parts = urlsplit(url)
+        return urlunsplit((base.scheme, base.netloc, parts.path, parts.query, parts.fragment))
+
+    def create_session(self) -> aiohttp.ClientSession:
+        """
+        Create the session shared by all requests of a crawl.
+        """
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, limit_per_host=self.limit_per_host)
+        return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    async def fetch(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Union[FetchedPage, CrawlFailure]:
+        """
+        Fetch a page, retrying transient errors.
+
+        Returns:
+            Union[FetchedPage, CrawlFailure]: The response, or why the page could not be fetched. The caller decides
+            whether it is a failure, e.g. not when a stored copy of the page is served instead.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                async with session.get(self.resolve_url(url), headers=headers) as response:
+                    if response.status in (200, 304):
+                        body = await response.read() if response.status == 200 else b''
+                        return FetchedPage(response.status, body, response.headers.get('ETag'),
+                                           response.headers.get('Last-Modified'), response.charset)
+                    reason = f"HTTP {response.status}"
+                    retryable = response.status in RETRYABLE_STATUS_CODES
+            except asyncio.TimeoutError:
+                reason, retryable = "Timeout", True
+            except aiohttp.ClientError as e:
+                reason, retryable = e.__class__.__name__, True
+
+            if not retryable or attempt > self.max_retries:
+                return CrawlFailure(url, reason, attempt)
+            await asyncio.sleep(self._backoff_delay(attempt - 1))
+
+    def _cached_details(
+        self,
+        page: CachedPage,
+        outcome: str,
+    ) -> Tuple[Optional[Dict[str, str]], Optional[PendingPage]]:
+        """
+        Get the details of a stored page, or the page to parse if its parsed result is not stored.
+        """
+        self.cache.record(outcome, page, parse_hit=page.parsed is not None)
+        if page.parsed is not None:
+            return page.parsed, None
+        return None, PendingPage(page.url, page.body, page.charset)
+
+    async def resolve_page(
+        self,
+        session: aiohttp.ClientSession,
+        course_url: str,
+    ) -> Tuple[Optional[Dict[str, str]], Optional[PendingPage]]:
+        """
+        Fetch or look up the page of a course.
+
+        Returns:
+            The details if they are known without parsing (from the cache, or empty for a failed page), otherwise
+            the page to parse. A page that cannot be fetched is served from the cache if stored, and recorded in
+            `stale_pages` instead of `failures`.
+        """
+        page = self.cache.get(course_url) if self.cache is not None else None
+        if page is not None and self.cache.is_fresh(page):
+            return self._cached_details(page, 'fresh')
+
+        response = await self.fetch(session, course_url, page.conditional_headers() if page is not None else None)
+        if isinstance(response, CrawlFailure):
+            if page is not None:
+                self.stale_pages.append(response)
+                return self._cached_details(page, 'stale')
+            self.failures.append(response)
+            return dict(EMPTY_DETAILS), None
+
+        if page is not None and (response.status == 304
+                                 or (response.body == page.body and response.charset == page.charset)):
+            self.cache.touch(course_url, response.etag, response.last_modified)
+            return self._cached_details(page, 'revalidated' if response.status == 304 else 'unchanged')
+        if response.status == 304:
+            # Not a conditional request, nothing to revalidate
+            self.failures.append(CrawlFailure(course_url, "HTTP 304", 1))
+            return dict(EMPTY_DETAILS), None
+
+        if self.cache is not None:
+            self.cache.record('misses')
+        return None, PendingPage(course_url, response.body, response.charset, response)
+
+    def store_parsed(self, pending: PendingPage, details: Dict[str, str]):
+        """
+        Store the parsed details of a page in the cache, with the page itself if it was downloaded.
+        """
+        if self.cache is None:
+            return
+        if pending.response is not None:
+            self.cache.put(pending.url, pending.body, pending.response.etag, pending.response.last_modified, details,
+                           pending.charset)
+        else:
+            self.cache.put_parsed(pending.url, details)
+
+    async def parse_page(self, pending: PendingPage, executor: Optional[ProcessPoolExecutor]) -> Dict[str, str]:
+        """
+        Parse a page in the parser processes (or in the event loop without them or once they broke) and store it in
+        the cache. A page that cannot be parsed is recorded as a failure, a page that cannot be stored is only
+        counted; this never raises, so a parse worker never dies and leaves the fetchers blocked on a full queue.
+        """
         try:
-            async with session.get(course_url) as response:
-                response.encoding = 'utf-8'
-                if response.status != 200:
-                    return {"syllabus": "", "objectives": ""}
-                html = await response.text()
-                soup = BeautifulSoup(html, 'html.parser')
-
-                # Find Course Syllabus
-                syllabus_tag = soup.find('p', string='課程大綱 Course syllabus')
-                syllabus = syllabus_tag.find_next('td', colspan="12").get_text(strip=True) if syllabus_tag else ""
-
-                # Find Course Objectives
-                objectives_tag = soup.find('p', string='課程目標 Objectives')
-                objectives = objectives_tag.find_next('td', colspan="12").get_text(strip=True) if objectives_tag else ""
-
-                return {"syllabus": syllabus, "objectives": objectives}
-        except aiohttp.ClientError:
-            return {"syllabus": "", "objectives": ""}
+            details = None
+            if executor is not None and not self.parse_pool_broken:
+                try:
+                    details = await asyncio.get_running_loop().run_in_executor(executor, parse_outline_page,
+                                                                               pending.body, pending.charset)
+                except BrokenProcessPool:
+                    if not self.parse_pool_broken:
+                        self.parse_pool_broken = True
+                        print("Warning: The parser processes died, parsing the remaining pages in the event loop")
+            if details is None:
+                details = parse_outline_page(pending.body, pending.charset)
+        except Exception as e:
+            self.failures.append(CrawlFailure(pending.url, f"Parse error ({e.__class__.__name__})", 1))
+            return dict(EMPTY_DETAILS)
+
+        try:
+            self.store_parsed(pending, details)
+        except Exception as e:
+            self.cache_write_errors += 1
+            if self.cache_write_errors == 1:
+                print(f"Warning: Failed to store {pending.url} in the HTTP cache: {str(e)}")
+        return details
+
+    async def extract_course_details(self, session: aiohttp.ClientSession, course_url: str) -> Dict[str, str]:
+        """
+        Extract course syllabus and objectives from the given URL, parsing in the event loop.
+        """
+        details, pending = await self.resolve_page(session, course_url)
+        return details if pending is None else await self.parse_page(pending, None)
+
+    async def crawl(self, urls: List[str], desc: str = "Fetching course details") -> List[Dict[str, str]]:
+        """
+        Extract the details of every URL, in the order of the URLs.
+        """
+        self.failures = []
+        self.stale_pages = []
+        self.cache_write_errors = 0
+        self.parse_pool_broken = False
+        if self.cache is not None:
+            self.cache.reset_stats()
+        results: List[Optional[Dict[str, str]]] = [None] * len(urls)
+        url_queue: asyncio.Queue = asyncio.Queue()
+        for position in range(len(urls)):
+            url_queue.put_nowait(position)
+        parse_queue: asyncio.Queue = asyncio.Queue(maxsize=self.parse_queue_size)
+        # Enough parse tasks in flight to keep every parser process busy
+        num_parse_tasks = max(1, 2 * self.parse_workers)
+
+        executor = None
+        if self.parse_workers > 0 and urls:
+            executor = ProcessPoolExecutor(max_workers=self.parse_workers,
+                                           mp_context=multiprocessing.get_context('spawn'))
+
+        start = time.perf_counter()
+        try:
+            async with self.create_session() as session:
+                with tqdm(total=len(urls), desc=desc) as progress_bar:
+                    async def fetch_worker():
+                        while not url_queue.empty():
+                            position = url_queue.get_nowait()
+                            details, pending = await self.resolve_page(session, urls[position])
+                            if pending is not None:
+                                await parse_queue.put((position, pending))
+                                continue
+                            results[position] = details
+                            progress_bar.update(1)
+
+                    async def parse_worker():
+                        while True:
+                            item = await parse_queue.get()
+                            if item is None:
+                                return
+                            position, pending = item
+                            results[position] = await self.parse_page(pending, executor)
+                            progress_bar.update(1)
+
+                    parse_tasks = [asyncio.create_task(parse_worker()) for _ in range(num_parse_tasks)]
+                    await asyncio.gather(*(fetch_worker() for _ in range(min(self.max_concurrency, len(urls)))))
+                    for _ in parse_tasks:
+                        await parse_queue.put(None)
+                    await asyncio.gather(*parse_tasks)
         finally:
-            # Update the progress bar
-            progress_bar.update(1)
+            if executor is not None:
+                executor.shutdown()
+
+        if self.cache is not None:
+            self.cache.commit()
+
+        self.print_summary(len(urls), time.perf_counter() - start)
+        return results
+
+    def print_summary(self, num_urls: int, seconds: float):
+        """
+        Print the number of fetched pages and the failures of the last crawl.
+        """
+        print(f"Crawled {num_urls - len(self.failures)} of {num_urls} pages in {seconds:.1f}s "
+              f"({num_urls / seconds if seconds else 0.0:.1f} pages/s)")
+        if self.cache is not None:
+            self.cache.print_summary()
+        if self.stale_pages:
+            print(f"Warning: {len(self.stale_pages)} pages could not be fetched and were served from the cache")
+        if self.cache_write_errors:
+            print(f"Warning: {self.cache_write_errors} parsed pages could not be stored in the HTTP cache")
+        if not self.failures:
+            return
+
+        reasons = Counter(failure.reason for failure in self.failures)
+        print(f"Warning: {len(self.failures)} pages failed: "
+              + ", ".join(f"{reason} x{count}" for reason, count in reasons.most_common()))
+        for failure in self.failures[:10]:
+            print(f"  {failure}")
+        if len(self.failures) > 10:
+            print(f"  ... and {len(self.failures) - 10} more")
+
+
+def get_course_crawler() -> CourseCrawler:
+    """
+    Create a crawler configured from the environment:
+        - `OUTLINE_BASE_URL`: Scheme and host serving the outline pages, e.g. a local stand-in.
+        - `CRAWLER_MAX_CONCURRENCY`, `CRAWLER_LIMIT_PER_HOST`, `CRAWLER_TIMEOUT`, `CRAWLER_MAX_RETRIES`.
+        - `CRAWLER_CACHE_PATH`: SQLite file of the HTTP cache, an empty value disables the cache.
+        - `CRAWLER_CACHE_TTL`: Seconds during which a cached page is used without a request.
+        - `CRAWLER_PARSE_WORKERS`: Number of parser processes, 0 parses in the event loop.
+    """
+    cache_path = os.getenv('CRAWLER_CACHE_PATH', DEFAULT_CACHE_PATH)
+    cache = None
+    if cache_path:
+        cache = HttpCache(cache_path, ttl=float(os.getenv('CRAWLER_CACHE_TTL', str(12 * 60 * 60))),
+                          parser_version=PARSER_VERSION)
+    return CourseCrawler(
+        max_concurrency=int(os.getenv('CRAWLER_MAX_CONCURRENCY', '16')),
+        limit_per_host=int(os.getenv('CRAWLER_LIMIT_PER_HOST', '8')),
+        timeout=float(os.getenv('CRAWLER_TIMEOUT', '20')),
+        max_retries=int(os.getenv('CRAWLER_MAX_RETRIES', '3')),
+        base_url=os.getenv('OUTLINE_BASE_URL') or None,
+        cache=cache,
+        # One core is left to the event loop, a single core machine parses in the event loop
+        parse_workers=int(os.getenv('CRAWLER_PARSE_WORKERS', str(min(4, (os.cpu_count() or 1) - 1)))),
+    )
+
 
-async def extend_course_dataframe(courses_df: pd.DataFrame, url_column: str) -> pd.DataFrame:
+async def extend_course_dataframe(
+    courses_df: pd.DataFrame,
+    url_column: str,
+    crawler: Optional[CourseCrawler] = None,
+) -> pd.DataFrame:
     """
     Extend the DataFrame by extracting syllabus and objectives for each URL asynchronously,
     with progress updates.
@@ -50,16 +426,15 @@ async def extend_course_dataframe(courses_df: pd.DataFrame, url_column: str) ->
     Args:
         courses_df (pd.DataFrame): DataFrame containing a column of URLs.
         url_column (str): Name of the column containing URLs.
+        crawler (Optional[CourseCrawler]): The crawler to use, configured from the environment by default.
 
     Returns:
         pd.DataFrame: Updated DataFrame with syllabus and objectives columns.
     """
-    total_tasks = len(courses_df[url_column])
-    with tqdm(total=total_tasks, desc="Fetching course details") as progress_bar:
-        tasks = [extract_course_details(url, progress_bar) for url in courses_df[url_column]]
-        results = await asyncio.gather(*tasks)
+    crawler = crawler or get_course_crawler()
+    results = await crawler.crawl(courses_df[url_column].tolist())
 
-    extracted_df = pd.DataFrame(results)
+    extracted_df = pd.DataFrame(results, columns=list(EMPTY_DETAILS))
     extended_df = pd.concat([courses_df.reset_index(drop=True), extracted_df], axis=1)
     return extended_df
 
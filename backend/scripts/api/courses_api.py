@@ -1,19 +1,242 @@
 import asyncio
+import codecs
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
 
+import aiohttp
+import numpy as np
 import pandas as pd
-import requests
-from typing import List, Dict, Any
 
 from backend.scripts.api.clawer import extend_course_dataframe
 
 BASE_URL = 'https://whats2000.github.io/NSYSUCourseAPI'
 
+# Size of the chunks read from a streamed response
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+async def iter_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """
+    Decode a JSON array incrementally, yielding its items as soon as they are complete.
+
+    Only the undecoded tail of the payload is buffered, so a large `all.json` is never held as one string next to
+    its decoded items.
+
+    Args:
+        chunks (AsyncIterator[bytes]): The UTF-8 encoded payload, in arbitrary chunks.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    position = 0
+    started = False
+    finished = False
+
+    async for chunk in chunks:
+        buffer = buffer[position:] + text_decoder.decode(chunk)
+        position = 0
+        while not finished:
+            # Skip the whitespace and separators between items
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position >= len(buffer):
+                break
+            if not started:
+                if buffer[position] != '[':
+                    raise ValueError("Expected a JSON array")
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                finished = True
+                break
+
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break  # Incomplete item, wait for the next chunk
+            if not isinstance(item, (dict, list)) and (end == len(buffer) or buffer[end] not in ' \t\r\n,]'):
+                break  # A number may continue in the next chunk, e.g. "2." followed by "5"
+            position = end
+            yield item
+
+    if not finished:
+        raise ValueError("Truncated JSON array")
+
+
+def unique_course_rows(course_ids: Sequence[Any]) -> np.ndarray:
+    """
+    Get the positions of the first course of every id.
+    """
+    return np.flatnonzero(~pd.Index(course_ids).duplicated(keep='first'))
+
+
+class NSYSUCourseClient:
+    """
+    Async client of the NSYSU course API on one shared session.
+
+    Version manifests and course lists of several academic years and update times are fetched concurrently,
+    with a bound on the requests in flight, and the large `all.json` payloads are decoded while they stream in.
+
+        async with NSYSUCourseClient() as client:
+            courses_df = await client.get_latest_course_list()
+    """
+
+    def __init__(self, base_url: str = BASE_URL, max_concurrency: int = 8, timeout: float = 120.0):
+        """
+        Args:
+            base_url (str): Base URL of the course API.
+            max_concurrency (int): Maximum number of requests in flight.
+            timeout (float): Total timeout of a single request in seconds.
+        """
+        self.base_url = base_url.rstrip('/')
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def __aenter__(self) -> 'NSYSUCourseClient':
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        self._session = aiohttp.ClientSession(connector=connector,
+                                              timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            raise RuntimeError("NSYSUCourseClient must be used as an async context manager")
+        return self._session
+
+    async def get_json(self, path: str, error_message: str) -> Any:
+        """
+        Fetch a small JSON document.
+        """
+        async with self._semaphore:
+            async with self.session.get(f"{self.base_url}/{path}") as response:
+                if not response.ok:
+                    raise Exception(error_message)
+                return await response.json(content_type=None)
+
+    async def get_available_semesters(self) -> Dict[str, Any]:
+        """
+        Retrieve all available semester lists.
+
+        Returns:
+            A dictionary representing available semesters.
+        """
+        return await self.get_json("version.json", "Failed to fetch available semesters")
+
+    async def get_semester_updates(self, academic_year: str) -> Dict[str, Any]:
+        """
+        Retrieve semester update information for a specific academic year.
+
+        Args:
+            academic_year (str): The academic year.
+
+        Returns:
+            A dictionary representing semester updates.
+        """
+        return await self.get_json(f"{academic_year}/version.json", "Failed to fetch semester updates")
+
+    async def _fetch_courses(self, academic_year: str, update_time: str) -> List[Dict[str, Any]]:
+        """
+        Fetch and stream-decode the `all.json` of an academic year and update time.
+        """
+        async with self._semaphore:
+            async with self.session.get(f"{self.base_url}/{academic_year}/{update_time}/all.json") as response:
+                if not response.ok:
+                    raise Exception("Failed to fetch courses")
+                return [course async for course in iter_json_array(
+                    response.content.iter_chunked(STREAM_CHUNK_SIZE))]
+
+    async def get_courses(self, academic_year: str, update_time: str) -> List[Dict[str, Any]]:
+        """
+        Retrieve all courses for a specified academic year and update time.
+
+        Args:
+            academic_year (str): The academic year.
+            update_time (str): The update time.
+
+        Returns:
+            A list of dictionaries representing courses.
+        """
+        courses = await self._fetch_courses(academic_year, update_time)
+
+        # Remove duplicates based on 'id' field
+        return [courses[row] for row in unique_course_rows([course.get("id") for course in courses])]
+
+    async def get_courses_df(self, academic_year: str, update_time: str) -> pd.DataFrame:
+        """
+        Retrieve all courses for a specified academic year and update time as a DataFrame.
+        """
+        courses_df = pd.DataFrame(await self._fetch_courses(academic_year, update_time))
+        if 'id' not in courses_df.columns:
+            return courses_df
+
+        # Remove duplicates based on 'id' field
+        return courses_df.drop_duplicates(subset='id', keep='first').reset_index(drop=True)
+
+    async def get_semesters_courses(
+        self,
+        academic_years: Sequence[str],
+        update_times: Optional[Sequence[Optional[str]]] = None,
+    ) -> Dict[Tuple[str, str], pd.DataFrame]:
+        """
+        Retrieve the courses of several academic years concurrently.
+
+        Args:
+            academic_years (Sequence[str]): The academic years.
+            update_times (Optional[Sequence[Optional[str]]]): The update time of each academic year, None (or a None
+                entry) fetches the latest update of the year.
+
+        Returns:
+            Dict[Tuple[str, str], pd.DataFrame]: The courses by (academic year, update time), in the given order.
+        """
+        update_times = list(update_times) if update_times is not None else [None] * len(academic_years)
+        if len(update_times) != len(academic_years):
+            raise ValueError(f"Got {len(update_times)} update times for {len(academic_years)} academic years")
+
+        async def resolve(academic_year: str, update_time: Optional[str]) -> str:
+            if update_time is not None:
+                return update_time
+            return (await self.get_semester_updates(academic_year)).get("latest")
+
+        resolved = await asyncio.gather(*(resolve(year, time) for year, time in zip(academic_years, update_times)))
+        frames = await asyncio.gather(*(self.get_courses_df(year, time)
+                                        for year, time in zip(academic_years, resolved)))
+        return {(year, time): frame for year, time, frame in zip(academic_years, resolved, frames)}
+
+    async def get_latest_course_list(self) -> pd.DataFrame:
+        """
+        Retrieve the course list of the latest semester, without the syllabus and objectives.
+
+        Returns:
+            A DataFrame of the courses for the latest semester.
+        """
+        latest_academic_year = (await self.get_available_semesters()).get("latest")
+        return next(iter((await self.get_semesters_courses([latest_academic_year])).values()))
+
 
 class NSYSUCourseAPI:
     """
     API client for retrieving NSYSU course data.
+
+    The synchronous methods are thin wrappers of `NSYSUCourseClient`, they cannot be called from a running event
+    loop, use the client there.
     """
 
+    @staticmethod
+    def _run(method: str, *args) -> Any:
+        async def call():
+            async with NSYSUCourseClient() as client:
+                return await getattr(client, method)(*args)
+
+        return asyncio.run(call())
+
     @staticmethod
     def get_available_semesters() -> Dict[str, Any]:
         """
@@ -22,10 +245,7 @@ class NSYSUCourseAPI:
         Returns:
             A dictionary representing available semesters.
         """
-        response = requests.get(f"{BASE_URL}/version.json")
-        if not response.ok:
-            raise Exception("Failed to fetch available semesters")
-        return response.json()
+        return NSYSUCourseAPI._run('get_available_semesters')
 
     @staticmethod
     def get_semester_updates(academic_year: str) -> Dict[str, Any]:
@@ -38,10 +258,7 @@ class NSYSUCourseAPI:
         Returns:
             A dictionary representing semester updates.
         """
-        response = requests.get(f"{BASE_URL}/{academic_year}/version.json")
-        if not response.ok:
-            raise Exception("Failed to fetch semester updates")
-        return response.json()
+        return NSYSUCourseAPI._run('get_semester_updates', academic_year)
 
     @staticmethod
     def get_courses(academic_year: str, update_time: str) -> List[Dict[str, Any]]:
@@ -55,22 +272,17 @@ class NSYSUCourseAPI:
         Returns:
             A list of dictionaries representing courses.
         """
-        response = requests.get(f"{BASE_URL}/{academic_year}/{update_time}/all.json")
-        if not response.ok:
-            raise Exception("Failed to fetch courses")
+        return NSYSUCourseAPI._run('get_courses', academic_year, update_time)
 
-        courses = response.json()
-        # Remove duplicates based on 'id' field
-        unique_courses = []
-        seen_ids = set()
-
-        for course in courses:
-            course_id = course.get("id")
-            if course_id not in seen_ids:
-                unique_courses.append(course)
-                seen_ids.add(course_id)
+    @staticmethod
+    def get_latest_course_list() -> pd.DataFrame:
+        """
+        Retrieve the course list of the latest semester, without the syllabus and objectives.
 
-        return unique_courses
+        Returns:
+            A DataFrame of the courses for the latest semester.
+        """
+        return NSYSUCourseAPI._run('get_latest_course_list')
 
     @staticmethod
     async def get_latest_courses() -> pd.DataFrame:
@@ -80,13 +292,8 @@ class NSYSUCourseAPI:
         Returns:
             A list of dictionaries representing courses for the latest semester.
         """
-        semesters = NSYSUCourseAPI.get_available_semesters()
-        latest_academic_year = semesters.get("latest")
-
-        updates = NSYSUCourseAPI.get_semester_updates(latest_academic_year)
-        latest_update_time = updates.get("latest")
-
-        courses_df = pd.DataFrame(NSYSUCourseAPI.get_courses(latest_academic_year, latest_update_time))
+        async with NSYSUCourseClient() as client:
+            courses_df = await client.get_latest_course_list()
 
         return await extend_course_dataframe(courses_df, 'url')
 
@@ -0,0 +1,188 @@
+import json
+import sqlite3
+import time
+from typing import Dict, Optional
+
+
+class CachedPage:
+    """
+    A page stored in the HTTP cache, with its charset, its validators and the result parsed from it.
+    """
+
+    __slots__ = ('url', 'body', 'etag', 'last_modified', 'fetched_at', 'parsed', 'charset')
+
+    def __init__(
+        self,
+        url: str,
+        body: bytes,
+        etag: Optional[str],
+        last_modified: Optional[str],
+        fetched_at: float,
+        parsed: Optional[Dict[str, str]],
+        charset: Optional[str] = None,
+    ):
+        self.url = url
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+        self.parsed = parsed
+        self.charset = charset
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """
+        Get the headers of a conditional request revalidating this page.
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class HttpCache:
+    """
+    Persistent HTTP cache of the course outline pages, in a SQLite file.
+
+    Every page is stored by URL with its body and response charset, ETag / Last-Modified validators, fetch time and the result parsed
+    from it. Pages fetched within the TTL are used without a request, older pages are revalidated with a
+    conditional request. The parsed result is kept as long as the body does not change, it is dropped when the
+    parser version changes.
+    """
+
+    def __init__(self, path: str, ttl: float = 12 * 60 * 60, parser_version: str = '1', commit_every: int = 200):
+        """
+        Args:
+            path (str): Path of the SQLite file.
+            ttl (float): Seconds during which a stored page is used without revalidation.
+            parser_version (str): Version of the parser, parsed results of other versions are ignored.
+            commit_every (int): Number of writes between two commits.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.parser_version = parser_version
+        self.commit_every = commit_every
+        self._pending_writes = 0
+
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                parsed TEXT,
+                parser_version TEXT,
+                charset TEXT
+            )
+        """)
+        # Caches written before the charset was stored, their pages are decoded as utf-8
+        columns = {row[1] for row in self.connection.execute('PRAGMA table_info(pages)')}
+        if 'charset' not in columns:
+            self.connection.execute('ALTER TABLE pages ADD COLUMN charset TEXT')
+        self.connection.commit()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {
+            'fresh': 0,  # Used without a request, within the TTL
+            'revalidated': 0,  # Answered with 304 Not Modified
+            'unchanged': 0,  # Downloaded again with the same body
+            'misses': 0,  # New or changed pages
+            'stale': 0,  # Could not be fetched, the stored page is used
+            'bytes_saved': 0,
+            'parse_hits': 0,
+        }
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        row = self.connection.execute(
+            'SELECT body, etag, last_modified, fetched_at, parsed, parser_version, charset FROM pages WHERE url = ?',
+            (url,),
+        ).fetchone()
+        if row is None:
+            return None
+
+        body, etag, last_modified, fetched_at, parsed, parser_version, charset = row
+        parsed = json.loads(parsed) if parsed is not None and parser_version == self.parser_version else None
+        return CachedPage(url, body, etag, last_modified, fetched_at, parsed, charset)
+
+    def is_fresh(self, page: CachedPage) -> bool:
+        return time.time() - page.fetched_at < self.ttl
+
+    def put(self, url: str, body: bytes, etag: Optional[str], last_modified: Optional[str],
+            parsed: Optional[Dict[str, str]], charset: Optional[str] = None):
+        """
+        Store a downloaded page, its response charset and the result parsed from it.
+        """
+        self.connection.execute(
+            'INSERT OR REPLACE INTO pages (url, body, etag, last_modified, fetched_at, parsed, parser_version, '
+            'charset) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (url, body, etag, last_modified, time.time(),
+             json.dumps(parsed, ensure_ascii=False) if parsed is not None else None, self.parser_version, charset),
+        )
+        self._written()
+
+    def put_parsed(self, url: str, parsed: Dict[str, str]):
+        """
+        Store the result parsed from a stored page.
+        """
+        self.connection.execute(
+            'UPDATE pages SET parsed = ?, parser_version = ? WHERE url = ?',
+            (json.dumps(parsed, ensure_ascii=False), self.parser_version, url),
+        )
+        self._written()
+
+    def touch(self, url: str, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        """
+        Mark a stored page as fetched now, after a successful revalidation.
+        """
+        self.connection.execute(
+            'UPDATE pages SET fetched_at = ?, etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified) '
+            'WHERE url = ?',
+            (time.time(), etag, last_modified, url),
+        )
+        self._written()
+
+    def _written(self):
+        self._pending_writes += 1
+        if self._pending_writes >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        self.connection.commit()
+        self._pending_writes = 0
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+    def record(self, outcome: str, page: Optional[CachedPage] = None, parse_hit: bool = False):
+        """
+        Record the outcome of a lookup, and the bytes it did not download.
+        """
+        self.stats[outcome] += 1
+        if outcome in ('fresh', 'revalidated') and page is not None:
+            self.stats['bytes_saved'] += len(page.body)
+        if parse_hit:
+            self.stats['parse_hits'] += 1
+
+    def print_summary(self):
+        """
+        Print the hit rate and the bytes saved since the last reset.
+        """
+        lookups = sum(self.stats[key] for key in ('fresh', 'revalidated', 'unchanged', 'misses', 'stale'))
+        hits = self.stats['fresh'] + self.stats['revalidated']
+        print(f"HTTP cache: {hits}/{lookups} hits ({hits / lookups if lookups else 0.0:.1%}): "
+              f"{self.stats['fresh']} fresh, {self.stats['revalidated']} revalidated, "
+              f"{self.stats['unchanged']} unchanged, {self.stats['misses']} misses, {self.stats['stale']} stale, "
+              f"{self.stats['bytes_saved'] / 1024 / 1024:.1f} MB not downloaded, "
+              f"{self.stats['parse_hits']} pages not parsed again")
+
+    def __len__(self) -> int:
+        return self.connection.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def __str__(self):
+        return f"HttpCache(path={self.path}, pages={len(self)}, ttl={self.ttl})"
@@ -0,0 +1,149 @@
+import codecs
+import html
+import re
+from html.entities import html5
+from typing import Dict, Optional
+
+from bs4 import BeautifulSoup
+
+# Section title (the text of a <p>) -> field, the section content is the next <td colspan="12">
+SECTION_MARKERS = {
+    'syllabus': '課程大綱 Course syllabus',
+    'objectives': '課程目標 Objectives',
+}
+
+# A tag, with quoted attribute values that may contain '>'
+_TAG = r"""(?:"[^"]*"|'[^']*'|[^'">])*"""
+_TAG_PATTERN = re.compile(rf"<[a-zA-Z/!?]{_TAG}>")
+# Comments and script / style content are not part of the document tree searched by BeautifulSoup
+_HIDDEN_PATTERN = re.compile(r"<!--.*?-->|<(script|style)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+_TD_PATTERN = re.compile(rf"<td(?=[\s/>]){_TAG}>", re.IGNORECASE)
+_TD_END_PATTERN = re.compile(r"</td\s*>", re.IGNORECASE)
+_COLSPAN_PATTERN = re.compile(r"""[\s/]colspan\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""", re.IGNORECASE)
+# Content the targeted extractor does not handle like BeautifulSoup: nested cells, unclosed rows, CDATA and
+# strings that `get_text` leaves out (ruby annotations, templates)
+_UNSUPPORTED_CONTENT_PATTERN = re.compile(r"<(?:td|th|tr|table|template|rt|rp)(?=[\s/>])|</(?:tr|table)\b|<!\[",
+                                          re.IGNORECASE)
+_REFERENCE_PATTERN = re.compile(r"&(#?[a-zA-Z0-9]*)(;?)")
+_NUMERIC_REFERENCE_PATTERN = re.compile(r"#(?:[0-9]+|[xX][0-9a-fA-F]+)")
+_MARKER_PATTERNS = {
+    field: re.compile(rf"<p(?=[\s/>]){_TAG}>{re.escape(marker)}</p\s*>", re.IGNORECASE)
+    for field, marker in SECTION_MARKERS.items()
+}
+
+
+def parse_course_details(html_text: str) -> Dict[str, str]:
+    """
+    Extract course syllabus and objectives from an outline page.
+
+    Args:
+        html_text (str): The HTML of the outline page.
+
+    Returns:
+        dict: A dictionary containing the syllabus and objectives.
+    """
+    soup = BeautifulSoup(html_text, 'html.parser')
+
+    # Find Course Syllabus
+    syllabus_tag = soup.find('p', string=SECTION_MARKERS['syllabus'])
+    syllabus = syllabus_tag.find_next('td', colspan="12").get_text(strip=True) if syllabus_tag else ""
+
+    # Find Course Objectives
+    objectives_tag = soup.find('p', string=SECTION_MARKERS['objectives'])
+    objectives = objectives_tag.find_next('td', colspan="12").get_text(strip=True) if objectives_tag else ""
+
+    return {"syllabus": syllabus, "objectives": objectives}
+
+
+def _colspan(td_tag: str) -> Optional[str]:
+    matches = _COLSPAN_PATTERN.findall(td_tag)
+    if not matches:
+        return None
+    # The last duplicate attribute wins, like BeautifulSoup
+    return next(value for value in matches[-1] if value is not None)
+
+
+def _has_ambiguous_reference(content: str) -> bool:
+    """
+    Check for character references that BeautifulSoup and `html.unescape` may resolve differently, e.g. unknown
+    entities or named entities without the semicolon.
+    """
+    for reference in _REFERENCE_PATTERN.finditer(content):
+        name, semicolon = reference.groups()
+        if semicolon:
+            if not (_NUMERIC_REFERENCE_PATTERN.fullmatch(name) or f"{name};" in html5):
+                return True
+        elif html.unescape(reference.group(0)) != reference.group(0):
+            return True
+    return False
+
+
+def _extract_section(document: str, field: str) -> Optional[str]:
+    """
+    Get the text of the cell after the section title, "" if there is no such section, None if unsure.
+    """
+    marker = _MARKER_PATTERNS[field].search(document)
+    if marker is None:
+        # The title may still be wrapped in another tag or spelled with character references, let BeautifulSoup
+        # decide
+        return "" if SECTION_MARKERS[field] not in document and '&#' not in document else None
+    if SECTION_MARKERS[field] in document[:marker.start()]:
+        return None  # An earlier title in another form may match first
+
+    for td in _TD_PATTERN.finditer(document, marker.end()):
+        if _colspan(td.group(0)) != '12':
+            continue
+        end = _TD_END_PATTERN.search(document, td.end())
+        if end is None:
+            return None
+        content = document[td.end():end.start()]
+        if _UNSUPPORTED_CONTENT_PATTERN.search(content) or ('&' in content and _has_ambiguous_reference(content)):
+            return None
+
+        # Same as `get_text(strip=True)`: every string between tags, unescaped and stripped, concatenated
+        strings = (html.unescape(text).strip() for text in _TAG_PATTERN.split(content))
+        return "".join(text for text in strings if text)
+    return None
+
+
+def extract_course_details_fast(html_text: str) -> Optional[Dict[str, str]]:
+    """
+    Extract course syllabus and objectives with targeted regular expressions instead of a full parse.
+
+    Only the section titles and the cells after them are looked at. When a page has a structure the extractor does
+    not handle exactly like `parse_course_details` (e.g. nested cells or a title wrapped in another tag), None is
+    returned and the page should be parsed with BeautifulSoup.
+    """
+    # Hidden content is replaced by an empty tag, so it still separates the strings around it
+    document = _HIDDEN_PATTERN.sub('<!>', html_text)
+    details = {}
+    for field in SECTION_MARKERS:
+        text = _extract_section(document, field)
+        if text is None:
+            return None
+        details[field] = text
+    return details
+
+
+def decode_page(body: bytes, charset: Optional[str] = None) -> str:
+    """
+    Decode a page with the charset of its response, like `aiohttp`'s `response.text()`: utf-8 if the response
+    declares no charset or an unknown one.
+    """
+    encoding = 'utf-8'
+    if charset:
+        try:
+            encoding = codecs.lookup(charset).name
+        except LookupError:
+            pass
+    return body.decode(encoding, errors='replace')
+
+
+def parse_outline_page(body: bytes, charset: Optional[str] = None) -> Dict[str, str]:
+    """
+    Decode and parse an outline page, with the targeted extractor and BeautifulSoup as fallback.
+    This is the function run by the parser processes of the crawler, the page is sent with its response charset.
+    """
+    html_text = decode_page(body, charset)
+    details = extract_course_details_fast(html_text)
+    return details if details is not None else parse_course_details(html_text)
@@ -0,0 +1,93 @@
+import argparse
+import json
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Dict
+
+import pandas as pd
+
+from backend.src.service.catalog_snapshot import parse_list_column, read_catalog_snapshot, write_catalog_snapshot
+
+LIST_COLUMNS = ['classTime', 'tags']
+PROJECTED_COLUMNS = ['id', 'name', 'department', 'teacher', 'tags']
+
+
+def load_variants(courses_path: str, snapshot_dir: str) -> Dict[str, Callable[[], pd.DataFrame]]:
+    """
+    The ways of loading the catalog that are compared.
+    """
+    def csv_parsed() -> pd.DataFrame:
+        courses_df = pd.read_csv(courses_path)
+        for column in LIST_COLUMNS:
+            courses_df[column] = courses_df[column].apply(parse_list_column)
+        return courses_df
+
+    def csv_projected() -> pd.DataFrame:
+        courses_df = pd.read_csv(courses_path, usecols=PROJECTED_COLUMNS)
+        courses_df['tags'] = courses_df['tags'].apply(parse_list_column)
+        return courses_df
+
+    return {
+        'csv': lambda: pd.read_csv(courses_path),
+        'csv + list parsing': csv_parsed,
+        'csv projected + list parsing': csv_projected,
+        'snapshot': lambda: read_catalog_snapshot(snapshot_dir),
+        'snapshot projected': lambda: read_catalog_snapshot(snapshot_dir, PROJECTED_COLUMNS),
+    }
+
+
+def measure_variant(courses_path: str, snapshot_dir: str, variant: str, repeat: int) -> Dict[str, float]:
+    """
+    Load the catalog in this process and report the load times and the peak RSS.
+    """
+    load = load_variants(courses_path, snapshot_dir)[variant]
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings = []
+    courses_df = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        courses_df = load()
+        timings.append(time.perf_counter() - start)
+    return {
+        'first_ms': timings[0] * 1000,
+        'median_ms': statistics.median(timings) * 1000,
+        'peak_rss_mb': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss) / 1024,
+        'frame_mb': courses_df.memory_usage(deep=True).sum() / 1024 / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare loading the catalog from the CSV and from the snapshot.')
+    parser.add_argument('--courses', default='backend/src/data/courses.csv')
+    parser.add_argument('--snapshot-dir', default='/tmp/courses_snapshot_benchmark',
+                        help='Directory the snapshot of the CSV is written to.')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--variant', default='', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(measure_variant(args.courses, args.snapshot_dir, args.variant, args.repeat)))
+        return
+
+    start = time.perf_counter()
+    write_catalog_snapshot(pd.read_csv(args.courses), args.snapshot_dir, None)
+    print(f"Snapshot of {args.courses} written to {args.snapshot_dir} in {time.perf_counter() - start:.2f} s")
+
+    # Every variant runs in a fresh interpreter, so its peak RSS is not hidden by an earlier one
+    print(f"{'variant':<30} {'first':>10} {'median':>10} {'RSS growth':>11} {'frame':>10}")
+    for variant in load_variants(args.courses, args.snapshot_dir):
+        output = subprocess.run(
+            [sys.executable, '-m', 'backend.scripts.benchmarks.benchmark_catalog_snapshot', '--courses', args.courses,
+             '--snapshot-dir', args.snapshot_dir, '--repeat', str(args.repeat), '--variant', variant],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{variant:<30} {result['first_ms']:>7.1f} ms {result['median_ms']:>7.1f} ms "
+              f"{result['peak_rss_mb']:>8.1f} MB {result['frame_mb']:>7.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import argparse
+import statistics
+import time
+
+import numpy as np
+import torch
+
+from backend.scripts.benchmarks.verify_cross_encoder_scores import legacy_scores
+from backend.src.service.course_catalog import get_course_catalog
+from backend.src.service.relative_search import CourseReranker
+
+TEST_QUERIES = [
+    {'keywords': '機器學習 深度學習', 'department': '資工系', 'teacher': '', 'grade': '', 'program': ''},
+    {'keywords': '英文 寫作', 'department': '', 'teacher': '', 'grade': '1', 'program': ''},
+    {'keywords': '財務 管理', 'department': '財管系', 'teacher': '', 'grade': '', 'program': ''},
+]
+
+
+def padding_efficiency(reranker: CourseReranker, catalog, query: dict, rows, batch_size: int,
+                       max_batch_tokens) -> float:
+    """
+    Get the fraction of real (non-padding) tokens over all tokens fed to the model.
+    """
+    course_inputs = reranker.get_course_inputs(catalog)
+    course_lengths = course_inputs.lengths if rows is None else [course_inputs.lengths[row] for row in rows]
+    combined_query = " ".join(map(str, query.values())).strip()
+    query_length = len(reranker.reranker_model.tokenizer(combined_query, add_special_tokens=False)['input_ids'])
+
+    pair_lengths = reranker.get_pair_lengths(query_length, course_lengths)
+    batches = reranker.build_batches(query_length, course_lengths, batch_size, max_batch_tokens)
+    padded_tokens = sum(len(batch) * pair_lengths[batch].max() for batch in batches)
+    return pair_lengths.sum() / padded_tokens if padded_tokens else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the cross-encoder batching strategies.')
+    parser.add_argument('--model', default='BAAI/bge-reranker-base', help='Cross-encoder model name or path.')
+    parser.add_argument('--courses', type=int, default=512,
+                        help='Number of randomly sampled courses scored per query. 0 scores the whole catalog.')
+    parser.add_argument('--max-batch-tokens', type=int, default=16384)
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+
+    catalog = get_course_catalog().catalog
+    reranker = CourseReranker(args.model)
+    reranker.get_course_inputs(catalog)  # Tokenize the catalog outside the timings
+
+    rng = np.random.default_rng(0)
+    rows = None if args.courses <= 0 else np.sort(rng.choice(len(catalog), args.courses, replace=False))
+    num_pairs = len(catalog) if rows is None else len(rows)
+
+    strategies = [
+        ('baseline (CrossEncoder.predict)', None),
+        ('before (32 rows, catalog order)', dict(batch_size=32, max_batch_tokens=None)),
+        (f'after ({args.max_batch_tokens} token budget)',
+         dict(batch_size=128, max_batch_tokens=args.max_batch_tokens)),
+    ]
+    print(f"Scoring {num_pairs} pairs per query, {len(TEST_QUERIES)} queries "
+          f"(device: {reranker.device}, torch threads: {torch.get_num_threads()})")
+
+    results = {}
+    for name, kwargs in strategies:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            if kwargs is None:
+                # The combined texts are rebuilt and every pair is tokenized per query, as before the course
+                # inputs were pre-tokenized
+                scores = [legacy_scores(reranker, catalog, query, rows) for query in TEST_QUERIES]
+            else:
+                scores = [reranker.score_courses(query, catalog, row_ids=rows, **kwargs).scores
+                          for query in TEST_QUERIES]
+            timings.append(time.perf_counter() - start)
+        results[name] = scores
+
+        # CrossEncoder.predict pads its batches of 32 pairs in catalog order as well
+        batch_kwargs = kwargs or dict(batch_size=32, max_batch_tokens=None)
+        efficiency = statistics.mean(
+            padding_efficiency(reranker, catalog, query, rows, batch_kwargs['batch_size'],
+                               batch_kwargs['max_batch_tokens'])
+            for query in TEST_QUERIES
+        )
+        seconds = statistics.median(timings)
+        print(f"{name:<34} {seconds:8.2f} s, {num_pairs * len(TEST_QUERIES) / seconds:8.1f} pairs/s, "
+              f"padding efficiency {efficiency:.1%}")
+
+    baseline_name, baseline = next(iter(results.items()))
+    for name, scores in list(results.items())[1:]:
+        max_diff = max(float(np.abs(a - b).max()) for a, b in zip(baseline, scores))
+        same_top10 = all(
+            np.array_equal(np.argsort(-a, kind='stable')[:10], np.argsort(-b, kind='stable')[:10])
+            for a, b in zip(baseline, scores)
+        )
+        print(f"{name:<34} max abs score difference to the baseline: {max_diff:.2e}, same top-10: {same_top10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import argparse
+import os
+import statistics
+import time
+from typing import Callable, Dict, List
+
+import torch
+import torch.nn.functional as F
+from sentence_transformers import util
+
+from backend.src.service.embedding_store import EmbeddingStore, normalize_rows, quantize_int8
+from backend.src.service.relative_search_bi_encoder import (
+    FactorizedEmbeddings, FusedFieldMatrix, QuantizedEmbeddings, build_field_matrix, score_field_matrix,
+)
+
+FIELDS = ['name', 'description', 'department', 'objectives', 'syllabus', 'tags', 'teacher']
+FACTORIZED_FIELDS = ['department', 'teacher', 'tags']
+KEYWORDS_WEIGHTS = {'name': 0.4, 'description': 0.2, 'objectives': 0.15, 'syllabus': 0.1, 'tags': 0.15}
+QUERY_FIELD_WEIGHTS = {
+    'keywords': KEYWORDS_WEIGHTS,
+    'department': {'department': 1.0},
+    'teacher': {'teacher': 1.0},
+}
+
+
+def legacy_score(
+    field_embeddings: Dict[str, torch.Tensor],
+    query_embeddings: Dict[str, torch.Tensor],
+) -> torch.Tensor:
+    """
+    The per-field scoring loop used before the fused field matrix.
+    """
+    relevance_scores = torch.zeros(next(iter(field_embeddings.values())).shape[0])
+    for query_field, query_embedding in query_embeddings.items():
+        for field, weight in QUERY_FIELD_WEIGHTS[query_field].items():
+            field_scores = util.cos_sim(query_embedding, field_embeddings[field])
+            relevance_scores += weight * field_scores.squeeze()
+    return relevance_scores
+
+
+def time_per_call(fn: Callable[[], torch.Tensor], repeat: int) -> List[float]:
+    fn()  # Warm up
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def benchmark_factorized(num_courses: int, dim: int, num_values: int, repeat: int):
+    """
+    Compare scoring the low-cardinality fields row by row against scoring their unique values.
+    """
+    values = [F.normalize(torch.randn(num_values, dim), dim=-1).half() for _ in FACTORIZED_FIELDS]
+    indices = [torch.randint(num_values, (num_courses,)) for _ in FACTORIZED_FIELDS]
+    dense_fields = [field_values[index] for field_values, index in zip(values, indices)]
+    factorized_fields = [FactorizedEmbeddings(field_values, index) for field_values, index in zip(values, indices)]
+    query_matrix = torch.randn(len(FACTORIZED_FIELDS), dim)
+    weight_matrix = torch.eye(len(FACTORIZED_FIELDS))
+
+    dense_scores = score_field_matrix(dense_fields, query_matrix, weight_matrix)
+    factorized_scores = score_field_matrix(factorized_fields, query_matrix, weight_matrix)
+    print(f"\nScoring {', '.join(FACTORIZED_FIELDS)} with {num_values} unique values each against {num_courses} "
+          f"courses, max abs score difference: {(dense_scores - factorized_scores).abs().max().item():.2e}")
+    for name, fn in [
+        ('dense rows', lambda: score_field_matrix(dense_fields, query_matrix, weight_matrix)),
+        ('factorized values', lambda: score_field_matrix(factorized_fields, query_matrix, weight_matrix)),
+    ]:
+        timings = time_per_call(fn, repeat)
+        print(f"{name:<28} median {statistics.median(timings) * 1000:.3f} ms, "
+              f"mean {statistics.mean(timings) * 1000:.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmark of the per-query field scoring.')
+    parser.add_argument('--embeddings-dir', default='backend/src/data/field_embeddings',
+                        help='Embedding store to score against. Random embeddings are used if missing.')
+    parser.add_argument('--courses', type=int, default=6700, help='Number of courses of the random embeddings.')
+    parser.add_argument('--dim', type=int, default=384, help='Dimension of the random embeddings.')
+    parser.add_argument('--values', type=int, default=300,
+                        help='Number of unique values of each low-cardinality field.')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    if os.path.exists(args.embeddings_dir):
+        store = EmbeddingStore(args.embeddings_dir)
+        print(f"Using embeddings from {store}")
+        field_embeddings = {field: torch.from_numpy(store.float_embeddings(field, expand=True))
+                            for field in store.field_names}
+    else:
+        print(f"Using random embeddings ({args.courses} courses, dim {args.dim})")
+        field_embeddings = {field: torch.randn(args.courses, args.dim) for field in FIELDS}
+
+    num_courses, dim = next(iter(field_embeddings.values())).shape
+    query_embeddings = {query_field: torch.randn(dim) for query_field in QUERY_FIELD_WEIGHTS}
+
+    field_names = list(field_embeddings.keys())
+    field_index = {field: i for i, field in enumerate(field_names)}
+    # All fields fused into one [courses x fields x dim] float32 tensor, scored with a single matmul
+    fused_matrix = FusedFieldMatrix(build_field_matrix(field_embeddings, field_names), range(len(field_names)))
+    no_fields = [None] * len(field_names)
+    # The same float32 embeddings scored with one matrix-vector product per field
+    float32_fields = [fused_matrix.matrix[:, field] for field in range(len(field_names))]
+    weight_matrix = torch.zeros(len(query_embeddings), len(field_names))
+    for row, query_field in enumerate(query_embeddings):
+        for field, weight in QUERY_FIELD_WEIGHTS[query_field].items():
+            weight_matrix[row, field_index[field]] += weight
+    query_matrix = torch.stack(list(query_embeddings.values()))
+    # Per-field float16 tensors, as scored from a memory-mapped embedding store
+    store_fields = [torch.from_numpy(normalize_rows(field_embeddings[field].numpy()).astype('float16'))
+                    for field in field_names]
+    # Per-field int8 values and scales, scored without dequantizing them
+    int8_fields = []
+    for field in field_names:
+        values, scales = quantize_int8(normalize_rows(field_embeddings[field].numpy()))
+        int8_fields.append(QuantizedEmbeddings(torch.from_numpy(values), torch.from_numpy(scales)))
+
+    legacy_scores = legacy_score(field_embeddings, query_embeddings)
+    fused_scores = score_field_matrix(no_fields, query_matrix, weight_matrix, fused_matrix)
+    store_scores = score_field_matrix(store_fields, query_matrix, weight_matrix)
+    int8_scores = score_field_matrix(int8_fields, query_matrix, weight_matrix)
+    print(f"Max abs score difference: {(legacy_scores - fused_scores).abs().max().item():.2e} (fused), "
+          f"{(legacy_scores - store_scores).abs().max().item():.2e} (float16 store), "
+          f"{(legacy_scores - int8_scores).abs().max().item():.2e} (int8 store)")
+
+    print(f"Scoring {len(query_embeddings)} query fields against {num_courses} courses "
+          f"(torch threads: {torch.get_num_threads()})")
+    for name, fn in [
+        ('before (per-field cos_sim)', lambda: legacy_score(field_embeddings, query_embeddings)),
+        ('fused float32', lambda: score_field_matrix(no_fields, query_matrix, weight_matrix, fused_matrix)),
+        ('float32 per field', lambda: score_field_matrix(float32_fields, query_matrix, weight_matrix)),
+        ('float16 store', lambda: score_field_matrix(store_fields, query_matrix, weight_matrix)),
+        ('int8 store', lambda: score_field_matrix(int8_fields, query_matrix, weight_matrix)),
+    ]:
+        timings = time_per_call(fn, args.repeat)
+        print(f"{name:<28} median {statistics.median(timings) * 1000:.3f} ms, "
+              f"mean {statistics.mean(timings) * 1000:.3f} ms")
+
+    benchmark_factorized(num_courses, dim, args.values, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
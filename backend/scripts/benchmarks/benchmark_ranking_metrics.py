@@ -0,0 +1,117 @@
+import argparse
+import time
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from backend.src.service.ranking_metrics import (
+    bootstrap_confidence_intervals, build_ranking_matrix, build_relevance_matrix, compute_ranking_metrics,
+)
+from backend.src.types.course_catalog import CourseCatalog
+
+K_VALUES = [5, 10, 20]
+
+
+def legacy_query_metrics(ground_truth: set, ranked_course_ids: List[str], k_values: List[int]) -> Dict[str, float]:
+    """
+    The per-query Hit@K and AP loop `evaluate.py` used before the vectorized metrics.
+    """
+    relevance = [1 if course_id in ground_truth else 0 for course_id in ranked_course_ids]
+    query_metrics = {f"Hit@{k}": 1 if sum(relevance[:k]) > 0 else 0 for k in k_values}
+    if len(ground_truth) > 0:
+        precision_values = []
+        num_relevant_retrieved = 0
+        for rank, rel in enumerate(relevance, start=1):
+            if rel == 1:
+                num_relevant_retrieved += 1
+                precision_values.append(num_relevant_retrieved / rank)
+        query_metrics["AP"] = np.mean(precision_values) if precision_values else 0.0
+    else:
+        query_metrics["AP"] = 0.0
+    return query_metrics
+
+
+def synthetic_rankings(
+    relevant_rows: List[np.ndarray],
+    num_courses: int,
+    signal: float,
+    keep: float,
+    rng: np.random.Generator,
+) -> List[np.ndarray]:
+    """
+    Rank the catalog by random scores, with a bonus of `signal` for the relevant courses. Only a `keep` fraction
+    of the catalog is ranked, like the candidates left by the filters of a structured query.
+    """
+    rankings = []
+    for rows in relevant_rows:
+        scores = rng.standard_normal(num_courses)
+        scores[rows] += signal
+        ranking = np.argsort(-scores, kind='stable')
+        if keep < 1.0:
+            ranking = ranking[rng.random(num_courses)[ranking] < keep]
+        rankings.append(ranking)
+    return rankings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare the per-query metrics loop with the vectorized ranking metrics on synthetic rankings '
+                    'of the evaluation set, and check that Hit@K and AP are identical.')
+    parser.add_argument('--courses', default='backend/src/data/courses.csv')
+    parser.add_argument('--ground-truth', default='backend/src/data/query_target_label_with_tags.csv')
+    parser.add_argument('--repeat-queries', type=int, default=1,
+                        help='Repeat the evaluation set to measure larger query sets.')
+    parser.add_argument('--variants', type=int, default=4, help='Number of synthetic rankers.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    courses_df = pd.read_csv(args.courses, usecols=['id'])
+    catalog = CourseCatalog.from_dataframe(courses_df)
+    ground_truth_df = pd.read_csv(args.ground_truth, converters={'relative_courses_id': eval})
+    ground_truths = [set(ids) for ids in ground_truth_df['relative_courses_id']] * args.repeat_queries
+    relevant_rows = [catalog.rows_of(ground_truth) for ground_truth in ground_truths]
+    relevant_rows_in_catalog = [rows[rows >= 0] for rows in relevant_rows]
+    num_relevant = np.array([len(ground_truth) for ground_truth in ground_truths])
+    print(f"{len(ground_truths)} queries, {len(catalog)} courses, {args.variants} rankers")
+
+    rng = np.random.default_rng(args.seed)
+    # Rankers from random to informative, ranking the full catalog or filtered candidates
+    settings = [(signal, keep) for signal in (0.0, 1.5, 3.0, 6.0) for keep in (1.0, 0.3)][:args.variants]
+
+    # The relevance matrix is built once and shared by every ranker
+    start = time.perf_counter()
+    relevance = build_relevance_matrix(relevant_rows, len(catalog))
+    vectorized_time = time.perf_counter() - start
+    legacy_time = 0.0
+    for signal, keep in settings:
+        rankings = synthetic_rankings(relevant_rows_in_catalog, len(catalog), signal, keep, rng)
+        ranked_ids = [catalog.ids_of(ranking) for ranking in rankings]
+
+        start = time.perf_counter()
+        legacy = pd.DataFrame([legacy_query_metrics(ground_truth, ids, K_VALUES)
+                               for ground_truth, ids in zip(ground_truths, ranked_ids)])
+        legacy_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        metrics = compute_ranking_metrics(build_ranking_matrix(rankings), relevance, K_VALUES, num_relevant)
+        vectorized_time += time.perf_counter() - start
+
+        mismatches = {column: int((legacy[column].to_numpy() != metrics[column]).sum()) for column in legacy.columns}
+        print(f"signal={signal} keep={keep}: MAP {metrics['AP'].mean():.6f}, MRR {metrics['RR'].mean():.6f}, "
+              f"nDCG@10 {metrics['nDCG@10'].mean():.6f}, mismatches {mismatches}")
+        if any(mismatches.values()):
+            raise SystemExit('Error: The vectorized metrics differ from the per-query loop')
+
+    start = time.perf_counter()
+    intervals = bootstrap_confidence_intervals(pd.DataFrame(metrics))
+    bootstrap_time = time.perf_counter() - start
+
+    print(f"Per-query loop:     {legacy_time * 1000:>9.1f} ms")
+    print(f"Vectorized metrics: {vectorized_time * 1000:>9.1f} ms ({legacy_time / vectorized_time:.1f}x)")
+    print(f"Bootstrap CIs of the last ranker ({bootstrap_time * 1000:.1f} ms):")
+    print(intervals.to_string(float_format=lambda value: f"{value:.4f}"))
+
+
+if __name__ == '__main__':
+    main()
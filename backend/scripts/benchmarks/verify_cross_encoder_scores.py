@@ -0,0 +1,103 @@
+import argparse
+import sys
+import time
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from backend.src.service.course_catalog import get_course_catalog
+from backend.src.service.relative_search import CourseReranker
+from backend.src.types.course_catalog import CourseCatalog
+
+TEST_QUERIES = [
+    {'teacher': '羅佩琪'},
+    {'keywords': '機器學習 深度學習', 'department': '資工系', 'teacher': '', 'grade': '', 'program': ''},
+    {'keywords': '英文 寫作', 'department': '', 'teacher': '', 'grade': '1', 'program': ''},
+    {'keywords': '財務 管理', 'department': '財管系', 'teacher': '', 'grade': '', 'program': ''},
+    {'keywords': '程式設計 ' * 200, 'department': '', 'teacher': '', 'grade': '', 'program': ''},
+]
+
+# Accepted absolute score difference to `CrossEncoder.predict` with the token budget batching. The pairs are
+# padded to other lengths than in the batches of `predict`, which only changes the order of the floating point
+# sums, the activation keeps the scores in [0, 1].
+TOKEN_BUDGET_TOLERANCE = 1e-5
+
+
+def legacy_scores(reranker: CourseReranker, catalog: CourseCatalog, search_query: Dict[str, str],
+                  rows: Optional[np.ndarray], batch_size: int = 256) -> np.ndarray:
+    """
+    The scoring `CourseReranker.score_courses` used before the course inputs were pre-tokenized: the combined text
+    is rebuilt from the catalog columns and every pair is tokenized and scored by `CrossEncoder.predict`.
+    """
+    columns = ['name', 'teacher', 'description', 'department', 'objectives', 'syllabus']
+    courses_df = pd.DataFrame({column: catalog[column] for column in columns})
+    if rows is not None:
+        courses_df = courses_df.iloc[rows]
+    combined_query = " ".join(map(str, search_query.values()))
+    combined_text = (
+        courses_df['name'].fillna('') + " " +
+        courses_df['teacher'].fillna('') + " " +
+        courses_df['description'].fillna('') + " " +
+        courses_df['department'].fillna('') + " " +
+        courses_df['objectives'].fillna('') + " " +
+        courses_df['syllabus'].fillna('')
+    )
+    pairs = [(combined_query, text) for text in combined_text.tolist()]
+    relevance_scores = []
+    for i in range(0, len(pairs), batch_size):
+        relevance_scores.extend(reranker.reranker_model.predict(pairs[i:i + batch_size], show_progress_bar=False))
+    return np.asarray(relevance_scores, dtype=np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check the scores of the cross-encoder reranker against CrossEncoder.predict on the catalog: '
+                    'identical with fixed batches, within the accepted tolerance with the token budget batching.')
+    parser.add_argument('--model', default='BAAI/bge-reranker-base', help='Cross-encoder model name or path.')
+    parser.add_argument('--courses', type=int, default=0,
+                        help='Number of randomly sampled courses scored per query. 0 scores the whole catalog.')
+    parser.add_argument('--max-batch-tokens', type=int, default=16384)
+    args = parser.parse_args()
+
+    catalog = get_course_catalog().catalog
+    reranker = CourseReranker(args.model)
+    rng = np.random.default_rng(0)
+    rows = None if args.courses <= 0 else np.sort(rng.choice(len(catalog), args.courses, replace=False))
+    print(f"Scoring {len(catalog) if rows is None else len(rows)} courses per query, {len(TEST_QUERIES)} queries")
+
+    arms = [
+        ('fixed batches (32 rows, catalog order)', dict(batch_size=32, max_batch_tokens=None), 0.0),
+        (f'token budget ({args.max_batch_tokens} tokens)', dict(max_batch_tokens=args.max_batch_tokens),
+         TOKEN_BUDGET_TOLERANCE),
+    ]
+    failed = False
+    seconds = {name: 0.0 for name in ['CrossEncoder.predict'] + [name for name, _, _ in arms]}
+    max_diffs = {name: 0.0 for name, _, _ in arms}
+    different_top10 = {name: 0 for name, _, _ in arms}
+    for query in TEST_QUERIES:
+        start = time.perf_counter()
+        expected = legacy_scores(reranker, catalog, query, rows)
+        seconds['CrossEncoder.predict'] += time.perf_counter() - start
+        for name, kwargs, _ in arms:
+            start = time.perf_counter()
+            scores = reranker.score_courses(query, catalog, row_ids=rows, **kwargs).scores
+            seconds[name] += time.perf_counter() - start
+            max_diffs[name] = max(max_diffs[name], float(np.abs(scores - expected).max()))
+            different_top10[name] += not np.array_equal(np.argsort(-scores, kind='stable')[:10],
+                                                         np.argsort(-expected, kind='stable')[:10])
+
+    print(f"{'CrossEncoder.predict':<40} {seconds['CrossEncoder.predict']:8.2f} s")
+    for name, _, tolerance in arms:
+        print(f"{name:<40} {seconds[name]:8.2f} s, max abs difference {max_diffs[name]:.2e} "
+              f"(accepted {tolerance:.0e}), {different_top10[name]} queries with another top-10")
+        if max_diffs[name] > tolerance:
+            print(f"Error: the scores of {name} differ from CrossEncoder.predict by more than {tolerance:.0e}")
+            failed = True
+    if failed:
+        sys.exit(1)
+    print("All scores match CrossEncoder.predict")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+from backend.scripts.api.clawer import DEFAULT_CACHE_PATH
+from backend.scripts.api.http_cache import HttpCache
+from backend.scripts.api.outline_parser import (
+    decode_page, extract_course_details_fast, parse_course_details, parse_outline_page,
+)
+
+# Outline pages kept with the repository, see the description of its index
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'outline_pages')
+INDEX_FILE = 'index.json'
+
+
+class SavedPage(NamedTuple):
+    body: bytes
+    charset: Optional[str]
+    # Syllabus and objectives of the BeautifulSoup parser, recorded when the page was saved, None if not recorded
+    expected: Optional[Dict[str, str]]
+
+
+def soup_details(body: bytes, charset: Optional[str] = None) -> Optional[Dict[str, str]]:
+    """
+    Parse a page with the BeautifulSoup parser only, the reference the crawler's parser is checked against.
+    None if it cannot parse the page (a section title without a content cell).
+    """
+    try:
+        return parse_course_details(decode_page(body, charset))
+    except AttributeError:
+        return None
+
+
+def load_pages_dir(pages_dir: str) -> Dict[str, SavedPage]:
+    """
+    Load the `.html` pages of a directory. The charset and expected details of each page are read from its
+    `index.json` when there is one, otherwise the pages are decoded as utf-8.
+    """
+    index_path = os.path.join(pages_dir, INDEX_FILE)
+    if os.path.exists(index_path):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)['pages']
+    else:
+        entries = [{'file': os.path.basename(path)} for path in sorted(glob.glob(os.path.join(pages_dir, '*.html')))]
+
+    corpus = {}
+    for entry in entries:
+        path = os.path.join(pages_dir, entry['file'])
+        with open(path, 'rb') as f:
+            corpus[path] = SavedPage(f.read(), entry.get('charset'), entry.get('expected'))
+    return corpus
+
+
+def load_corpus(cache_path: str, pages_dir: str) -> Dict[str, SavedPage]:
+    """
+    Load the saved outline pages with their response charset: the bodies stored in the crawler's HTTP cache and the
+    pages of a directory.
+    """
+    corpus = {}
+    if cache_path and os.path.exists(cache_path):
+        cache = HttpCache(cache_path)
+        corpus.update((url, SavedPage(body, charset, None)) for url, body, charset
+                      in cache.connection.execute('SELECT url, body, charset FROM pages').fetchall())
+        cache.close()
+    if pages_dir:
+        corpus.update(load_pages_dir(pages_dir))
+    return corpus
+
+
+def save_corpus(corpus: Dict[str, SavedPage], output_dir: str):
+    """
+    Save the pages as numbered `.html` files with an `index.json` of their source, charset and details parsed by
+    BeautifulSoup, e.g. to add the pages of a crawl to the corpus. Pages already in the index are kept.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    index_path = os.path.join(output_dir, INDEX_FILE)
+    index = {'description': '', 'pages': []}
+    if os.path.exists(index_path):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    saved = {entry.get('source') for entry in index['pages']}
+    saved.update(os.path.join(output_dir, entry['file']) for entry in index['pages'])
+
+    number = len(index['pages'])
+    for source, page in corpus.items():
+        if source in saved:
+            continue
+        file_name = f"{number:03d}.html"
+        with open(os.path.join(output_dir, file_name), 'wb') as f:
+            f.write(page.body)
+        index['pages'].append({
+            'file': file_name,
+            'source': source,
+            'charset': page.charset,
+            'expected': soup_details(page.body, page.charset),
+        })
+        number += 1
+
+    with open(index_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+    os.replace(index_path + '.tmp', index_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check the targeted outline extractor against the BeautifulSoup parser on saved pages.')
+    parser.add_argument('--pages', default=CORPUS_DIR, help='Directory of saved .html outline pages, empty to skip.')
+    parser.add_argument('--cache', default='',
+                        help=f'HTTP cache of the crawler to check as well, e.g. {DEFAULT_CACHE_PATH}.')
+    parser.add_argument('--save', default='', help='Directory to add the loaded pages to, e.g. the corpus.')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.cache, args.pages)
+    if not corpus:
+        print("No saved pages found, pass --pages or --cache")
+        sys.exit(1)
+    if args.save:
+        save_corpus(corpus, args.save)
+
+    texts = [decode_page(page.body, page.charset) for page in corpus.values()]
+    mismatches: List[str] = []
+    # Pages the crawler's parser does not parse to the BeautifulSoup details recorded when they were saved, e.g.
+    # after a change of the decoding or of the BeautifulSoup version
+    changed = [key for key, page in corpus.items()
+               if page.expected is not None and parse_outline_page(page.body, page.charset) != page.expected]
+    fast_pages = 0
+    fast_seconds = soup_seconds = 0.0
+    for key, text in zip(corpus, texts):
+        start = time.perf_counter()
+        try:
+            expected = parse_course_details(text)
+        except AttributeError:
+            expected = None  # A section title without a content cell
+        soup_seconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        details = extract_course_details_fast(text)
+        fast_seconds += time.perf_counter() - start
+
+        if details is not None:
+            fast_pages += 1
+            if details != expected:
+                mismatches.append(key)
+
+    print(f"{len(corpus)} pages, {fast_pages} ({fast_pages / len(corpus):.1%}) handled by the targeted extractor, "
+          f"the others fall back to BeautifulSoup")
+    print(f"BeautifulSoup: {soup_seconds / len(corpus) * 1000:.3f} ms/page, "
+          f"targeted extractor: {fast_seconds / len(corpus) * 1000:.3f} ms/page")
+    if changed:
+        print(f"Error: {len(changed)} pages are not parsed to the BeautifulSoup details recorded when they were "
+              f"saved:")
+        for key in changed[:10]:
+            print(f"  {key}")
+    if mismatches:
+        print(f"Error: {len(mismatches)} pages differ from the BeautifulSoup parser:")
+        for key in mismatches[:10]:
+            print(f"  {key}")
+    if changed or mismatches:
+        sys.exit(1)
+    print("All pages match the BeautifulSoup parser and the recorded details")
+
+
+if __name__ == '__main__':
+    main()
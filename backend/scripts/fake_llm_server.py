@@ -0,0 +1,133 @@
+"""
+A local stand-in for the Groq chat completion API.
+
+It speaks the OpenAI compatible protocol used by the Groq SDK, so the backend can be tested or benchmarked
+without network access or API quota:
+
+    python backend/scripts/fake_llm_server.py --port 8001 --token-delay 0.05
+    LLM_BASE_URL=http://127.0.0.1:8001 GROQ_API_KEY=fake python backend/app.py
+
+Requests with `tools` are answered with a `course_query` tool call built from the last user message, and all
+other requests are answered with a canned text, streamed chunk by chunk when `stream` is set.
+"""
+
+import argparse
+import json
+import time
+import uuid
+from typing import Dict, Iterator, List
+
+from flask import Flask, request, jsonify, Response
+
+app = Flask(__name__)
+
+CANNED_RESPONSE = "這是一個來自本地模擬伺服器的回應。根據檢索結果，以下課程可能符合你的需求，請參考課程大綱後再做選擇。"
+TOKEN_DELAY = 0.0
+FIRST_TOKEN_DELAY = 0.0
+
+
+def split_into_tokens(text: str, size: int = 4) -> List[str]:
+    """
+    Split the text into fixed size chunks to imitate model tokens.
+    """
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def build_usage(messages: List[Dict], completion: str) -> Dict[str, int]:
+    """
+    Build a rough token usage report, counting one token per four characters.
+    """
+    prompt_tokens = sum(len(str(msg.get('content', ''))) for msg in messages) // 4
+    completion_tokens = len(split_into_tokens(completion))
+    return {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'total_tokens': prompt_tokens + completion_tokens,
+    }
+
+
+def build_tool_call(messages: List[Dict]) -> Dict:
+    """
+    Build a `course_query` tool call with the last user message as keywords.
+    """
+    user_messages = [msg['content'] for msg in messages if msg.get('role') == 'user']
+    arguments = {'keywords': user_messages[-1] if user_messages else 'course recommendation'}
+    return {
+        'id': f"call_{uuid.uuid4().hex[:8]}",
+        'type': 'function',
+        'function': {'name': 'course_query', 'arguments': json.dumps(arguments, ensure_ascii=False)},
+    }
+
+
+def stream_completion(completion_id: str, model: str, messages: List[Dict]) -> Iterator[str]:
+    """
+    Stream the canned response as chat completion chunks.
+    """
+    created = int(time.time())
+    time.sleep(FIRST_TOKEN_DELAY)
+    for token in split_into_tokens(CANNED_RESPONSE):
+        chunk = {
+            'id': completion_id,
+            'object': 'chat.completion.chunk',
+            'created': created,
+            'model': model,
+            'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': token}, 'finish_reason': None}],
+        }
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        time.sleep(TOKEN_DELAY)
+
+    final_chunk = {
+        'id': completion_id,
+        'object': 'chat.completion.chunk',
+        'created': created,
+        'model': model,
+        'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}],
+        'x_groq': {'id': completion_id, 'usage': build_usage(messages, CANNED_RESPONSE)},
+    }
+    yield f"data: {json.dumps(final_chunk, ensure_ascii=False)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.route('/openai/v1/chat/completions', methods=['POST'])
+def chat_completions() -> Response:
+    body = request.json
+    model = body.get('model', 'fake-model')
+    messages = body.get('messages', [])
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+    if body.get('stream'):
+        return Response(stream_completion(completion_id, model, messages), mimetype='text/event-stream')
+
+    time.sleep(FIRST_TOKEN_DELAY)
+    if body.get('tools'):
+        message = {'role': 'assistant', 'content': None, 'tool_calls': [build_tool_call(messages)]}
+        completion = message['tool_calls'][0]['function']['arguments']
+        finish_reason = 'tool_calls'
+    else:
+        message = {'role': 'assistant', 'content': CANNED_RESPONSE}
+        completion = CANNED_RESPONSE
+        finish_reason = 'stop'
+        time.sleep(TOKEN_DELAY * len(split_into_tokens(CANNED_RESPONSE)))
+
+    return jsonify({
+        'id': completion_id,
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{'index': 0, 'message': message, 'finish_reason': finish_reason}],
+        'usage': build_usage(messages, completion),
+    })
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a local stand-in for the Groq chat completion API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--token-delay', type=float, default=0.0, help='Seconds to wait between streamed tokens.')
+    parser.add_argument('--first-token-delay', type=float, default=0.0, help='Seconds to wait before answering.')
+    args = parser.parse_args()
+
+    TOKEN_DELAY = args.token_delay
+    FIRST_TOKEN_DELAY = args.first_token_delay
+
+    app.run(host=args.host, port=args.port, threaded=True)
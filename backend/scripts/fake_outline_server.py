@@ -0,0 +1,103 @@
+"""
+A local stand-in for the course outline pages of selcrs.nsysu.edu.tw.
+
+It serves canned outline pages with the syllabus and objectives of the courses in a catalog snapshot, so the
+crawler can be tested or benchmarked without hitting the university server:
+
+    python backend/scripts/fake_outline_server.py --port 8002 --delay 0.05 --error-rate 0.1
+    OUTLINE_BASE_URL=http://127.0.0.1:8002 python backend/scripts/update_courses.py
+
+Pages of courses missing from the snapshot are answered with 404, and a fraction of the requests can be answered
+with a 503 to exercise the retries. Pages carry ETag and Last-Modified validators, and conditional requests for an
+unchanged page are answered with 304 Not Modified (unless `--no-validators` is set).
+"""
+
+import argparse
+import hashlib
+import html
+import random
+import time
+from email.utils import formatdate
+from typing import Dict
+
+import pandas as pd
+from flask import Flask, request, Response
+
+app = Flask(__name__)
+
+DELAY = 0.0
+ERROR_RATE = 0.0
+VALIDATORS = True
+LAST_MODIFIED = formatdate(time.time(), usegmt=True)
+OUTLINES: Dict[str, Dict[str, str]] = {}
+
+PAGE_TEMPLATE = """<html>
+<head><meta charset="utf-8"><title>{name}</title></head>
+<body>
+<table>
+<tr><td colspan="12"><p>課程名稱 Course name</p></td></tr>
+<tr><td colspan="12">{name}</td></tr>
+<tr><td colspan="12"><p>課程目標 Objectives</p></td></tr>
+<tr><td colspan="12">{objectives}</td></tr>
+<tr><td colspan="12"><p>課程大綱 Course syllabus</p></td></tr>
+<tr><td colspan="12">{syllabus}</td></tr>
+</table>
+</body>
+</html>
+"""
+
+
+def load_outlines(courses_path: str) -> Dict[str, Dict[str, str]]:
+    """
+    Load the name, syllabus and objectives of every course of the snapshot, by course id.
+    """
+    courses_df = pd.read_csv(courses_path, usecols=['id', 'name', 'syllabus', 'objectives']).fillna('')
+    return {
+        str(row['id']): {'name': row['name'], 'syllabus': row['syllabus'], 'objectives': row['objectives']}
+        for row in courses_df.to_dict('records')
+    }
+
+
+def render_outline(outline: Dict[str, str]) -> str:
+    """
+    Render the outline page of a course.
+    """
+    return PAGE_TEMPLATE.format(**{key: html.escape(str(value)) for key, value in outline.items()})
+
+
+@app.route('/menu5/showoutline.asp', methods=['GET'])
+def show_outline() -> Response:
+    time.sleep(DELAY)
+    if random.random() < ERROR_RATE:
+        return Response('Service Unavailable', status=503)
+
+    outline = OUTLINES.get(request.args.get('CrsDat', ''))
+    if outline is None:
+        return Response('Not Found', status=404)
+    page = render_outline(outline)
+    if not VALIDATORS:
+        return Response(page, mimetype='text/html; charset=utf-8')
+
+    etag = f'"{hashlib.sha1(page.encode("utf-8")).hexdigest()}"'
+    headers = {'ETag': etag, 'Last-Modified': LAST_MODIFIED}
+    if request.headers.get('If-None-Match') == etag:
+        return Response(status=304, headers=headers)
+    return Response(page, mimetype='text/html; charset=utf-8', headers=headers)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a local stand-in for the course outline pages.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8002)
+    parser.add_argument('--courses', default='backend/src/data/courses.csv', help='Catalog snapshot to serve.')
+    parser.add_argument('--delay', type=float, default=0.0, help='Seconds to wait before answering.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 503.')
+    parser.add_argument('--no-validators', action='store_true', help='Do not send ETag and Last-Modified.')
+    args = parser.parse_args()
+
+    DELAY = args.delay
+    ERROR_RATE = args.error_rate
+    VALIDATORS = not args.no_validators
+    OUTLINES = load_outlines(args.courses)
+
+    app.run(host=args.host, port=args.port, threaded=True)
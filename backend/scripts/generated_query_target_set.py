@@ -1,3 +1,5 @@
+import hashlib
+import os
 from typing import List
 
 import pandas as pd
@@ -6,12 +8,16 @@ from dotenv import load_dotenv
 from tqdm import tqdm
 from transformers import pipeline
 
+from backend.src.service.catalog_snapshot import (
+    DEFAULT_SNAPSHOT_DIR, MANIFEST_FILE, parse_list_column, read_catalog_snapshot,
+)
+
 load_dotenv()
 
 
 class QueryTargetWithTagsGenerator:
-    def __init__(self, model_name: str, courses_file: str):
-        self.courses_df = pd.read_csv(courses_file)
+    def __init__(self, model_name: str, courses_file: str, snapshot_dir: str = DEFAULT_SNAPSHOT_DIR):
+        self.courses_df = self._load_courses(courses_file, snapshot_dir)
         self._prepare_tags()
 
         # Load Hugging Face pipeline
@@ -24,13 +30,28 @@ class QueryTargetWithTagsGenerator:
         )
         print(f"Initialized with Hugging Face pipeline '{model_name}'.")
 
+    @staticmethod
+    def _load_courses(courses_file: str, snapshot_dir: str) -> pd.DataFrame:
+        """
+        Load the id, name and tags of the courses, from the columnar snapshot when it matches the CSV file.
+        """
+        columns = ['id', 'name', 'tags']
+        if os.path.exists(os.path.join(snapshot_dir, MANIFEST_FILE)):
+            with open(courses_file, 'rb') as f:
+                version = hashlib.sha256(f.read()).hexdigest()
+            try:
+                return read_catalog_snapshot(snapshot_dir, columns, expected_catalog_version=version)
+            except ValueError as e:
+                print(f"Warning: {str(e)}, reading {courses_file} instead")
+        return pd.read_csv(courses_file, usecols=columns)
+
     def _prepare_tags(self):
         """Flatten and clean the tags."""
-        self.courses_df['tags'] = self.courses_df['tags'].apply(lambda x: eval(x) if pd.notna(x) else [])
+        self.courses_df['tags'] = self.courses_df['tags'].apply(parse_list_column)
         self.tag_to_courses = {}
-        for _, row in self.courses_df.iterrows():
-            for tag in row['tags']:
-                self.tag_to_courses.setdefault(tag, []).append(row['id'])
+        for course_id, tags in zip(self.courses_df['id'], self.courses_df['tags']):
+            for tag in tags:
+                self.tag_to_courses.setdefault(tag, []).append(course_id)
 
     def _get_related_courses(self, tag: str) -> List[str]:
         """
@@ -1,42 +1,267 @@
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
 import pandas as pd
 import torch
 from sentence_transformers import SentenceTransformer
 from tqdm import tqdm
 
+from backend.src.service.course_catalog import get_course_catalog
+from backend.src.service.embedding_store import (
+    EmbeddingStore,
+    FieldArrays,
+    factorize_texts,
+    hash_texts,
+    match_hashes,
+    write_embedding_store,
+)
+
 tqdm.pandas()
 
+FIELDS_TO_EMBED = ['name', 'description', 'department', 'objectives', 'syllabus', 'tags', 'teacher']
+# Fields with a few hundred distinct values, only their unique values are encoded
+FACTORIZED_FIELDS = ['department', 'teacher', 'tags']
+
+# Model of a pool worker, loaded once by `init_encode_worker`
+_worker_model: Optional[SentenceTransformer] = None
+
+
+def build_encode_chunks(texts: List[str], batch_size: int) -> List[np.ndarray]:
+    """
+    Split texts into chunks of at most `batch_size` positions, grouping texts of similar length.
+
+    Every chunk is encoded as exactly one model batch, so a text is always padded together with the same
+    neighbours no matter which process encodes it, and the sharded output is identical to the single-process one.
+    """
+    order = np.argsort([-len(text) for text in texts], kind='stable')
+    return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+
+def init_encode_worker(model_name: str, num_threads: int):
+    """
+    Load the model of a pool worker, sharing the CPU cores evenly between the workers.
+    """
+    global _worker_model
+    torch.set_num_threads(num_threads)
+    _worker_model = SentenceTransformer(model_name, device='cpu')
+
+
+def encode_chunk_in_worker(texts: List[str], batch_size: int) -> Tuple[int, np.ndarray, float]:
+    """
+    Encode a chunk with the worker's model, returns the worker pid, the embeddings and the encoding time.
+    """
+    start = time.perf_counter()
+    embeddings = _worker_model.encode(texts, convert_to_numpy=True, batch_size=batch_size)
+    return os.getpid(), embeddings, time.perf_counter() - start
+
+
+class FieldPlan(NamedTuple):
+    """
+    The texts of a field and which of them can be reused from the previous store.
+    """
+    texts: List[str]
+    hashes: np.ndarray
+    previous: Optional[FieldArrays]
+    previous_rows: np.ndarray
+    index: Optional[np.ndarray]
+
+    @property
+    def missing(self) -> np.ndarray:
+        return np.flatnonzero(self.previous_rows < 0)
+
 
 class CourseFieldEmbeddingPreprocessor:
     def __init__(self, model_name='paraphrase-multilingual-MiniLM-L12-v2'):
+        self.model_name = model_name
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model = SentenceTransformer(model_name, device=self.device)
-        print(f"Using device: {self.device}")
+        self._model: Optional[SentenceTransformer] = None
+
+    @property
+    def model(self) -> SentenceTransformer:
+        # Loaded on first use, an incremental run without changed texts never needs the model
+        if self._model is None:
+            self._model = SentenceTransformer(self.model_name, device=self.device)
+            print(f"Using device: {self.device}")
+        return self._model
+
+    def load_previous_store(self, output_dir: str, dtype: str) -> Optional[EmbeddingStore]:
+        """
+        Open the existing store, if its vectors can be reused (same model and storage dtype).
+        """
+        try:
+            store = EmbeddingStore(output_dir)
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError) as e:
+            print(f"Warning: Ignoring the existing embedding store: {str(e)}")
+            return None
+
+        if store.model_name != self.model_name or store.dtype != dtype:
+            print(f"The existing embeddings were computed with {store.model_name} ({store.dtype}), "
+                  f"re-encoding all texts")
+            return None
+        return store
 
-    def preprocess_courses(self, courses_df: pd.DataFrame, output_file: str, batch_size: int = 256):
+    def encode_chunks(self, chunks: List[List[str]], batch_size: int, workers: int = 1) -> List[np.ndarray]:
+        """
+        Encode chunks of texts into [texts x dim] float32 embeddings, in the order of the chunks.
+
+        With several workers the chunks are spread over a process pool, each worker loads the model once and gets
+        an equal share of the CPU threads. The rows/sec of every worker are reported.
+        """
+        if workers <= 1 or not chunks:
+            return [self.model.encode(chunk, convert_to_numpy=True, batch_size=batch_size) for chunk in chunks]
+
+        num_threads = max(1, (os.cpu_count() or 1) // workers)
+        print(f"Encoding {len(chunks)} chunks with {workers} workers ({num_threads} torch threads each)")
+        worker_stats: Dict[int, List[float]] = {}
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_encode_worker,
+            initargs=(self.model_name, num_threads),
+        ) as executor:
+            futures = [executor.submit(encode_chunk_in_worker, chunk, batch_size) for chunk in chunks]
+            results = []
+            for chunk, future in zip(chunks, tqdm(futures, desc="Chunks")):
+                pid, embeddings, seconds = future.result()
+                stats = worker_stats.setdefault(pid, [0, 0.0])
+                stats[0] += len(chunk)
+                stats[1] += seconds
+                results.append(embeddings)
+
+        for worker, (pid, (rows, seconds)) in enumerate(sorted(worker_stats.items())):
+            print(f"Worker {worker} (pid {pid}): {rows} rows in {seconds:.1f}s, "
+                  f"{rows / seconds if seconds else 0.0:.1f} rows/s")
+        return results
+
+    def plan_field(self, field: str, texts: List[str], previous: Optional[EmbeddingStore],
+                   index: Optional[np.ndarray] = None) -> FieldPlan:
+        """
+        Hash the texts of a field and match them against the previous store.
+        """
+        hashes = hash_texts(texts)
+        previous_arrays = previous.field_arrays(field) if previous is not None and field in previous.fields else None
+        previous_rows = match_hashes(previous_arrays.hashes if previous_arrays is not None else None, hashes)
+        plan = FieldPlan(texts, hashes, previous_arrays, previous_rows, index)
+        print(f"Field {field}: {len(plan.missing)} of {len(texts)} texts to encode, "
+              f"{len(texts) - len(plan.missing)} reused")
+        return plan
+
+    def encode_fields(self, plans: Dict[str, FieldPlan], batch_size: int, dtype: str,
+                      workers: int = 1) -> Dict[str, FieldArrays]:
+        """
+        Encode the missing texts of all fields and merge them with the reused vectors.
+
+        The (field, row) work is sharded into length-sorted chunks over all fields, so the pool stays busy even
+        when a single field changed.
+        """
+        chunk_keys: List[Tuple[str, np.ndarray]] = []
+        for field, plan in plans.items():
+            missing = plan.missing
+            chunk_keys.extend((field, missing[chunk]) for chunk in build_encode_chunks(
+                [plan.texts[i] for i in missing], batch_size))
+
+        chunk_embeddings = self.encode_chunks(
+            [[plans[field].texts[i] for i in rows] for field, rows in chunk_keys], batch_size, workers)
+
+        # Scatter the chunks back into field order, the merge does not depend on which worker encoded a chunk
+        dim = chunk_embeddings[0].shape[1] if chunk_embeddings else None
+        fields = {}
+        for field, plan in plans.items():
+            encoded = None
+            missing = plan.missing
+            if len(missing) or plan.previous is None:
+                positions = np.full(len(plan.texts), -1, dtype=np.int64)
+                positions[missing] = np.arange(len(missing))
+                if dim is None:
+                    dim = self.model.get_sentence_embedding_dimension()
+                embeddings = np.zeros((len(missing), dim), dtype=np.float32)
+                for (chunk_field, rows), chunk in zip(chunk_keys, chunk_embeddings):
+                    if chunk_field == field:
+                        embeddings[positions[rows]] = chunk
+                encoded = FieldArrays.from_embeddings(embeddings, dtype)
+            fields[field] = FieldArrays.merge(plan.hashes, plan.previous, plan.previous_rows, encoded,
+                                              index=plan.index)
+        return fields
+
+    def preprocess_courses(
+        self,
+        courses_df: pd.DataFrame,
+        output_dir: str,
+        batch_size: int = 256,
+        catalog_version: str = None,
+        dtype: str = 'float16',
+        incremental: bool = True,
+        workers: int = 1,
+    ):
         """
         Precompute and save embeddings for individual fields.
 
+        With `incremental`, the content hash of every embedded text is compared against the existing store: the
+        vectors of unchanged texts are reused, only new or changed texts are encoded and removed courses are
+        dropped. The new store is written as a new generation, so the app never sees a partially written store.
+
         Args:
             courses_df (pd.DataFrame): The courses dataframe.
-            output_file (str): Path to save precomputed embeddings.
+            output_dir (str): Directory of the embedding store to write.
             batch_size (int): Batch size for encoding.
+            catalog_version (str): Version id of the catalog snapshot the embeddings belong to.
+            dtype (str): Storage type of the embeddings, 'float16' or 'int8' (with per-row scales).
+            incremental (bool): Whether to reuse the vectors of the existing store.
+            workers (int): Number of encoding processes, the output is identical for any number of workers.
         """
-        fields_to_embed = ['name', 'description', 'department', 'objectives', 'syllabus', 'tags', 'teacher']
-        embeddings_dict = {}
+        start = time.perf_counter()
+        previous = self.load_previous_store(output_dir, dtype) if incremental else None
+        if previous is not None and catalog_version is not None and previous.catalog_version == catalog_version \
+                and previous.field_names == FIELDS_TO_EMBED and set(previous.indices) == set(FACTORIZED_FIELDS):
+            print(f"Embeddings in {output_dir} are up to date with catalog {catalog_version[:12]}")
+            return
 
+        plans = {}
         print("Generating embeddings for each field...")
-        for field in fields_to_embed:
-            print(f"Encoding field: {field}")
-            field_texts = courses_df[field].fillna('').tolist()
-            embeddings = self.model.encode(field_texts, convert_to_tensor=True, batch_size=batch_size)
-            embeddings_dict[field] = embeddings.cpu()
+        for field in FIELDS_TO_EMBED:
+            # List columns (tags) are embedded as their text, e.g. "['環境教育學程']" like in the CSV
+            field_texts = [str(text) if isinstance(text, list) else text
+                           for text in courses_df[field].fillna('').tolist()]
+            index = None
+            if field in FACTORIZED_FIELDS:
+                field_texts, index = factorize_texts(field_texts)
+            plans[field] = self.plan_field(field, field_texts, previous, index=index)
 
-        # Save embeddings and course data
-        torch.save({'field_embeddings': embeddings_dict, 'courses_df': courses_df}, output_file)
-        print(f"Embeddings saved to {output_file}")
+        if workers > 1 and self.device != 'cpu':
+            print(f"Warning: Parallel precompute is only used on CPU, encoding on {self.device} in one process")
+            workers = 1
+        fields = self.encode_fields(plans, batch_size, dtype, workers=workers)
+
+        # Save the embeddings, the course data is read from the catalog at load time
+        write_embedding_store(output_dir, fields, self.model_name, catalog_version)
+        print(f"Embeddings saved to {output_dir} in {time.perf_counter() - start:.1f}s")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Precompute the field embeddings of the course catalog.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of encoding processes, e.g. the number of CPU cores of the build box.')
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--dtype', choices=['float16', 'int8'], default='float16')
+    parser.add_argument('--full', action='store_true', help='Re-encode all texts instead of an incremental update.')
+    args = parser.parse_args()
+
     # Preprocess and save embeddings
+    catalog = get_course_catalog('backend/src/data/courses.csv')
     preprocessor = CourseFieldEmbeddingPreprocessor()
-    preprocessor.preprocess_courses(pd.read_csv('backend/src/data/courses.csv'), output_file='backend/src/data/precomputed_field_embeddings.pt')
+    preprocessor.preprocess_courses(
+        catalog.courses_df,
+        output_dir='backend/src/data/field_embeddings',
+        batch_size=args.batch_size,
+        catalog_version=catalog.version,
+        dtype=args.dtype,
+        incremental=not args.full,
+        workers=args.workers,
+    )
@@ -1,11 +1,28 @@
+import argparse
 import asyncio
+import hashlib
+import io
+import json
+import os
 import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional
 
+import pandas as pd
 from tqdm import tqdm
 
-from backend.scripts.api.courses_api import NSYSUCourseAPI
+from backend.scripts.api.clawer import extend_course_dataframe, get_course_crawler
+from backend.scripts.api.courses_api import NSYSUCourseClient
+from backend.src.service.catalog_snapshot import write_catalog_snapshot
 
 DATA_STORAGE_PATH = 'backend/src/data/courses.csv'
+CHANGESET_PATH = 'backend/src/data/courses_changeset.json'
+SNAPSHOT_PATH = 'backend/src/data/courses_snapshot'
+
+# Columns crawled from the outline pages
+DETAIL_COLUMNS = ['syllabus', 'objectives']
+# Seat counts change all the time during course selection, they do not make a course worth crawling again
+VOLATILE_COLUMNS = ['select', 'selected', 'remaining']
 
 tqdm.pandas()
 
@@ -48,31 +65,170 @@ def clean_syllabus(text: str) -> str:
 
     return text
 
-async def update_courses():
+def clean_course_details(course_data: pd.DataFrame) -> pd.DataFrame:
     """
-    Update the course data from the NSYSU API and store it in a local file.
+    Clean the crawled syllabus of the courses.
     """
-    try:
-        # Fetch course data from the NSYSU API
-        course_data = await NSYSUCourseAPI.get_latest_courses()
+    # Convert the syllabus to string and clean it
+    course_data['syllabus'] = course_data['syllabus'].fillna('').progress_apply(str)
+
+    # Remove the header that indicates the syllabus is in English
+    course_data['syllabus'] = course_data['syllabus'].progress_apply(remove_syllabus_header)
+
+    # Clean the syllabus text
+    course_data['syllabus'] = course_data['syllabus'].progress_apply(clean_syllabus)
+
+    return course_data
+
+
+def file_version(path: str) -> Optional[str]:
+    """
+    Get the content hash of a file, the same version id as the catalog store, or None if it does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def read_snapshot(path_or_buffer) -> pd.DataFrame:
+    """
+    Read a CSV snapshot with every value as its stored string, so values compare exactly.
+    """
+    return pd.read_csv(path_or_buffer, dtype=str, keep_default_na=False)
+
+
+def diff_courses(previous_df: pd.DataFrame, current_df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Diff the new course list against the previous snapshot (read with `read_snapshot`) by course id.
+
+    A course is changed when any column but the crawled details and the seat counts differs, including the
+    upstream `change` / `changeDescription` markers.
+
+    Returns:
+        Dict[str, Any]: The `added` and `removed` course ids, and the `changed` course ids with their changed
+            columns.
+    """
+    columns = [column for column in current_df.columns
+               if column not in DETAIL_COLUMNS + VOLATILE_COLUMNS + ['id']]
+    previous = previous_df.set_index('id')
+    # Compare the values the way they are written to the snapshot
+    current = read_snapshot(io.StringIO(current_df.to_csv(index=False))).set_index('id')
+    for column in columns:
+        if column not in previous.columns:
+            previous[column] = ''
+
+    previous_ids = set(previous.index)
+    current_ids = set(current.index)
+    common_ids = [course_id for course_id in current.index if course_id in previous_ids]
+
+    changed: Dict[str, List[str]] = {}
+    previous_common = previous.loc[common_ids, columns]
+    current_common = current.loc[common_ids, columns]
+    differs = (previous_common.to_numpy() != current_common.to_numpy())
+    for row, column in zip(*differs.nonzero()):
+        changed.setdefault(common_ids[row], []).append(columns[column])
+
+    return {
+        'added': [course_id for course_id in current.index if course_id not in previous_ids],
+        'removed': [course_id for course_id in previous.index if course_id not in current_ids],
+        'changed': changed,
+    }
+
+
+def write_changeset(path: str, changeset: Dict[str, Any]):
+    """
+    Write the changeset of an update, for the downstream steps such as the embedding precompute.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(changeset, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
 
-        # Convert the syllabus to string and clean it
-        course_data['syllabus'] = course_data['syllabus'].fillna('').progress_apply(str)
 
-        # Remove the header that indicates the syllabus is in English
-        course_data['syllabus'] = course_data['syllabus'].progress_apply(remove_syllabus_header)
+async def update_courses(incremental: bool = True):
+    """
+    Update the course data from the NSYSU API and store it in a local file.
 
-        # Clean the syllabus text
-        course_data['syllabus'] = course_data['syllabus'].progress_apply(clean_syllabus)
+    In incremental mode the new course list is diffed against the previous snapshot: only added or changed
+    courses are crawled, unchanged courses carry their syllabus and objectives forward, and so do changed
+    courses whose outline page could not be fetched. Both modes write a changeset file and a typed columnar
+    snapshot (see `catalog_snapshot`) next to the CSV.
+
+    Args:
+        incremental (bool): Whether to reuse the previous snapshot, if there is one.
+    """
+    try:
+        # Fetch the course list from the NSYSU API
+        async with NSYSUCourseClient() as client:
+            course_data = await client.get_latest_course_list()
+
+        previous_version = file_version(DATA_STORAGE_PATH)
+        previous_df = read_snapshot(DATA_STORAGE_PATH) if previous_version is not None else None
+        diff = diff_courses(previous_df, course_data) if previous_df is not None else {
+            'added': course_data['id'].tolist(), 'removed': [], 'changed': {},
+        }
+        print(f"Course list: {len(diff['added'])} added, {len(diff['removed'])} removed, "
+              f"{len(diff['changed'])} changed, {len(course_data)} in total")
+
+        if incremental and previous_df is not None:
+            crawl_ids = set(diff['added']) | set(diff['changed'])
+        else:
+            crawl_ids = set(course_data['id'])
+        crawl_mask = course_data['id'].isin(crawl_ids).to_numpy()
+
+        # Crawl the syllabus and objectives of the selected courses
+        crawler = get_course_crawler()
+        crawled_df = clean_course_details(await extend_course_dataframe(course_data[crawl_mask], 'url', crawler))
+        # Pages served from the cache after a failed fetch are not failures, their cached details are used
+        failed_urls = {failure.url for failure in crawler.failures}
+
+        # Take the details of the other courses, and of the changed courses that failed, from the previous snapshot
+        details = pd.DataFrame('', index=course_data['id'], columns=DETAIL_COLUMNS)
+        carried_ids = []
+        if previous_df is not None:
+            previous_details = previous_df.set_index('id')[DETAIL_COLUMNS]
+            carried_ids = [
+                course_id for course_id, url, crawled in zip(course_data['id'], course_data['url'], crawl_mask)
+                if course_id in previous_details.index and (not crawled or url in failed_urls)
+            ]
+            details.loc[carried_ids] = previous_details.loc[carried_ids].to_numpy()
+
+        crawled_ok = ~crawled_df['id'].isin(carried_ids).to_numpy()
+        details.loc[crawled_df['id'][crawled_ok]] = crawled_df.loc[crawled_ok, DETAIL_COLUMNS].to_numpy()
+        course_data = pd.concat([course_data.reset_index(drop=True), details.reset_index(drop=True)], axis=1)
 
         # Store the course data in a local file
         course_data.to_csv(DATA_STORAGE_PATH, index=False)
 
+        # Build the typed columnar snapshot from the written file, so both hold the same catalog version
+        version = file_version(DATA_STORAGE_PATH)
+        write_catalog_snapshot(pd.read_csv(DATA_STORAGE_PATH), SNAPSHOT_PATH, version)
+
+        write_changeset(CHANGESET_PATH, {
+            'mode': 'incremental' if incremental and previous_df is not None else 'full',
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'previous_version': previous_version,
+            'version': version,
+            'num_courses': len(course_data),
+            'added': diff['added'],
+            'removed': diff['removed'],
+            'changed': diff['changed'],
+            'crawled': int(crawl_mask.sum()),
+            'carried_forward': len(carried_ids),
+        })
+        print(f"Crawled {int(crawl_mask.sum())} courses, carried forward {len(carried_ids)}, "
+              f"changeset written to {CHANGESET_PATH}")
+
     except Exception as e:
         print(f"Failed to update course data: {str(e)}")
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Update the course data from the NSYSU API.')
+    parser.add_argument('--full', action='store_true', help='Crawl every course instead of an incremental update.')
+    args = parser.parse_args()
+
     async def main():
-        await update_courses()
+        await update_courses(incremental=not args.full)
 
     asyncio.run(main())
@@ -0,0 +1,141 @@
+import copy
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with an optional time-to-live and optional on-disk persistence.
+
+    Values must be JSON serializable when a persistence file is set. The file is rewritten atomically after every
+    insertion, so it is meant for caches of expensive results (e.g. LLM calls) rather than hot loops.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None, persist_path: Optional[str] = None):
+        """
+        Args:
+            max_size (int): Maximum number of entries, the least recently used entry is evicted first.
+            ttl (Optional[float]): Time-to-live of an entry in seconds. None means entries never expire.
+            persist_path (Optional[str]): JSON file used to persist the cache across restarts.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persist_path = persist_path
+
+        self._lock = threading.Lock()
+        # key -> (value, stored_at wall clock time)
+        self._entries: 'OrderedDict[str, Tuple[Any, float]]' = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        if persist_path:
+            self._load()
+
+    def _is_expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Get a copy of the cached value, or None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, stored_at = entry
+            if self._is_expired(stored_at, now):
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(value)
+
+    def put(self, key: str, value: Any):
+        """
+        Insert or replace a value, evicting the least recently used entries if the cache is full.
+        """
+        with self._lock:
+            self._entries[key] = (copy.deepcopy(value), time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+            if self.persist_path:
+                self._save()
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        with self._lock:
+            self._entries.clear()
+            if self.persist_path:
+                self._save()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the hit/miss counters of the cache.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxSize': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    def _load(self):
+        """
+        Load the persisted entries, skipping the expired ones.
+        """
+        if not os.path.exists(self.persist_path):
+            return
+
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Failed to load cache file {self.persist_path}: {str(e)}")
+            return
+
+        now = time.time()
+        # Entries are stored from least to most recently used
+        for key, value, stored_at in entries[-self.max_size:]:
+            if not self._is_expired(stored_at, now):
+                self._entries[key] = (value, stored_at)
+
+    def _save(self):
+        """
+        Atomically write the entries to the persistence file. Must be called with the lock held.
+        """
+        directory = os.path.dirname(os.path.abspath(self.persist_path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.persist_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump([[key, value, stored_at] for key, (value, stored_at) in self._entries.items()],
+                          f, ensure_ascii=False)
+            os.replace(tmp_path, self.persist_path)
+        except OSError as e:
+            print(f"Warning: Failed to persist cache file {self.persist_path}: {str(e)}")
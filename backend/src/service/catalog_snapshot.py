@@ -0,0 +1,296 @@
+import ast
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+CATALOG_SNAPSHOT_FORMAT_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+DEFAULT_SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'courses_snapshot')
+
+# Storage kind of the known catalog columns, the kind of other columns is inferred from their dtype
+COLUMN_KINDS = {
+    'classTime': 'list',
+    'tags': 'list',
+    'department': 'category',
+    'teacher': 'category',
+    'class': 'category',
+    'yearSemester': 'category',
+    'change': 'category',
+    'multipleCompulsory': 'bool',
+    'compulsory': 'bool',
+    'english': 'bool',
+    'grade': 'int',
+    'restrict': 'int',
+    'select': 'int',
+    'selected': 'int',
+    'remaining': 'int',
+    'credit': 'float',
+}
+LIST_COLUMNS = [column for column, kind in COLUMN_KINDS.items() if kind == 'list']
+
+
+def parse_list_column(value: Any) -> List[str]:
+    """
+    Parse a list column stored as its Python representation in the CSV, e.g. "['環境教育學程']".
+    """
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return list(value)
+    if not isinstance(value, str) or not value.strip():
+        return []
+    try:
+        parsed = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return [value]
+    return list(parsed) if isinstance(parsed, (list, tuple)) else [parsed]
+
+
+def encode_strings(values: Sequence[Any]) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+    """
+    Encode strings as one UTF-8 buffer with row offsets.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]: The uint8 buffer, the int64 offsets (one more than the
+            values) and the null mask, None if no value is missing.
+    """
+    nulls = np.fromiter((value is None or (isinstance(value, float) and np.isnan(value)) for value in values),
+                        dtype=bool, count=len(values))
+    encoded = [b'' if null else str(value).encode('utf-8') for value, null in zip(values, nulls)]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return data, offsets, nulls if nulls.any() else None
+
+
+def decode_strings(data: np.ndarray, offsets: np.ndarray, nulls: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Decode strings encoded by `encode_strings` into an object array, missing values are NaN like in `pd.read_csv`.
+    """
+    buffer = data.tobytes()
+    values = np.empty(len(offsets) - 1, dtype=object)
+    values[:] = [buffer[start:end].decode('utf-8') for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+    if nulls is not None:
+        values[nulls] = np.nan
+    return values
+
+
+def to_bool(values: pd.Series) -> np.ndarray:
+    """
+    Convert a bool column, also when it was read back from text.
+    """
+    if values.dtype == bool:
+        return values.to_numpy()
+    return values.map(lambda value: str(value).strip().lower() in ('true', '1')).to_numpy(dtype=bool)
+
+
+def column_kind(name: str, values: pd.Series) -> str:
+    if name in COLUMN_KINDS:
+        return COLUMN_KINDS[name]
+    if pd.api.types.is_bool_dtype(values):
+        return 'bool'
+    if pd.api.types.is_integer_dtype(values):
+        return 'int'
+    if pd.api.types.is_float_dtype(values):
+        return 'float'
+    return 'string'
+
+
+def manifest_files(manifest: Dict) -> List[str]:
+    """
+    Get the array files referenced by a manifest.
+    """
+    return [name for entry in manifest.get('columns', {}).values() for key, name in entry.items()
+            if key.endswith('_file')]
+
+
+def write_catalog_snapshot(courses_df: pd.DataFrame, output_dir: str, catalog_version: Optional[str]):
+    """
+    Write the catalog as a typed columnar snapshot: raw array files per column plus a JSON manifest.
+
+    List columns (`tags`, `classTime`) are stored as real lists, whether the DataFrame holds lists or their Python
+    representation read back from the CSV. Low-cardinality text columns are dictionary encoded, bools and ints keep
+    their dtype. Like the embedding store, every write is a new generation and the manifest is replaced last.
+
+    Args:
+        courses_df (pd.DataFrame): The catalog.
+        output_dir (str): The snapshot directory, created if missing.
+        catalog_version (Optional[str]): Content hash of the CSV file of the same catalog.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    previous_manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            previous_manifest = json.load(f)
+    generation = previous_manifest.get('generation', 0) + 1
+
+    def write_array(array: np.ndarray, name: str) -> str:
+        path = os.path.join(output_dir, name)
+        with open(path, 'wb') as f:
+            np.ascontiguousarray(array).tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        return name
+
+    def write_strings(values: Sequence[Any], prefix: str, entry: Dict[str, Any]):
+        data, offsets, nulls = encode_strings(values)
+        entry[f'{prefix}data_file'] = write_array(data, f"{column}.g{generation}.{prefix}data.uint8")
+        entry[f'{prefix}offsets_file'] = write_array(offsets, f"{column}.g{generation}.{prefix}offsets.int64")
+        if nulls is not None:
+            entry[f'{prefix}nulls_file'] = write_array(nulls, f"{column}.g{generation}.{prefix}nulls.bool")
+
+    entries = {}
+    for column in courses_df.columns:
+        values = courses_df[column]
+        kind = column_kind(column, values)
+        if kind == 'int' and values.isna().any():
+            kind = 'float'
+        entry: Dict[str, Any] = {'kind': kind}
+
+        if kind == 'list':
+            lists = [parse_list_column(value) for value in values.tolist()]
+            list_offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+            np.cumsum([len(items) for items in lists], out=list_offsets[1:])
+            entry['list_offsets_file'] = write_array(list_offsets, f"{column}.g{generation}.list_offsets.int64")
+            write_strings([str(item) for items in lists for item in items], 'values_', entry)
+        elif kind == 'category':
+            codes, categories = pd.factorize(values, sort=True)
+            entry['codes_file'] = write_array(codes.astype(np.int32), f"{column}.g{generation}.codes.int32")
+            write_strings(list(categories), 'categories_', entry)
+        elif kind == 'bool':
+            entry['file'] = write_array(to_bool(values), f"{column}.g{generation}.bool")
+        elif kind == 'int':
+            entry['file'] = write_array(pd.to_numeric(values).to_numpy(np.int64), f"{column}.g{generation}.int64")
+        elif kind == 'float':
+            entry['file'] = write_array(pd.to_numeric(values).to_numpy(np.float64),
+                                        f"{column}.g{generation}.float64")
+        else:
+            write_strings(values.tolist(), '', entry)
+        entries[column] = entry
+
+    manifest = {
+        'format_version': CATALOG_SNAPSHOT_FORMAT_VERSION,
+        'generation': generation,
+        'num_rows': len(courses_df),
+        'catalog_version': catalog_version,
+        'columns': entries,
+    }
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, manifest_path)
+
+    current_files = set(manifest_files(manifest))
+    for name in manifest_files(previous_manifest):
+        if name not in current_files:
+            try:
+                os.remove(os.path.join(output_dir, name))
+            except OSError as e:
+                print(f"Warning: Failed to remove stale snapshot file {name}: {str(e)}")
+
+
+class CatalogSnapshotReader:
+    """
+    Reader of a columnar catalog snapshot.
+
+    Only the files of the requested columns are read, so a service that needs a few attributes does not pay for
+    the long text columns.
+    """
+
+    def __init__(self, snapshot_dir: str = DEFAULT_SNAPSHOT_DIR, expected_catalog_version: Optional[str] = None):
+        """
+        Args:
+            snapshot_dir (str): The snapshot directory.
+            expected_catalog_version (Optional[str]): Refuse to load a snapshot of another catalog version.
+
+        Raises:
+            FileNotFoundError: If the directory has no manifest.
+            ValueError: If the format or the catalog version does not match.
+        """
+        self.snapshot_dir = snapshot_dir
+        manifest_path = os.path.join(snapshot_dir, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(f"No catalog snapshot manifest found at {manifest_path}")
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+
+        if self.manifest.get('format_version') != CATALOG_SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported catalog snapshot format {self.manifest.get('format_version')}")
+        self.catalog_version = self.manifest.get('catalog_version')
+        if expected_catalog_version is not None and self.catalog_version != expected_catalog_version:
+            raise ValueError(f"Catalog snapshot is for catalog {str(self.catalog_version)[:12]}, "
+                             f"expected {expected_catalog_version[:12]}, re-run update_courses.py")
+        self.num_rows = self.manifest['num_rows']
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.manifest['columns'])
+
+    def _read(self, entry: Dict[str, Any], key: str, dtype) -> Optional[np.ndarray]:
+        if key not in entry:
+            return None
+        return np.fromfile(os.path.join(self.snapshot_dir, entry[key]), dtype=dtype)
+
+    def _read_strings(self, entry: Dict[str, Any], prefix: str = '') -> np.ndarray:
+        return decode_strings(
+            self._read(entry, f'{prefix}data_file', np.uint8),
+            self._read(entry, f'{prefix}offsets_file', np.int64),
+            self._read(entry, f'{prefix}nulls_file', bool),
+        )
+
+    def read_column(self, column: str) -> Any:
+        """
+        Read a column as a numpy array, a `pd.Categorical` for dictionary encoded columns or an object array of
+        lists for list columns.
+        """
+        entry = self.manifest['columns'][column]
+        kind = entry['kind']
+        if kind == 'list':
+            list_offsets = self._read(entry, 'list_offsets_file', np.int64).tolist()
+            items = self._read_strings(entry, 'values_').tolist()
+            lists = np.empty(self.num_rows, dtype=object)
+            lists[:] = [items[start:end] for start, end in zip(list_offsets[:-1], list_offsets[1:])]
+            return lists
+        if kind == 'category':
+            categories = self._read_strings(entry, 'categories_')
+            return pd.Categorical.from_codes(self._read(entry, 'codes_file', np.int32), categories=categories)
+        if kind in ('bool', 'int', 'float'):
+            return self._read(entry, 'file', {'bool': bool, 'int': np.int64, 'float': np.float64}[kind])
+        return self._read_strings(entry)
+
+    def read(self, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """
+        Read the snapshot, or only the given columns of it, as a DataFrame.
+        """
+        columns = self.columns if columns is None else list(columns)
+        missing = [column for column in columns if column not in self.manifest['columns']]
+        if missing:
+            raise KeyError(f"Columns {missing} are not in the catalog snapshot")
+        return pd.DataFrame({column: self.read_column(column) for column in columns})
+
+    def __str__(self):
+        return (f"CatalogSnapshotReader(dir={self.snapshot_dir}, rows={self.num_rows}, "
+                f"columns={len(self.columns)}, catalog={str(self.catalog_version)[:12]})")
+
+
+def read_catalog_snapshot(
+    snapshot_dir: str = DEFAULT_SNAPSHOT_DIR,
+    columns: Optional[Sequence[str]] = None,
+    expected_catalog_version: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Read a columnar catalog snapshot, or only some of its columns, as a DataFrame.
+
+    Args:
+        snapshot_dir (str): The snapshot directory.
+        columns (Optional[Sequence[str]]): The columns to read, all by default.
+        expected_catalog_version (Optional[str]): Refuse to load a snapshot of another catalog version.
+
+    Returns:
+        pd.DataFrame: The courses, with list, categorical, bool and numeric columns.
+    """
+    return CatalogSnapshotReader(snapshot_dir, expected_catalog_version).read(columns)
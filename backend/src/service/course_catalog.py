@@ -0,0 +1,173 @@
+import hashlib
+import io
+import os
+import threading
+from typing import Dict, Optional, Union
+
+import pandas as pd
+
+from ..types.course_catalog import CourseCatalog
+from .catalog_snapshot import LIST_COLUMNS, MANIFEST_FILE, parse_list_column, read_catalog_snapshot
+
+DEFAULT_COURSES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'courses.csv')
+# Directory of the columnar snapshot written by `update_courses.py`, next to the CSV file
+SNAPSHOT_DIR_NAME = 'courses_snapshot'
+
+
+def read_courses_csv(source: Union[str, io.BytesIO]) -> pd.DataFrame:
+    """
+    Read the courses CSV with its list columns (`tags`, `classTime`) parsed into lists, like in the snapshot.
+    """
+    return pd.read_csv(source, converters={column: parse_list_column for column in LIST_COLUMNS})
+
+
+class CourseCatalogSnapshot:
+    """
+    A read-only snapshot of the course catalog.
+
+    The DataFrame is shared by every request of the process, so callers must never mutate it in place.
+    Copy it (or use ``DataFrame.assign``) before adding columns. The request path uses `catalog`, the same data
+    as read-only arrays with row id maps.
+    """
+
+    def __init__(
+        self,
+        courses_df: pd.DataFrame,
+        version: str,
+        path: str,
+        mtime_ns: int,
+        size: int,
+        catalog: Optional[CourseCatalog] = None,
+    ):
+        self.courses_df = courses_df
+        self.catalog = catalog if catalog is not None else CourseCatalog.from_dataframe(courses_df, version)
+        self.version = version
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.size = size
+
+    def __len__(self) -> int:
+        return len(self.courses_df)
+
+    def __str__(self):
+        return f"CourseCatalogSnapshot(version={self.version[:12]}, courses={len(self)}, path={self.path})"
+
+
+class CourseCatalogStore:
+    """
+    Process-wide holder of the course catalog.
+
+    The catalog is loaded once and reused until the mtime or size of the CSV file changes. On a change, the file is
+    re-read and its content hash is compared against the current version, so touching the file without
+    modifying it does not trigger a reload. The courses are read from the columnar snapshot (see
+    `catalog_snapshot`) when its catalog version is the hash of the CSV file, and parsed from the CSV otherwise.
+    """
+
+    def __init__(self, path: str = DEFAULT_COURSES_FILE, snapshot_dir: Optional[str] = None):
+        """
+        Args:
+            path (str): Path to the courses CSV file.
+            snapshot_dir (Optional[str]): The columnar snapshot of the catalog, `courses_snapshot` next to the CSV
+                file by default.
+        """
+        self.path = os.path.abspath(path)
+        self.snapshot_dir = snapshot_dir or os.path.join(os.path.dirname(self.path), SNAPSHOT_DIR_NAME)
+        self._lock = threading.Lock()
+        self._snapshot: Optional[CourseCatalogSnapshot] = None
+
+    def _is_fresh(self, snapshot: Optional[CourseCatalogSnapshot], stat: os.stat_result) -> bool:
+        return snapshot is not None and snapshot.mtime_ns == stat.st_mtime_ns and snapshot.size == stat.st_size
+
+    def _read_courses(self, raw: bytes, version: str) -> pd.DataFrame:
+        """
+        Read the courses from the snapshot of this CSV content, falling back to parsing the CSV.
+        """
+        if os.path.exists(os.path.join(self.snapshot_dir, MANIFEST_FILE)):
+            try:
+                columns = pd.read_csv(io.BytesIO(raw), nrows=0).columns.tolist()
+                courses_df = read_catalog_snapshot(self.snapshot_dir, columns, expected_catalog_version=version)
+                # The shared DataFrame keeps the dtypes of the CSV, so callers can e.g. fillna('') any text column
+                for column in courses_df.select_dtypes('category').columns:
+                    courses_df[column] = courses_df[column].astype(object)
+                print(f"Loading course catalog from {self.snapshot_dir}")
+                return courses_df
+            except (KeyError, ValueError) as e:
+                print(f"Warning: {str(e)}, reading {self.path} instead")
+
+        print(f"Loading course catalog from {self.path}")
+        return read_courses_csv(io.BytesIO(raw))
+
+    def get(self) -> CourseCatalogSnapshot:
+        """
+        Get the current catalog snapshot, reloading it only if the underlying file has changed.
+
+        Returns:
+            CourseCatalogSnapshot: The current snapshot.
+        """
+        stat = os.stat(self.path)
+        snapshot = self._snapshot
+        if self._is_fresh(snapshot, stat):
+            return snapshot
+
+        with self._lock:
+            # Another thread might have reloaded while we were waiting for the lock
+            stat = os.stat(self.path)
+            snapshot = self._snapshot
+            if self._is_fresh(snapshot, stat):
+                return snapshot
+
+            with open(self.path, 'rb') as f:
+                raw = f.read()
+            version = hashlib.sha256(raw).hexdigest()
+
+            if snapshot is not None and snapshot.version == version:
+                # Content unchanged, only refresh the file stat
+                courses_df, catalog = snapshot.courses_df, snapshot.catalog
+            else:
+                courses_df, catalog = self._read_courses(raw, version), None
+
+            self._snapshot = CourseCatalogSnapshot(
+                courses_df=courses_df,
+                version=version,
+                path=self.path,
+                mtime_ns=stat.st_mtime_ns,
+                size=stat.st_size,
+                catalog=catalog,
+            )
+            if snapshot is None or snapshot.version != version:
+                print(f"Course catalog loaded: {self._snapshot}")
+            return self._snapshot
+
+
+_stores: Dict[str, CourseCatalogStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_catalog_store(path: str = DEFAULT_COURSES_FILE) -> CourseCatalogStore:
+    """
+    Get the process-wide catalog store for a file.
+
+    Args:
+        path (str): Path to the courses CSV file.
+
+    Returns:
+        CourseCatalogStore: The shared store for the file.
+    """
+    key = os.path.abspath(path)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = CourseCatalogStore(key)
+        return _stores[key]
+
+
+def get_course_catalog(path: str = DEFAULT_COURSES_FILE) -> CourseCatalogSnapshot:
+    """
+    Get the current snapshot of the course catalog.
+
+    Args:
+        path (str): Path to the courses CSV file.
+
+    Returns:
+        CourseCatalogSnapshot: The current snapshot.
+    """
+    return get_catalog_store(path).get()
@@ -0,0 +1,95 @@
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from ..types.course_catalog import CourseCatalog
+
+
+class CourseFilterIndex:
+    """
+    Inverted index from structured course attributes to row ids.
+
+    Filters on grade, department, program tag and compulsory flag are resolved into a sorted array of candidate
+    row ids before any similarity is computed, so the scoring cost is proportional to the number of candidates.
+    """
+
+    # Index name -> catalog column
+    INDEXED_FIELDS = {
+        'grade': 'grade',
+        'department': 'department',
+        'tags': 'tags',
+        'compulsory': 'compulsory',
+    }
+    # Indexes of list columns, every item of a course's list is a key
+    LIST_FIELDS = {'tags'}
+
+    def __init__(self, courses: Union[CourseCatalog, pd.DataFrame]):
+        self.num_rows = len(courses)
+        self.index: Dict[str, Dict[Any, np.ndarray]] = {}
+
+        for field, column in self.INDEXED_FIELDS.items():
+            if column not in courses.columns:
+                continue
+
+            postings: Dict[Any, List[int]] = {}
+            for row, value in enumerate(courses[column].tolist()):
+                if field in self.LIST_FIELDS and isinstance(value, str):
+                    raise ValueError(f"Column '{column}' holds text instead of lists, load the catalog with "
+                                     f"`get_course_catalog` or `read_courses_csv`")
+                values = value if field in self.LIST_FIELDS else [value]
+                for item in values:
+                    key = self.normalize_value(field, item)
+                    if key is not None:
+                        postings.setdefault(key, []).append(row)
+
+            self.index[field] = {key: np.asarray(rows, dtype=np.int64) for key, rows in postings.items()}
+
+    @staticmethod
+    def normalize_value(field: str, value: Any) -> Optional[Any]:
+        """
+        Normalize a catalog or query value into an index key, e.g. a grade of 4, 4.0 or "4" becomes 4.
+        """
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            return None
+        if field == 'grade':
+            try:
+                return int(float(value))
+            except (TypeError, ValueError):
+                return None
+        if field == 'compulsory':
+            if isinstance(value, str):
+                return value.strip().lower() in ('true', '1', '必修')
+            return bool(value)
+        value = str(value).strip()
+        return value if value else None
+
+    def lookup(self, field: str, value: Any) -> np.ndarray:
+        """
+        Get the sorted row ids of the courses whose field matches the value.
+        """
+        key = self.normalize_value(field, value)
+        return self.index.get(field, {}).get(key, np.empty(0, dtype=np.int64))
+
+    def candidates(self, filters: Dict[str, Any]) -> Optional[np.ndarray]:
+        """
+        Resolve filters into the sorted row ids matching all of them.
+
+        Args:
+            filters (Dict[str, Any]): Index name to the required value. A list of values matches any of them.
+
+        Returns:
+            Optional[np.ndarray]: The candidate row ids, or None when no filter applies (all rows are candidates).
+        """
+        candidate_rows = None
+        for field, value in filters.items():
+            if field not in self.index:
+                print(f"Warning: No index for filter '{field}', ignored")
+                continue
+
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            postings = [self.lookup(field, item) for item in values]
+            rows = np.unique(np.concatenate(postings)) if postings else np.empty(0, dtype=np.int64)
+            candidate_rows = rows if candidate_rows is None else np.intersect1d(candidate_rows, rows,
+                                                                                 assume_unique=True)
+        return candidate_rows
@@ -0,0 +1,368 @@
+import hashlib
+import json
+import os
+import warnings
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+EMBEDDING_STORE_FORMAT_VERSION = 3
+# Version 1 stores only have dense fields and version 2 stores have no text hashes, they are read as is
+SUPPORTED_FORMAT_VERSIONS = (1, 2, 3)
+MANIFEST_FILE = 'manifest.json'
+SUPPORTED_DTYPES = ('float16', 'int8')
+# Number of bytes of the sha256 digest kept as the content hash of an embedded text
+TEXT_HASH_BYTES = 16
+
+
+def normalize_rows(embeddings: np.ndarray) -> np.ndarray:
+    """
+    L2-normalize each row, all-zero rows are kept as is.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.where(norms > 0, norms, 1.0)
+
+
+def quantize_int8(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Quantize each row to int8 with its own scale, so that `quantized * scales[:, None]` approximates the input.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The [rows x dim] int8 values and the [rows] float32 scales.
+    """
+    scales = np.abs(embeddings).max(axis=-1) / 127.0
+    scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+    quantized = np.clip(np.rint(embeddings / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales
+
+
+def factorize_texts(texts: List[str]) -> Tuple[List[str], np.ndarray]:
+    """
+    Split the texts of a low-cardinality field into its sorted unique values and the value index of each row.
+
+    Returns:
+        Tuple[List[str], np.ndarray]: The unique values and the [rows] int32 index into them.
+    """
+    values, index = np.unique(np.asarray(texts, dtype=object).astype(str), return_inverse=True)
+    return values.tolist(), index.astype(np.int32)
+
+
+def hash_texts(texts: List[str]) -> np.ndarray:
+    """
+    Get the content hash of each text as a [texts x TEXT_HASH_BYTES] uint8 array.
+    """
+    digests = b''.join(hashlib.sha256(text.encode('utf-8')).digest()[:TEXT_HASH_BYTES] for text in texts)
+    return np.frombuffer(digests, dtype=np.uint8).reshape(-1, TEXT_HASH_BYTES)
+
+
+def match_hashes(previous_hashes: Optional[np.ndarray], hashes: np.ndarray) -> np.ndarray:
+    """
+    Find the row of each hash in a previous set of hashes.
+
+    Returns:
+        np.ndarray: The previous row of each hash, or -1 if the text is new or changed.
+    """
+    rows = np.full(len(hashes), -1, dtype=np.int64)
+    if previous_hashes is None:
+        return rows
+    previous_rows = {digest.tobytes(): row for row, digest in enumerate(previous_hashes)}
+    for i, digest in enumerate(hashes):
+        rows[i] = previous_rows.get(digest.tobytes(), -1)
+    return rows
+
+
+class FieldArrays:
+    """
+    The stored arrays of one field: the normalized embeddings in the storage dtype, the per-row scales of int8
+    embeddings, the course-to-value index of a factorized field and the content hash of each embedded text.
+    """
+
+    def __init__(
+        self,
+        data: np.ndarray,
+        hashes: Optional[np.ndarray] = None,
+        scales: Optional[np.ndarray] = None,
+        index: Optional[np.ndarray] = None,
+    ):
+        self.data = data
+        self.hashes = hashes
+        self.scales = scales
+        self.index = index
+
+    @classmethod
+    def from_embeddings(
+        cls,
+        embeddings: np.ndarray,
+        dtype: str,
+        hashes: Optional[np.ndarray] = None,
+        index: Optional[np.ndarray] = None,
+    ) -> 'FieldArrays':
+        """
+        Normalize and convert float embeddings to the storage dtype ('float16', or 'int8' with per-row scales).
+        """
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported embedding dtype: {dtype}, expected one of {SUPPORTED_DTYPES}")
+        embeddings = normalize_rows(embeddings)
+        if dtype == 'int8':
+            data, scales = quantize_int8(embeddings)
+            return cls(data, hashes=hashes, scales=scales, index=index)
+        return cls(embeddings.astype(dtype), hashes=hashes, index=index)
+
+    @classmethod
+    def merge(
+        cls,
+        hashes: np.ndarray,
+        previous: Optional['FieldArrays'],
+        previous_rows: np.ndarray,
+        encoded: Optional['FieldArrays'],
+        index: Optional[np.ndarray] = None,
+    ) -> 'FieldArrays':
+        """
+        Assemble a field from reused rows of a previous store and newly encoded rows.
+
+        Reused rows are copied as stored, so unchanged texts keep exactly the same bytes.
+
+        Args:
+            hashes (np.ndarray): The content hash of each embedded text.
+            previous (Optional[FieldArrays]): The field in the previous store.
+            previous_rows (np.ndarray): The previous row of each text, -1 for the encoded ones.
+            encoded (Optional[FieldArrays]): The newly encoded texts, in order of appearance.
+            index (Optional[np.ndarray]): The course-to-value index of a factorized field.
+        """
+        reused = np.flatnonzero(previous_rows >= 0)
+        missing = np.flatnonzero(previous_rows < 0)
+        source = encoded if encoded is not None else previous
+
+        data = np.empty((len(hashes), source.data.shape[1]), dtype=source.data.dtype)
+        scales = None if source.scales is None else np.empty(len(hashes), dtype=np.float32)
+        if len(reused):
+            data[reused] = previous.data[previous_rows[reused]]
+            if scales is not None:
+                scales[reused] = previous.scales[previous_rows[reused]]
+        if len(missing):
+            data[missing] = encoded.data
+            if scales is not None:
+                scales[missing] = encoded.scales
+        return cls(data, hashes=hashes, scales=scales, index=index)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    @property
+    def dtype(self) -> str:
+        return str(self.data.dtype)
+
+
+def manifest_files(manifest: Dict) -> List[str]:
+    """
+    Get the names of the array files referenced by a manifest.
+    """
+    return [name for entry in manifest.get('fields', {}).values()
+            for key, name in entry.items() if key.endswith('file')]
+
+
+def write_embedding_store(
+    output_dir: str,
+    fields: Dict[str, FieldArrays],
+    model_name: str,
+    catalog_version: Optional[str],
+):
+    """
+    Write the fields as raw array files plus a JSON manifest.
+
+    Every write is a new generation: the array files are tagged with the generation number, the manifest is
+    atomically replaced last, and only then the files of the previous generation are removed. A reader therefore
+    always sees a complete store, either the previous or the new one.
+
+    Args:
+        output_dir (str): The store directory, created if missing.
+        fields (Dict[str, FieldArrays]): The arrays of each field.
+        model_name (str): The sentence transformer the embeddings were computed with.
+        catalog_version (Optional[str]): Content hash of the catalog the embeddings belong to.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    previous_manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            previous_manifest = json.load(f)
+    generation = previous_manifest.get('generation', 0) + 1
+
+    def write_array(array: np.ndarray, name: str) -> str:
+        path = os.path.join(output_dir, name)
+        with open(path, 'wb') as f:
+            np.ascontiguousarray(array).tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        return name
+
+    num_rows, dim, dtype = None, None, None
+    entries = {}
+    for field, arrays in fields.items():
+        rows = len(arrays.index) if arrays.index is not None else len(arrays)
+        if num_rows is None:
+            num_rows, dim, dtype = rows, arrays.data.shape[1], arrays.dtype
+        if rows != num_rows or arrays.data.shape[1] != dim or arrays.dtype != dtype:
+            raise ValueError(f"Field {field} has {rows} rows of dim {arrays.data.shape[1]} ({arrays.dtype}), "
+                             f"expected {num_rows} rows of dim {dim} ({dtype})")
+
+        prefix = f"{field}.g{generation}"
+        entry = {'file': write_array(arrays.data, f"{prefix}.{dtype}")}
+        if arrays.scales is not None:
+            entry['scales_file'] = write_array(arrays.scales.astype(np.float32), f"{prefix}.scales.float32")
+        if arrays.index is not None:
+            entry['num_values'] = len(arrays)
+            entry['index_file'] = write_array(arrays.index.astype(np.int32), f"{prefix}.index.int32")
+        if arrays.hashes is not None:
+            entry['hashes_file'] = write_array(arrays.hashes, f"{prefix}.hashes.bin")
+        entries[field] = entry
+
+    manifest = {
+        'format_version': EMBEDDING_STORE_FORMAT_VERSION,
+        'generation': generation,
+        'model_name': model_name,
+        'dim': int(dim),
+        'num_rows': int(num_rows),
+        'dtype': dtype,
+        'catalog_version': catalog_version,
+        'fields': entries,
+    }
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, manifest_path)
+
+    # Processes still mapping the previous generation keep their pages until they reload
+    current_files = set(manifest_files(manifest))
+    for name in manifest_files(previous_manifest):
+        if name not in current_files:
+            try:
+                os.remove(os.path.join(output_dir, name))
+            except OSError as e:
+                print(f"Warning: Failed to remove stale embedding file {name}: {str(e)}")
+
+
+class EmbeddingStore:
+    """
+    Read-only view of an embedding store written by `write_embedding_store`.
+
+    float16 and int8 fields are memory-mapped, so opening the store does not read the files and every process
+    scoring against the same store shares the page cache. Only the float32 per-row scales of int8 fields are read
+    into memory, scores are computed against the int8 values and scaled afterwards.
+
+    Factorized fields hold the embeddings of their unique values in `fields` and the value of each course in
+    `indices`.
+    """
+
+    def __init__(self, store_dir: str, expected_catalog_version: Optional[str] = None):
+        """
+        Args:
+            store_dir (str): The store directory.
+            expected_catalog_version (Optional[str]): Content hash of the loaded catalog. The store refuses to load
+                (ValueError) if it was computed for another catalog.
+        """
+        self.store_dir = store_dir
+        manifest_path = os.path.join(store_dir, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(f"No embedding store at {store_dir}, please run the precompute script.")
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+
+        if self.manifest.get('format_version') not in SUPPORTED_FORMAT_VERSIONS:
+            raise ValueError(f"Unsupported embedding store format {self.manifest.get('format_version')} "
+                             f"in {store_dir}, please rerun the precompute script.")
+
+        self.model_name: str = self.manifest['model_name']
+        self.dim: int = self.manifest['dim']
+        self.num_rows: int = self.manifest['num_rows']
+        self.dtype: str = self.manifest['dtype']
+        self.catalog_version: Optional[str] = self.manifest.get('catalog_version')
+        self.generation: int = self.manifest.get('generation', 0)
+
+        if expected_catalog_version is not None and self.catalog_version != expected_catalog_version:
+            stored = self.catalog_version[:12] if self.catalog_version else None
+            raise ValueError(f"Embeddings in {store_dir} were computed for catalog {stored}, but the current "
+                             f"catalog is {expected_catalog_version[:12]}. Please rerun the precompute script.")
+
+        self.fields: Dict[str, np.ndarray] = {
+            field: self._map_data(entry) for field, entry in self.manifest['fields'].items()
+        }
+        self.scales: Dict[str, np.ndarray] = {
+            field: np.fromfile(self._path(entry['scales_file']), dtype=np.float32)
+            for field, entry in self.manifest['fields'].items() if 'scales_file' in entry
+        }
+        self.indices: Dict[str, np.ndarray] = {
+            field: np.fromfile(os.path.join(store_dir, entry['index_file']), dtype=np.int32).astype(np.int64)
+            for field, entry in self.manifest['fields'].items() if 'index_file' in entry
+        }
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.store_dir, name)
+
+    def _map_data(self, entry: Dict[str, str]) -> np.ndarray:
+        shape = (entry.get('num_values', self.num_rows), self.dim)
+        return np.memmap(self._path(entry['file']), dtype=self.dtype, mode='r', shape=shape)
+
+    @property
+    def field_names(self):
+        return list(self.fields.keys())
+
+    def is_factorized(self, field: str) -> bool:
+        return field in self.indices
+
+    def field_tensor(self, field: str) -> torch.Tensor:
+        """
+        Get the [courses x dim] (or [values x dim] if factorized) normalized embeddings of a field in the storage
+        dtype, as a tensor sharing the store memory. The rows of an int8 field are scaled by `scales_tensor`.
+        """
+        with warnings.catch_warnings():
+            # The memory map is read-only on purpose, the tensors are never written to
+            warnings.filterwarnings('ignore', message='The given NumPy array is not writable')
+            return torch.from_numpy(self.fields[field])
+
+    def scales_tensor(self, field: str) -> Optional[torch.Tensor]:
+        """
+        Get the per-row scales of an int8 field, None for a float16 field.
+        """
+        return torch.from_numpy(self.scales[field]) if field in self.scales else None
+
+    def float_embeddings(self, field: str, expand: bool = False) -> np.ndarray:
+        """
+        Read the embeddings of a field into a private float32 array, with the int8 values scaled back.
+
+        Args:
+            field (str): The field.
+            expand (bool): Give the [courses x dim] embeddings of a factorized field instead of those of its values.
+        """
+        embeddings = np.asarray(self.fields[field], dtype=np.float32)
+        if field in self.scales:
+            embeddings = embeddings * self.scales[field][:, None]
+        if expand and field in self.indices:
+            embeddings = embeddings[self.indices[field]]
+        return embeddings
+
+    def index_tensor(self, field: str) -> torch.Tensor:
+        """
+        Get the [courses] value index of a factorized field.
+        """
+        return torch.from_numpy(self.indices[field])
+
+    def field_arrays(self, field: str) -> FieldArrays:
+        """
+        Get the stored arrays of a field as written, e.g. to reuse unchanged rows in the next generation.
+        """
+        entry = self.manifest['fields'][field]
+        scales = self.scales.get(field)
+        hashes = None
+        if 'hashes_file' in entry:
+            hashes = np.fromfile(self._path(entry['hashes_file']), dtype=np.uint8).reshape(-1, TEXT_HASH_BYTES)
+        return FieldArrays(self._map_data(entry), hashes=hashes, scales=scales, index=self.indices.get(field))
+
+    def __str__(self):
+        return f"EmbeddingStore(model={self.model_name}, fields={len(self.fields)}, " \
+               f"factorized={len(self.indices)}, rows={self.num_rows}, dim={self.dim}, dtype={self.dtype}, " \
+               f"generation={self.generation})"
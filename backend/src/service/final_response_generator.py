@@ -1,9 +1,11 @@
 import os
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, List, Sequence, Union
 
 import pandas as pd
 from dotenv import load_dotenv
-from groq import Groq
+
+from .llm_gateway import get_llm_gateway
+from ..types.course_catalog import CourseCatalog, CourseRecord
 
 # Load environment variables
 load_dotenv()
@@ -38,25 +40,30 @@ def get_column_display_name(column: str) -> str:
 
 
 def format_prompt(
-    data: pd.DataFrame,
+    data: Union[Sequence[CourseRecord], pd.DataFrame],
     query_dict: Dict[str, str],
     last_user_message: str,
     max_columns: int = 10,
 ) -> str:
     """
-    Dynamically format the prompt with relevant information from the DataFrame.
+    Dynamically format the prompt with relevant information from the courses.
 
     Args:
-        data (pd.DataFrame): DataFrame containing course information
+        data (Union[Sequence[CourseRecord], pd.DataFrame]): The course records (e.g.
+            `RankedCourses.top_records`) or a DataFrame containing course information
         query_dict (Dict[str, str]): Query parameters used for filtering
         last_user_message (str): The last message from the user
-        max_columns (int): Maximum number of columns to display
+        max_columns (int): Maximum number of courses to display
 
     Returns:
         str: Dynamically formatted prompt in a markdown-like structure
     """
-    # Cut down the number of columns to display
-    data = data.head(max_columns)
+    # Cut down the number of courses to display
+    if isinstance(data, pd.DataFrame):
+        data = data.head(max_columns)
+        courses = CourseCatalog.from_dataframe(data).records(range(len(data)))
+    else:
+        courses = list(data[:max_columns])
 
     # Format query details
     query_details = f"### 用戶請求\n- **最後一條消息**: {last_user_message}\n"
@@ -71,14 +78,14 @@ def format_prompt(
         'syllabus', 'objectives', 'tags'
     ]
 
-    # Ensure these columns exist, use those that do
-    available_columns = [col for col in key_columns if col in data.columns]
-
     # Format course information
     course_details = "### 課程檢索結果\n"
-    for _, course in data.iterrows():
+    for course in courses:
         course_details += "#### 課程詳細資訊\n"
 
+        # Ensure these columns exist, use those that do
+        available_columns = [col for col in key_columns if col in course]
+
         for col in available_columns:
             # Handle different column types and formats
             value = course.get(col, '無')
@@ -99,7 +106,7 @@ def format_prompt(
             course_details += f"- **{get_column_display_name(col)}**: {value}\n"
 
         # Add any additional dynamic columns not in the predefined list
-        additional_columns = set(course.index) - set(available_columns)
+        additional_columns = [col for col in course.keys() if col not in available_columns]
         if additional_columns:
             course_details += "\n#### 其他資訊\n"
             for col in additional_columns:
@@ -133,27 +140,37 @@ def format_prompt(
     return full_prompt
 
 
+FINAL_RESPONSE_MODEL = "llama-3.3-70b-versatile"
+FINAL_RESPONSE_SYSTEM_PROMPT = (
+    "你是一位智能課程推薦助手。根據用戶提供的查詢與數據，生成必要且精確的課程建議。  "
+    "如果用戶有疑問，請利用檢所提供的資訊進行回答。  "
+    "若資訊不足，請提出具體的後續問題，確保結果更符合用戶需求。  "
+    "回應應簡潔明瞭，避免冗餘內容。"
+)
+
+
+def build_groq_messages(prompt: str) -> List[Dict[str, str]]:
+    """
+    Build the message list sent to Groq for the final response.
+    """
+    return [
+        {"role": "system", "content": FINAL_RESPONSE_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+
 def connect_to_groq(api_key: str, prompt: str) -> Dict[str, Any]:
     """
     Connect to Groq and get a response based on the provided prompt.
     """
-    # Initialize Groq client
-    client = Groq(api_key=api_key)
+    # Get the shared LLM gateway
+    gateway = get_llm_gateway(api_key)
 
     try:
-        response = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[
-                {
-                    "role": "system",
-                    "content":
-                        "你是一位智能課程推薦助手。根據用戶提供的查詢與數據，生成必要且精確的課程建議。  "
-                        "如果用戶有疑問，請利用檢所提供的資訊進行回答。  "
-                        "若資訊不足，請提出具體的後續問題，確保結果更符合用戶需求。  "
-                        "回應應簡潔明瞭，避免冗餘內容。"
-                },
-                {"role": "user", "content": prompt}
-            ],
+        response = gateway.chat_completion(
+            name="final_response",
+            model=FINAL_RESPONSE_MODEL,
+            messages=build_groq_messages(prompt),
             max_tokens=4096,
         )
 
@@ -168,8 +185,41 @@ def connect_to_groq(api_key: str, prompt: str) -> Dict[str, Any]:
         return {"error": str(e)}
 
 
+def stream_from_groq(api_key: str, prompt: str) -> Iterator[Dict[str, str]]:
+    """
+    Connect to Groq and stream the response tokens as they are generated.
+
+    Set the `LLM_BASE_URL` environment variable to point the gateway to another OpenAI compatible server,
+    e.g. `scripts/fake_llm_server.py` for local testing.
+
+    Yields:
+        Dict[str, str]: A dictionary with a 'token' key for each generated chunk, or an 'error' key on failure.
+    """
+    # Get the shared LLM gateway
+    gateway = get_llm_gateway(api_key)
+
+    try:
+        stream = gateway.stream_chat_completion(
+            name="final_response_stream",
+            model=FINAL_RESPONSE_MODEL,
+            messages=build_groq_messages(prompt),
+            max_tokens=4096,
+        )
+
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            token = chunk.choices[0].delta.content
+            if token:
+                yield {"token": token}
+
+    except Exception as e:
+        print(f"Error streaming from Groq: {str(e)}")
+        yield {"error": str(e)}
+
+
 def generate_final_response(
-    data: pd.DataFrame,
+    data: Union[Sequence[CourseRecord], pd.DataFrame],
     query_dict: Dict[str, str],
     last_user_message: str,
 ) -> Dict[str, str]:
@@ -177,7 +227,7 @@ def generate_final_response(
     Generate the final response using the Groq API.
 
     Args:
-        data (pd.DataFrame): DataFrame containing course information
+        data (Union[Sequence[CourseRecord], pd.DataFrame]): The courses to recommend, see `format_prompt`
         query_dict (Dict[str, str]): Query parameters used for filtering
         last_user_message (str): The last message from the user
 
@@ -198,6 +248,37 @@ def generate_final_response(
     return connect_to_groq(api_key, prompt)
 
 
+def stream_final_response(
+    data: Union[Sequence[CourseRecord], pd.DataFrame],
+    query_dict: Dict[str, str],
+    last_user_message: str,
+) -> Iterator[Dict[str, str]]:
+    """
+    Stream the final response using the Groq API.
+
+    Args:
+        data (Union[Sequence[CourseRecord], pd.DataFrame]): The courses to recommend, see `format_prompt`
+        query_dict (Dict[str, str]): Query parameters used for filtering
+        last_user_message (str): The last message from the user
+
+    Yields:
+        Dict[str, str]: A dictionary with a 'token' key for each generated chunk, or an 'error' key on failure.
+    """
+    # Get API Key
+    api_key = os.getenv('GROQ_API_KEY')
+
+    if not api_key or api_key == 'YOUR_GROQ_API_KEY_HERE':
+        print("Warning: No valid API Key")
+        yield {"error": "Invalid API Key"}
+        return
+
+    # Format the prompt
+    prompt = format_prompt(data, query_dict, last_user_message)
+
+    # Connect to Groq and stream the response
+    yield from stream_from_groq(api_key, prompt)
+
+
 # For self-testing below is an example of how you might call this function
 if __name__ == "__main__":
     # Sample data
@@ -0,0 +1,302 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from groq import Groq, APIConnectionError, APIStatusError
+
+# Load environment variables
+load_dotenv()
+
+# Status codes worth retrying: request timeout, conflict, rate limit and server errors
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+
+class LLMCallStats:
+    """
+    Latency and token usage of a single LLM call.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        model: str,
+        latency: float,
+        attempts: int,
+        first_token_latency: Optional[float] = None,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        error: Optional[str] = None,
+    ):
+        self.name = name
+        self.model = model
+        self.latency = latency
+        self.attempts = attempts
+        self.first_token_latency = first_token_latency
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.error = error
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'model': self.model,
+            'latency': self.latency,
+            'firstTokenLatency': self.first_token_latency,
+            'attempts': self.attempts,
+            'promptTokens': self.prompt_tokens,
+            'completionTokens': self.completion_tokens,
+            'totalTokens': self.total_tokens,
+            'error': self.error,
+        }
+
+    def __str__(self):
+        status = f"error={self.error}" if self.error else f"tokens={self.prompt_tokens}+{self.completion_tokens}"
+        return f"LLMCallStats(name={self.name}, model={self.model}, latency={self.latency:.3f}s, " \
+               f"attempts={self.attempts}, {status})"
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """
+    Check whether an error from the Groq client is transient and worth retrying.
+    """
+    if isinstance(error, APIConnectionError):  # Also covers timeouts
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return False
+
+
+def extract_usage(usage: Any) -> Tuple[int, int]:
+    """
+    Extract prompt and completion token counts from a usage object.
+    """
+    if usage is None:
+        return 0, 0
+    return getattr(usage, 'prompt_tokens', 0) or 0, getattr(usage, 'completion_tokens', 0) or 0
+
+
+class LLMGateway:
+    """
+    Shared client for all LLM calls of the process.
+
+    A single Groq client (and its HTTP connection pool) is reused by every call, so connections are kept alive
+    between requests. The gateway also bounds the number of concurrent calls, applies per-call timeouts, retries
+    transient errors with jittered exponential backoff and records latency and token usage of every call.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: Optional[str] = None,
+        max_concurrency: int = 8,
+        timeout: float = 60.0,
+        max_retries: int = 2,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        max_connections: int = 20,
+        stats_history: int = 1000,
+    ):
+        """
+        Args:
+            api_key (str): The Groq API key.
+            base_url (Optional[str]): Endpoint of an OpenAI compatible server. Defaults to the Groq API.
+            max_concurrency (int): Maximum number of in-flight calls, further calls wait for a free slot.
+            timeout (float): Default timeout of a call in seconds.
+            max_retries (int): Maximum number of retries of a call on transient errors.
+            backoff_base (float): Base delay of the exponential backoff in seconds.
+            backoff_max (float): Maximum delay between two attempts in seconds.
+            max_connections (int): Size of the HTTP connection pool.
+            stats_history (int): Number of recent call stats to keep.
+        """
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        http_client = httpx.Client(
+            timeout=httpx.Timeout(timeout, connect=5.0),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        # Retries are handled by the gateway to apply the same policy to normal and streaming calls
+        self.client = Groq(api_key=api_key, base_url=base_url, max_retries=0, http_client=http_client)
+
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._stats_lock = threading.Lock()
+        self._recent_stats = deque(maxlen=stats_history)
+        self._totals: Dict[str, Dict[str, float]] = {}
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """
+        Compute the delay before the next attempt with full jitter.
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _record(self, stats: LLMCallStats):
+        print(stats)
+        with self._stats_lock:
+            self._recent_stats.append(stats)
+            totals = self._totals.setdefault(stats.name, {
+                'calls': 0, 'errors': 0, 'latency': 0.0, 'promptTokens': 0, 'completionTokens': 0,
+            })
+            totals['calls'] += 1
+            totals['errors'] += 1 if stats.error else 0
+            totals['latency'] += stats.latency
+            totals['promptTokens'] += stats.prompt_tokens
+            totals['completionTokens'] += stats.completion_tokens
+
+    def _create_with_retry(self, timeout: Optional[float], **kwargs) -> Tuple[Any, int]:
+        """
+        Create a chat completion, retrying transient errors.
+
+        Returns:
+            Tuple[Any, int]: The completion (or stream) and the number of attempts.
+        """
+        attempt = 0
+        while True:
+            try:
+                response = self.client.chat.completions.create(timeout=timeout or self.timeout, **kwargs)
+                return response, attempt + 1
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable_error(e):
+                    e.attempts = attempt + 1
+                    raise
+                delay = self._backoff_delay(attempt)
+                print(f"LLM call failed ({e.__class__.__name__}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
+
+    def chat_completion(self, name: str, timeout: Optional[float] = None, **kwargs) -> Any:
+        """
+        Create a chat completion.
+
+        Args:
+            name (str): Name of the call site, used to group the usage accounting.
+            timeout (Optional[float]): Timeout of this call in seconds. Defaults to the gateway timeout.
+            **kwargs: Arguments passed to `chat.completions.create`.
+
+        Returns:
+            The chat completion.
+        """
+        model = kwargs.get('model', '')
+        with self._semaphore:
+            start = time.perf_counter()
+            try:
+                response, attempts = self._create_with_retry(timeout, **kwargs)
+            except Exception as e:
+                self._record(LLMCallStats(name, model, time.perf_counter() - start,
+                                          attempts=getattr(e, 'attempts', 1), error=str(e)))
+                raise
+
+            prompt_tokens, completion_tokens = extract_usage(getattr(response, 'usage', None))
+            self._record(LLMCallStats(name, model, time.perf_counter() - start, attempts,
+                                      prompt_tokens=prompt_tokens, completion_tokens=completion_tokens))
+            return response
+
+    def stream_chat_completion(self, name: str, timeout: Optional[float] = None, **kwargs) -> Iterator[Any]:
+        """
+        Create a streaming chat completion and yield its chunks.
+
+        Only opening the stream is retried, an error in the middle of the stream is raised to the caller.
+        The concurrency slot is held until the stream is exhausted or closed.
+
+        Args:
+            name (str): Name of the call site, used to group the usage accounting.
+            timeout (Optional[float]): Timeout of this call in seconds. Defaults to the gateway timeout.
+            **kwargs: Arguments passed to `chat.completions.create`.
+
+        Yields:
+            The chat completion chunks.
+        """
+        model = kwargs.get('model', '')
+        with self._semaphore:
+            start = time.perf_counter()
+            attempts = 1
+            first_token_latency = None
+            prompt_tokens, completion_tokens = 0, 0
+            try:
+                stream, attempts = self._create_with_retry(timeout, stream=True, **kwargs)
+                try:
+                    for chunk in stream:
+                        if first_token_latency is None:
+                            first_token_latency = time.perf_counter() - start
+                        # Groq reports the usage in the last chunk
+                        x_groq = getattr(chunk, 'x_groq', None)
+                        if x_groq is not None and getattr(x_groq, 'usage', None) is not None:
+                            prompt_tokens, completion_tokens = extract_usage(x_groq.usage)
+                        yield chunk
+                finally:
+                    # Release the connection back to the pool even if the consumer stops early
+                    stream.close()
+            except Exception as e:
+                self._record(LLMCallStats(name, model, time.perf_counter() - start,
+                                          attempts=getattr(e, 'attempts', attempts),
+                                          first_token_latency=first_token_latency, error=str(e)))
+                raise
+
+            self._record(LLMCallStats(name, model, time.perf_counter() - start, attempts,
+                                      first_token_latency=first_token_latency,
+                                      prompt_tokens=prompt_tokens, completion_tokens=completion_tokens))
+
+    def get_recent_stats(self) -> List[LLMCallStats]:
+        """
+        Get the stats of the most recent calls, oldest first.
+        """
+        with self._stats_lock:
+            return list(self._recent_stats)
+
+    def get_usage_summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Get the accumulated call count, errors, latency and token usage per call site.
+        """
+        with self._stats_lock:
+            summary = {}
+            for name, totals in self._totals.items():
+                summary[name] = {
+                    **totals,
+                    'averageLatency': totals['latency'] / totals['calls'] if totals['calls'] else 0.0,
+                }
+            return summary
+
+
+_gateways: Dict[Tuple[str, Optional[str]], LLMGateway] = {}
+_gateways_lock = threading.Lock()
+
+
+def get_llm_gateway(api_key: str) -> LLMGateway:
+    """
+    Get the process-wide LLM gateway for an API key.
+
+    The gateway is configured from the environment:
+        - `LLM_BASE_URL` (or `GROQ_BASE_URL`): Endpoint of an OpenAI compatible server, e.g. a local stand-in.
+        - `LLM_MAX_CONCURRENCY`: Maximum number of in-flight calls. Default: 8
+        - `LLM_TIMEOUT`: Default timeout of a call in seconds. Default: 60
+        - `LLM_MAX_RETRIES`: Maximum number of retries on transient errors. Default: 2
+
+    Args:
+        api_key (str): The Groq API key.
+
+    Returns:
+        LLMGateway: The shared gateway.
+    """
+    base_url = os.getenv('LLM_BASE_URL') or os.getenv('GROQ_BASE_URL') or None
+    key = (api_key, base_url)
+    with _gateways_lock:
+        if key not in _gateways:
+            _gateways[key] = LLMGateway(
+                api_key=api_key,
+                base_url=base_url,
+                max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', '8')),
+                timeout=float(os.getenv('LLM_TIMEOUT', '60')),
+                max_retries=int(os.getenv('LLM_MAX_RETRIES', '2')),
+            )
+        return _gateways[key]
@@ -1,9 +1,13 @@
+import hashlib
 import json
 import os
+import unicodedata
 from typing import List, Dict, TYPE_CHECKING
 
 from dotenv import load_dotenv
-from groq import Groq
+
+from .cache import LRUCache
+from .llm_gateway import get_llm_gateway
 
 if TYPE_CHECKING:
     from backend.src.types.chat_types import Message
@@ -36,6 +40,74 @@ def read_system_prompt(file_path: str = './prompt.txt') -> str:
         """
 
 
+COURSE_QUERY_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "course_query",
+        "description": "Search and retrieve course information based on specified parameters. You must select at least one parameter.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "teacher": {
+                    "type": "string",
+                    "description": "Name of the course teacher or instructor. Provide the name if the course has a specific instructor."
+                },
+                "keywords": {
+                    "type": "string",
+                    "description": "Name or keyword for the course (excluding teacher's name). Notice: The user might contain typos or abbreviations you need to correct them into correct keywords.",
+                    "default": "course recommendation"
+                },
+                "department": {
+                    "type": "string",
+                    "description": "Department offering the course."
+                },
+                "program": {
+                    "type": "string",
+                    "description": "Academic program to which the course belongs."
+                },
+                "grade": {
+                    "type": "number",
+                    "description": "Targeted grade or year of students for the course."
+                },
+            },
+            "required": []
+        }
+    }
+}
+
+# Cache of structured queries, keyed by the normalized conversation and the model
+query_cache = LRUCache(
+    max_size=int(os.getenv('QUERY_CACHE_SIZE', '2048')),
+    ttl=float(os.getenv('QUERY_CACHE_TTL', str(24 * 60 * 60))),
+    persist_path=os.getenv('QUERY_CACHE_FILE') or None,
+)
+
+
+def normalize_message_content(content: str) -> str:
+    """
+    Normalize message content so that trivially different messages share a cache entry.
+    Full-width characters are folded, letters are lower-cased and whitespace is collapsed.
+    """
+    return " ".join(unicodedata.normalize('NFKC', content).lower().split())
+
+
+def build_query_cache_key(messages: List['Message'], model: str, system_prompt: str) -> str:
+    """
+    Build the cache key of a conversation. The system prompt and the tool schema are part of the key, so editing
+    them invalidates the cached queries.
+    """
+    payload = {
+        "model": model,
+        "system_prompt": system_prompt,
+        "tool": COURSE_QUERY_TOOL,
+        "messages": [[msg.role, normalize_message_content(msg.content)] for msg in messages],
+    }
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# Model of the query generation
+QUERY_MODEL = "llama-3.3-70b-versatile"
+
 """
 Available models:
 - gemma2-9b-it
@@ -46,89 +118,89 @@ Available models:
 """
 
 
-def generate_potential_query(messages: List['Message'], model: str = "llama-3.3-70b-versatile") -> Dict[str, str]:
+class QueryGenerationError(Exception):
     """
-    Convert dialog to potential query using Groq
+    The LLM did not return a structured query.
+    """
+
+
+def request_potential_query(messages: List['Message'], model: str = QUERY_MODEL) -> Dict[str, str]:
+    """
+    Convert dialog to potential query using Groq, without the fallback query of `generate_potential_query`.
+
+    Raises:
+        QueryGenerationError: If there is no valid API key, the call fails or the model does not call the tool.
     """
     # Get API Key
     api_key = os.getenv('GROQ_API_KEY')
 
     if not api_key or api_key == 'YOUR_GROQ_API_KEY_HERE':
-        print("Warning: No valid API Key")
-        return {"name": "course recommendation"}
+        raise QueryGenerationError("No valid API Key")
 
     # Read system prompt
     system_prompt = read_system_prompt()
 
-    # Initialize Groq client
-    client = Groq(api_key=api_key)
+    # Reuse the query of an identical conversation
+    cache_key = build_query_cache_key(messages, model, system_prompt)
+    cached_query = query_cache.get(cache_key)
+    if cached_query is not None:
+        print(f"Query cache hit: {cached_query}")
+        return cached_query
+
+    # Get the shared LLM gateway
+    gateway = get_llm_gateway(api_key)
 
     # Convert messages to Groq format
     groq_messages = convert_messages_to_groq_format(messages)
 
     try:
-        response = client.chat.completions.create(
+        response = gateway.chat_completion(
+            name="query_generation",
             model=model,
             messages=[
                 {"role": "system", "content": system_prompt},
                 *groq_messages
             ],
-            tools=[
-                {
-                    "type": "function",
-                    "function": {
-                        "name": "course_query",
-                        "description": "Search and retrieve course information based on specified parameters. You must select at least one parameter.",
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                "teacher": {
-                                    "type": "string",
-                                    "description": "Name of the course teacher or instructor. Provide the name if the course has a specific instructor."
-                                },
-                                "keywords": {
-                                    "type": "string",
-                                    "description": "Name or keyword for the course (excluding teacher's name). Notice: The user might contain typos or abbreviations you need to correct them into correct keywords.",
-                                    "default": "course recommendation"
-                                },
-                                "department": {
-                                    "type": "string",
-                                    "description": "Department offering the course."
-                                },
-                                "program": {
-                                    "type": "string",
-                                    "description": "Academic program to which the course belongs."
-                                },
-                                "grade": {
-                                    "type": "number",
-                                    "description": "Targeted grade or year of students for the course."
-                                },
-                            },
-                            "required": []
-                        }
-                    }
-                }
-            ],
+            tools=[COURSE_QUERY_TOOL],
             tool_choice="required",
             max_tokens=4096,
         )
 
         # Safely extract tool calls
         tool_calls = response.choices[0].message.tool_calls
+        if not tool_calls:
+            raise QueryGenerationError("No tool calls")
+
+        query_data = tool_calls[0].function.arguments
+        print(f"Generated query: {query_data}")
+        query = json.loads(query_data)
+    except QueryGenerationError:
+        raise
+    except Exception as e:
+        raise QueryGenerationError(str(e)) from e
 
-        if tool_calls:
-            query_data = tool_calls[0].function.arguments
-            print(f"Generated query: {query_data}")
-            return json.loads(query_data)
-        else:
-            # Fallback if no tool calls
-            default_query = {"name": messages[-1].content if messages else "course recommendation"}
-            print(f"No tool calls, using default query: {default_query}")
-            return default_query
+    query_cache.put(cache_key, query)
+    return query
 
-    except Exception as e:
-        print(f"Query generation error: {str(e)}")
-        return {"name": messages[-1].content if messages else "course recommendation"}
+
+def generate_potential_query(messages: List['Message'], model: str = QUERY_MODEL) -> Dict[str, str]:
+    """
+    Convert dialog to potential query using Groq
+    """
+    # Get API Key
+    api_key = os.getenv('GROQ_API_KEY')
+
+    if not api_key or api_key == 'YOUR_GROQ_API_KEY_HERE':
+        print("Warning: No valid API Key")
+        return {"name": "course recommendation"}
+
+    try:
+        return request_potential_query(messages, model)
+    except QueryGenerationError as e:
+        # Fallback to the last message
+        default_query = {"name": messages[-1].content if messages else "course recommendation"}
+        print(f"Query generation error: {str(e)}, using default query: {default_query}")
+        return default_query
 
 
 def test_query_generator():
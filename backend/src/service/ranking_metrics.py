@@ -0,0 +1,175 @@
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Number of queries whose rankings are compared against the relevance matrix at once
+DEFAULT_CHUNK_SIZE = 1024
+
+
+def build_ranking_matrix(rankings: Sequence[Sequence[int]], fill_value: int = -1) -> np.ndarray:
+    """
+    Stack rankings of catalog row ids into a [queries x max ranking length] matrix, padding the shorter rankings
+    (e.g. of filtered queries) with `fill_value`.
+    """
+    length = max((len(ranking) for ranking in rankings), default=0)
+    matrix = np.full((len(rankings), length), fill_value, dtype=np.int64)
+    for query, ranking in enumerate(rankings):
+        matrix[query, :len(ranking)] = ranking
+    return matrix
+
+
+def build_relevance_matrix(relevant_rows: Sequence[Iterable[int]], num_courses: int) -> sparse.csr_matrix:
+    """
+    Build the [queries x courses] binary relevance matrix from the relevant catalog rows of every query.
+    Negative rows (relevant courses missing from the catalog) are left out.
+    """
+    indptr = [0]
+    indices: List[int] = []
+    for rows in relevant_rows:
+        rows = sorted({int(row) for row in rows if row >= 0})
+        indices.extend(rows)
+        indptr.append(len(indices))
+    data = np.ones(len(indices), dtype=np.int8)
+    return sparse.csr_matrix((data, np.asarray(indices, dtype=np.int64), np.asarray(indptr, dtype=np.int64)),
+                             shape=(len(relevant_rows), num_courses))
+
+
+def relevance_hits(ranked_rows: np.ndarray, relevance: sparse.csr_matrix) -> np.ndarray:
+    """
+    Get the [queries x ranks] boolean matrix of the ranked courses that are relevant to their query.
+
+    Args:
+        ranked_rows (np.ndarray): The [queries x ranks] catalog rows in rank order, negative for padding.
+        relevance (sparse.csr_matrix): The [queries x courses] relevance matrix.
+    """
+    # A dense [queries x courses] mask of a chunk of queries is small, the rankings are gathered from it
+    relevant = relevance.toarray().astype(bool)
+    hits = np.take_along_axis(relevant, np.maximum(ranked_rows, 0), axis=1)
+    hits &= ranked_rows >= 0
+    return hits
+
+
+def mean_precision_at_hits(hits: np.ndarray) -> np.ndarray:
+    """
+    Average the precision at the rank of every relevant course retrieved, 0 for queries without any.
+
+    This is the AP of `evaluate.py`: the precision values are summed per query with the same (pairwise) numpy
+    summation as `np.mean` of a per-query list, so the results are identical to the bit.
+    """
+    num_hits = hits.sum(axis=1)
+    query_of_hit, rank_of_hit = np.nonzero(hits)
+    # The hits of a query are contiguous and in rank order, so the number retrieved so far is their position
+    starts = np.concatenate([[0], np.cumsum(num_hits)[:-1]])
+    num_retrieved = np.arange(len(rank_of_hit)) - starts[query_of_hit] + 1
+    precisions = num_retrieved / (rank_of_hit + 1)
+
+    # Queries with the same number of hits are reduced together
+    average_precisions = np.zeros(len(hits), dtype=np.float64)
+    for count in np.unique(num_hits[num_hits > 0]):
+        queries = np.flatnonzero(num_hits == count)
+        values = precisions[starts[queries][:, None] + np.arange(count)]
+        average_precisions[queries] = np.add.reduce(values, axis=1) / count
+    return average_precisions
+
+
+def compute_ranking_metrics(
+    ranked_rows: np.ndarray,
+    relevance: sparse.csr_matrix,
+    k_values: Sequence[int] = (5, 10, 20),
+    num_relevant: Optional[np.ndarray] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Dict[str, np.ndarray]:
+    """
+    Compute the query-level ranking metrics of many queries at once.
+
+    Args:
+        ranked_rows (np.ndarray): The [queries x ranks] catalog rows in rank order, negative for padding, see
+            `build_ranking_matrix`.
+        relevance (sparse.csr_matrix): The [queries x courses] binary relevance matrix.
+        k_values (Sequence[int]): The cutoffs of Hit@K, Recall@K and nDCG@K.
+        num_relevant (Optional[np.ndarray]): The number of relevant courses of every query, the denominator of
+            the recall and the ideal DCG. Defaults to the relevant courses of the relevance matrix; pass it when
+            some relevant courses are missing from the catalog.
+        chunk_size (int): Number of queries processed at once, bounds the memory of the [queries x ranks] matrices.
+
+    Returns:
+        Dict[str, np.ndarray]: For every query, `Hit@K` (0 or 1), `Recall@K`, `nDCG@K` with binary gains, `RR`
+        (the reciprocal rank of the first relevant course) and `AP` (the mean precision at the relevant courses
+        retrieved), with 0 for queries without relevant course retrieved.
+    """
+    num_queries = ranked_rows.shape[0]
+    if relevance.shape[0] != num_queries:
+        raise ValueError(f"Got {num_queries} rankings for {relevance.shape[0]} relevance rows")
+    if num_relevant is None:
+        num_relevant = np.diff(relevance.tocsr().indptr)
+    num_relevant = np.asarray(num_relevant, dtype=np.int64)
+
+    metrics = {f"Hit@{k}": np.zeros(num_queries, dtype=np.int64) for k in k_values}
+    metrics.update({f"{name}@{k}": np.zeros(num_queries) for name in ('Recall', 'nDCG') for k in k_values})
+    metrics['RR'] = np.zeros(num_queries)
+    metrics['AP'] = np.zeros(num_queries)
+
+    relevance = relevance.tocsr()
+    max_k = max(k_values, default=0)
+    discounts = 1.0 / np.log2(np.arange(2, max_k + 2))
+    ideal_dcg = np.concatenate([[0.0], np.cumsum(discounts)])
+    has_relevant = num_relevant > 0
+
+    for start in range(0, num_queries, chunk_size):
+        end = min(start + chunk_size, num_queries)
+        hits = relevance_hits(ranked_rows[start:end], relevance[start:end])
+        chunk_relevant = num_relevant[start:end]
+        chunk_has_relevant = has_relevant[start:end]
+
+        for k in k_values:
+            top_k_hits = hits[:, :k]
+            num_top_k_hits = top_k_hits.sum(axis=1)
+            metrics[f"Hit@{k}"][start:end] = num_top_k_hits > 0
+            metrics[f"Recall@{k}"][start:end] = np.divide(num_top_k_hits, chunk_relevant, where=chunk_has_relevant,
+                                                          out=np.zeros(end - start))
+            dcg = top_k_hits @ discounts[:top_k_hits.shape[1]]
+            metrics[f"nDCG@{k}"][start:end] = np.divide(dcg, ideal_dcg[np.minimum(chunk_relevant, k)],
+                                                        where=chunk_has_relevant, out=np.zeros(end - start))
+
+        any_hit = hits.any(axis=1)
+        first_hit = hits.argmax(axis=1)
+        metrics['RR'][start:end] = np.where(any_hit, 1.0 / (first_hit + 1), 0.0)
+        metrics['AP'][start:end] = np.where(chunk_has_relevant, mean_precision_at_hits(hits), 0.0)
+
+    return metrics
+
+
+def bootstrap_confidence_intervals(
+    query_metrics: pd.DataFrame,
+    num_resamples: int = 1000,
+    confidence: float = 0.95,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    Estimate percentile bootstrap confidence intervals of the mean of query-level metrics.
+
+    All metrics are resampled with the same query samples, drawn as multinomial query counts, so each resample
+    is a single weighted sum instead of a copy of the metrics.
+
+    Args:
+        query_metrics (pd.DataFrame): One row per query, one numeric column per metric.
+        num_resamples (int): Number of bootstrap resamples.
+        confidence (float): Confidence level of the intervals.
+        seed (int): Seed of the resampling, so reruns report the same intervals.
+
+    Returns:
+        pd.DataFrame: The `mean`, `low` and `high` bound of every metric, one row per metric.
+    """
+    values = query_metrics.to_numpy(dtype=np.float64)
+    num_queries = len(values)
+    if num_queries == 0:
+        return pd.DataFrame(np.nan, index=query_metrics.columns, columns=['mean', 'low', 'high'])
+
+    rng = np.random.default_rng(seed)
+    counts = rng.multinomial(num_queries, np.full(num_queries, 1.0 / num_queries), size=num_resamples)
+    resampled_means = counts @ values / num_queries
+    alpha = (1.0 - confidence) / 2
+    low, high = np.quantile(resampled_means, [alpha, 1.0 - alpha], axis=0)
+    return pd.DataFrame({'mean': values.mean(axis=0), 'low': low, 'high': high}, index=query_metrics.columns)
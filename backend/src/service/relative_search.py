@@ -1,50 +1,248 @@
-from typing import Dict
+import threading
+from typing import Dict, List, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
 import torch
 from sentence_transformers import CrossEncoder
 from tqdm import tqdm
 
+from .course_catalog import get_course_catalog
+from ..types.course_catalog import CourseCatalog, as_course_catalog
+from ..types.ranked_courses import RankedCourses
+
 tqdm.pandas()
 
+# Course columns joined into the course side of the cross-encoder input
+COURSE_TEXT_COLUMNS = ['name', 'teacher', 'description', 'department', 'objectives', 'syllabus']
+
+
+def build_course_texts(catalog: Union[CourseCatalog, pd.DataFrame]) -> List[str]:
+    """
+    Join the text columns of each course into the course side of the cross-encoder input.
+    """
+    columns = [pd.Series(catalog[column]).fillna('').tolist() for column in COURSE_TEXT_COLUMNS]
+    # CrossEncoder.predict strips both sides of a pair before tokenizing
+    return [" ".join(values).strip() for values in zip(*columns)]
+
+
+def truncate_pair_longest_first(first_length: int, second_length: int, max_tokens: int) -> Tuple[int, int]:
+    """
+    Get the lengths both sequences of a pair are truncated to, following the "longest_first" strategy of the
+    fast tokenizers, so pre-tokenized pairs end up with exactly the same tokens as tokenizing the text pair.
+
+    Args:
+        first_length (int): The number of tokens of the first sequence, without special tokens.
+        second_length (int): The number of tokens of the second sequence, without special tokens.
+        max_tokens (int): The maximum number of tokens of the pair, without special tokens.
+
+    Returns:
+        Tuple[int, int]: The number of tokens kept from each sequence.
+    """
+    n1, n2 = first_length, second_length
+    if n1 + n2 <= max_tokens:
+        return n1, n2
+
+    swap = n1 > n2
+    if swap:
+        n1, n2 = n2, n1
+    # Only the longer sequence is truncated, unless both exceed half the budget
+    n2 = n1 if n1 > max_tokens else max(n1, max_tokens - n1)
+    if n1 + n2 > max_tokens:
+        n1 = max_tokens // 2
+        n2 = n1 + max_tokens % 2
+    return (n2, n1) if swap else (n1, n2)
+
+
+def build_token_budget_batches(
+    pair_lengths: np.ndarray,
+    max_batch_tokens: int,
+    max_batch_size: int,
+) -> List[np.ndarray]:
+    """
+    Group pairs of similar length into batches whose padded size stays under a token budget.
+
+    Pairs are sorted by length, so each batch is padded to the length of its last pair, and a batch is closed when
+    adding the next pair would exceed `max_batch_tokens` padded tokens or `max_batch_size` pairs. A pair longer
+    than the budget gets a batch of its own.
+
+    Args:
+        pair_lengths (np.ndarray): The number of tokens of each pair, including the special tokens.
+        max_batch_tokens (int): The maximum number of padded tokens of a batch.
+        max_batch_size (int): The maximum number of pairs of a batch.
+
+    Returns:
+        List[np.ndarray]: The positions of the pairs of each batch.
+    """
+    order = np.argsort(pair_lengths, kind='stable')
+    batches = []
+    start = 0
+    for end in range(1, len(order) + 1):
+        if end == len(order):
+            batches.append(order[start:end])
+            break
+        batch_size = end - start + 1
+        if batch_size > max_batch_size or batch_size * pair_lengths[order[end]] > max_batch_tokens:
+            batches.append(order[start:end])
+            start = end
+    return batches
+
+
+class CourseInputs:
+    """
+    Course side of the cross-encoder input of a catalog: the combined course texts and their token IDs, truncated
+    to the longest course side a pair can keep. They only depend on the catalog, so they are built once per
+    catalog version and only the query has to be tokenized per request.
+
+    The untruncated token counts are kept as well, the truncation of a pair depends on which side is longer.
+    """
+
+    def __init__(self, catalog: Union[CourseCatalog, pd.DataFrame], tokenizer, max_tokens: int):
+        self.texts = build_course_texts(catalog)
+        token_ids = tokenizer(self.texts, add_special_tokens=False, verbose=False)['input_ids']
+        self.lengths: List[int] = [len(ids) for ids in token_ids]
+        self.token_ids: List[List[int]] = [ids[:max_tokens] for ids in token_ids]
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
 
 class CourseReranker:
-    def __init__(self):
+    def __init__(self, model_name: str = 'BAAI/bge-reranker-base'):
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.reranker_model = CrossEncoder('BAAI/bge-reranker-base', device=self.device)
+        self.reranker_model = CrossEncoder(model_name, device=self.device)
         print(f"Using device: {self.device}")
 
-    def score_courses(self, search_query: Dict[str, str], courses_df: pd.DataFrame, batch_size: int = 256) -> pd.DataFrame:
+        tokenizer = self.reranker_model.tokenizer
+        max_length = self.reranker_model.max_length or tokenizer.model_max_length
+        # Token budget of a (query, course) pair without the special tokens
+        self.max_pair_tokens = max_length - tokenizer.num_special_tokens_to_add(pair=True)
+
+        self._course_inputs: Optional[CourseInputs] = None
+        self._course_inputs_source: Optional[CourseCatalog] = None
+        self._course_inputs_lock = threading.Lock()
+
+    def get_course_inputs(self, catalog: CourseCatalog) -> CourseInputs:
+        """
+        Get the course side inputs of a catalog, building them on first use.
+        """
+        with self._course_inputs_lock:
+            if not catalog.is_same(self._course_inputs_source):
+                print("Tokenizing course texts...")
+                self._course_inputs = CourseInputs(catalog, self.reranker_model.tokenizer, self.max_pair_tokens)
+                self._course_inputs_source = catalog
+            return self._course_inputs
+
+    def build_features(
+        self,
+        query_ids: List[int],
+        course_token_ids: List[List[int]],
+        course_lengths: List[int],
+    ) -> Dict[str, torch.Tensor]:
+        """
+        Build the padded model inputs of a batch of (query, course) pairs from their token IDs.
+
+        Args:
+            query_ids (List[int]): The token IDs of the query, without special tokens.
+            course_token_ids (List[List[int]]): The (pre-truncated) token IDs of each course.
+            course_lengths (List[int]): The untruncated number of tokens of each course.
+        """
+        tokenizer = self.reranker_model.tokenizer
+        encoded = {'input_ids': []}
+        with_token_type_ids = 'token_type_ids' in tokenizer.model_input_names
+        if with_token_type_ids:
+            encoded['token_type_ids'] = []
+
+        for course_ids, course_length in zip(course_token_ids, course_lengths):
+            n_query, n_course = truncate_pair_longest_first(len(query_ids), course_length, self.max_pair_tokens)
+            pair = (query_ids[:n_query], course_ids[:n_course])
+            encoded['input_ids'].append(tokenizer.build_inputs_with_special_tokens(*pair))
+            if with_token_type_ids:
+                encoded['token_type_ids'].append(tokenizer.create_token_type_ids_from_sequences(*pair))
+
+        features = tokenizer.pad(encoded, padding=True, return_tensors='pt')
+        return {name: tensor.to(self.device) for name, tensor in features.items()}
+
+    def get_pair_lengths(self, query_length: int, course_lengths: List[int]) -> np.ndarray:
+        """
+        Get the number of tokens of each (query, course) pair after truncation, including the special tokens.
+        """
+        num_special_tokens = self.reranker_model.tokenizer.num_special_tokens_to_add(pair=True)
+        return np.asarray([
+            sum(truncate_pair_longest_first(query_length, course_length, self.max_pair_tokens))
+            for course_length in course_lengths
+        ], dtype=np.int64) + num_special_tokens
+
+    def build_batches(
+        self,
+        query_length: int,
+        course_lengths: List[int],
+        batch_size: int,
+        max_batch_tokens: Optional[int],
+    ) -> List[np.ndarray]:
+        """
+        Split the (query, course) pairs into batches, see `score_courses`.
+
+        Returns:
+            List[np.ndarray]: The positions of the pairs of each batch.
+        """
+        if max_batch_tokens is None:
+            return [np.arange(i, min(i + batch_size, len(course_lengths)))
+                    for i in range(0, len(course_lengths), batch_size)]
+        pair_lengths = self.get_pair_lengths(query_length, course_lengths)
+        return build_token_budget_batches(pair_lengths, max_batch_tokens, batch_size)
+
+    def score_courses(
+        self,
+        search_query: Dict[str, str],
+        courses: Optional[Union[CourseCatalog, pd.DataFrame]] = None,
+        batch_size: int = 128,
+        row_ids: Optional[np.ndarray] = None,
+        max_batch_tokens: Optional[int] = 16384,
+    ) -> RankedCourses:
         """
         Score courses based on the search query.
 
         Args:
             search_query (Dict[str, str]): The search query.
-            courses_df (pd.DataFrame): The courses dataframe.
-            batch_size (int): The batch size for scoring.
+            courses (Optional[Union[CourseCatalog, pd.DataFrame]]): The courses. Defaults to the shared course
+                catalog. The tokenized course texts are reused while the same catalog (version) is passed, pass a
+                `CourseCatalog` rather than a DataFrame to benefit from it.
+            batch_size (int): The maximum number of (query, course) pairs per forward pass.
+            row_ids (Optional[np.ndarray]): Sorted catalog rows to score, e.g. the candidates of a first stage
+                retriever. Defaults to all courses.
+            max_batch_tokens (Optional[int]): Token budget of a forward pass. Pairs are bucketed by length into
+                batches of at most this many padded tokens, which avoids scoring mostly padding. None scores
+                fixed batches of `batch_size` pairs in catalog order.
 
         Returns:
-            pd.DataFrame: The courses dataframe with relevance scores.
-        """
-        combined_query = " ".join(map(str, search_query.values()))
-        courses_df['combined_text'] = (
-            courses_df['name'].fillna('') + " " +
-            courses_df['teacher'].fillna('') + " " +
-            courses_df['description'].fillna('') + " " +
-            courses_df['department'].fillna('') + " " +
-            courses_df['objectives'].fillna('') + " " +
-            courses_df['syllabus'].fillna('')
-        )
-        pairs = [(combined_query, text) for text in courses_df['combined_text'].tolist()]
-        # Batch scoring
-        relevance_scores = []
-        for i in tqdm(range(0, len(pairs), batch_size)):
-            batch = pairs[i:i+batch_size]
-            scores = self.reranker_model.predict(batch)
-            relevance_scores.extend(scores)
-
-        courses_df['relevance_score'] = relevance_scores
-        return courses_df.sort_values('relevance_score', ascending=False)
+            RankedCourses: The ranked courses.
+        """
+        catalog = get_course_catalog().catalog if courses is None else as_course_catalog(courses)
+
+        course_inputs = self.get_course_inputs(catalog)
+        rows = range(len(course_inputs)) if row_ids is None else row_ids
+        course_token_ids = [course_inputs.token_ids[row] for row in rows]
+        course_lengths = [course_inputs.lengths[row] for row in rows]
+
+        combined_query = " ".join(map(str, search_query.values())).strip()
+        query_ids = self.reranker_model.tokenizer(combined_query, add_special_tokens=False)['input_ids']
+
+        batches = self.build_batches(len(query_ids), course_lengths, batch_size, max_batch_tokens)
+
+        # Batch scoring, the scores are scattered back to the candidate order
+        model = self.reranker_model.model
+        model.eval()
+        model.to(self.device)
+        relevance_scores = np.zeros(len(rows), dtype=np.float32)
+        with torch.no_grad():
+            for positions in tqdm(batches):
+                features = self.build_features(query_ids, [course_token_ids[i] for i in positions],
+                                               [course_lengths[i] for i in positions])
+                logits = self.reranker_model.default_activation_function(model(**features, return_dict=True).logits)
+                relevance_scores[positions] = logits[:, 0].cpu().float().numpy()
+
+        return RankedCourses(catalog, relevance_scores, row_ids=row_ids)
 
 
 
@@ -53,10 +251,8 @@ if __name__ == "__main__":
         "teacher": "羅佩琪",
     }
 
-    test_courses_df = pd.read_csv('../data/courses.csv')
-
     reranker = CourseReranker()
 
-    scored_courses = reranker.score_courses(test_query, test_courses_df)
+    scored_courses = reranker.score_courses(test_query)
 
-    print(scored_courses[['name', 'teacher', 'department', 'description', 'relevance_score']].head())
+    print(scored_courses.top_courses(5)[['name', 'teacher', 'department', 'description', 'relevance_score']])
@@ -1,23 +1,244 @@
-from typing import Dict
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+import numpy as np
 import pandas as pd
 import torch
-from sentence_transformers import SentenceTransformer, util
+import torch.nn.functional as F
+from sentence_transformers import SentenceTransformer
 from tqdm import tqdm
 
+from .course_catalog import get_course_catalog
+from .course_filter_index import CourseFilterIndex
+from .embedding_store import EmbeddingStore
+from ..types.course_catalog import CourseCatalog, as_course_catalog
+from ..types.ranked_courses import RankedCourses
+
 tqdm.pandas()
 
+# Rows of int8 embeddings multiplied at once, the float32 copy numpy makes of each block stays in cache
+QUANTIZED_BLOCK_ROWS = 256
+
+
+def build_field_matrix(field_embeddings: Dict[str, torch.Tensor], field_names: List[str]) -> torch.Tensor:
+    """
+    Stack the field embeddings into one contiguous, L2-normalized float32 tensor, course-major so the fields of a
+    course are adjacent in memory.
+
+    Args:
+        field_embeddings (Dict[str, torch.Tensor]): The [courses x dim] embeddings of each field.
+        field_names (List[str]): The order of the fields in the stacked tensor.
+
+    Returns:
+        torch.Tensor: The [courses x fields x dim] tensor of normalized embeddings.
+    """
+    stacked = torch.stack([field_embeddings[field].float() for field in field_names], dim=1)
+    return F.normalize(stacked, p=2, dim=-1).contiguous()
+
+
+class FusedFieldMatrix:
+    """
+    Dense fields fused into one [courses x fields x dim] float32 tensor, see `build_field_matrix`. All of them are
+    scored with a single matrix-vector product of its [courses x (fields * dim)] view with the concatenated
+    weighted queries of the fields, which also sums the weighted similarities over the fields.
+    """
+
+    def __init__(self, matrix: torch.Tensor, fields: Sequence[int]):
+        """
+        Args:
+            matrix (torch.Tensor): The [courses x fields x dim] normalized embeddings.
+            fields (Sequence[int]): The position of each fused field in the field order of the weight matrix.
+        """
+        self.matrix = matrix
+        self.fields = list(fields)
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        return tuple(self.matrix.shape)
+
+    @property
+    def device(self) -> torch.device:
+        return self.matrix.device
+
+    def to(self, device) -> 'FusedFieldMatrix':
+        return FusedFieldMatrix(self.matrix.to(device), self.fields)
+
+    def __getitem__(self, rows: torch.Tensor) -> 'FusedFieldMatrix':
+        return FusedFieldMatrix(self.matrix[rows], self.fields)
+
+    def __matmul__(self, field_queries: torch.Tensor) -> torch.Tensor:
+        """
+        Score the courses against the [fields x dim] weighted queries of every field of the weight matrix.
+        """
+        queries = field_queries[self.fields].reshape(-1)
+        return self.matrix.reshape(self.matrix.shape[0], -1) @ queries
+
+
+class QuantizedEmbeddings:
+    """
+    int8 embeddings with a float32 scale per row, as memory-mapped from an int8 embedding store. Products with a
+    query vector are computed against the int8 values block by block and scaled per row afterwards, so the
+    embeddings are never dequantized into a float copy of the store.
+    """
+
+    def __init__(self, values: torch.Tensor, scales: torch.Tensor):
+        """
+        Args:
+            values (torch.Tensor): The [rows x dim] int8 values.
+            scales (torch.Tensor): The [rows] float32 scale of each row.
+        """
+        self.values = values
+        self.scales = scales
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return tuple(self.values.shape)
+
+    @property
+    def dtype(self) -> torch.dtype:
+        # Products are computed in float32
+        return torch.float32
+
+    @property
+    def device(self) -> torch.device:
+        return self.values.device
+
+    def to(self, device) -> 'QuantizedEmbeddings':
+        return QuantizedEmbeddings(self.values.to(device), self.scales.to(device))
+
+    def __getitem__(self, rows: torch.Tensor) -> 'QuantizedEmbeddings':
+        return QuantizedEmbeddings(self.values[rows], self.scales[rows])
+
+    def __matmul__(self, query: torch.Tensor) -> torch.Tensor:
+        if self.values.device.type != 'cpu':
+            return (self.values.to(query.dtype) @ query) * self.scales
+        values = self.values.numpy()
+        query = query.float().numpy()
+        products = np.empty(values.shape[0], dtype=np.float32)
+        for start in range(0, values.shape[0], QUANTIZED_BLOCK_ROWS):
+            products[start:start + QUANTIZED_BLOCK_ROWS] = values[start:start + QUANTIZED_BLOCK_ROWS] @ query
+        return torch.from_numpy(products) * self.scales
+
+
+class FactorizedEmbeddings:
+    """
+    Embeddings of a low-cardinality field, stored as the embeddings of its unique values and the value of each
+    course. Products with a query vector are computed against the unique values and broadcast to the courses, so
+    it can be scored in place of a dense [courses x dim] tensor.
+    """
+
+    def __init__(self, values: torch.Tensor, index: torch.Tensor):
+        """
+        Args:
+            values (torch.Tensor): The [values x dim] normalized embeddings of the unique values.
+            index (torch.Tensor): The [courses] value index of each course.
+        """
+        self.values = values
+        self.index = index
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.index.shape[0], self.values.shape[1]
+
+    @property
+    def dtype(self) -> torch.dtype:
+        return self.values.dtype
+
+    @property
+    def device(self) -> torch.device:
+        return self.values.device
+
+    def to(self, device) -> 'FactorizedEmbeddings':
+        return FactorizedEmbeddings(self.values.to(device), self.index.to(device))
+
+    def __getitem__(self, rows: torch.Tensor) -> 'FactorizedEmbeddings':
+        return FactorizedEmbeddings(self.values, self.index[rows])
+
+    def __matmul__(self, query: torch.Tensor) -> torch.Tensor:
+        return (self.values @ query)[self.index]
+
+
+def score_field_matrix(
+    field_matrix: Sequence[Any],
+    query_embeddings: torch.Tensor,
+    weight_matrix: torch.Tensor,
+    fused_matrix: Optional[FusedFieldMatrix] = None,
+) -> torch.Tensor:
+    """
+    Compute the weighted sum of cosine similarities between every query value and every course field.
+
+    The field weights are folded into the queries first. The fused fields are scored with a single matmul, the
+    other fields with one matrix-vector product each, skipping the fields without weight.
+
+    Args:
+        field_matrix (Sequence[Any]): The normalized [courses x dim] course embeddings of each field, e.g. the
+            float16 tensors of an embedding store, None for the fields of `fused_matrix`. int8 fields can be given
+            as `QuantizedEmbeddings`, low-cardinality fields as `FactorizedEmbeddings`.
+        query_embeddings (torch.Tensor): The [query values x dim] query embeddings.
+        weight_matrix (torch.Tensor): The [query values x fields] weight of each field for each query value.
+        fused_matrix (Optional[FusedFieldMatrix]): The dense fields fused into one float32 tensor.
+
+    Returns:
+        torch.Tensor: The [courses] float32 relevance scores.
+    """
+    reference = fused_matrix if fused_matrix is not None else next(
+        field_embeddings for field_embeddings in field_matrix if field_embeddings is not None)
+    relevance_scores = torch.zeros(reference.shape[0], device=reference.device)
+    if query_embeddings.shape[0] == 0:
+        return relevance_scores
+
+    query_embeddings = F.normalize(query_embeddings.float(), p=2, dim=-1)
+    field_queries = weight_matrix.T @ query_embeddings  # [fields x dim]
+    field_weights = weight_matrix.abs().sum(dim=0)
+    if fused_matrix is not None and field_weights[fused_matrix.fields].any():
+        relevance_scores += fused_matrix @ field_queries
+    for field, field_embeddings in enumerate(field_matrix):
+        if field_embeddings is None or field_weights[field] == 0:
+            continue
+        relevance_scores += (field_embeddings @ field_queries[field].to(field_embeddings.dtype)).float()
+    return relevance_scores
+
 
 class CourseRerankerWithFieldMapping:
-    def __init__(self, embeddings_file: str, model_name='paraphrase-multilingual-MiniLM-L12-v2'):
+    def __init__(
+        self,
+        embeddings_dir: str,
+        model_name='paraphrase-multilingual-MiniLM-L12-v2',
+        query_embedding_cache_size: int = 4096,
+        fuse_float32: bool = False,
+    ):
+        """
+        Args:
+            embeddings_dir (str): The embedding store written by the precompute script.
+            model_name (str): The sentence transformer used to encode the queries.
+            query_embedding_cache_size (int): Number of query string embeddings kept in the LRU cache.
+            fuse_float32 (bool): Upcast the dense fields once at load into a fused float32 field matrix, scored
+                with a single matmul, instead of scoring the memory-mapped store. It is faster on CPU, but every
+                process holds its own copy of the embeddings instead of sharing the pages of the memory map.
+        """
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
+
+        # Memory-map the precomputed embeddings, refusing embeddings of another catalog or model
+        print("Loading precomputed embeddings...")
+        catalog = get_course_catalog()
+        self.embedding_store = EmbeddingStore(embeddings_dir, expected_catalog_version=catalog.version)
+        # The catalog snapshot the embeddings belong to, scored in place of a reloaded catalog of another version
+        self.catalog = catalog.catalog
+        if self.embedding_store.model_name != model_name:
+            raise ValueError(f"Embeddings in {embeddings_dir} were computed with {self.embedding_store.model_name}, "
+                             f"but the query model is {model_name}. Please rerun the precompute script.")
         self.model = SentenceTransformer(model_name, device=self.device)
         print(f"Using device: {self.device}")
 
-        # Load precomputed embeddings and course data
-        print("Loading precomputed embeddings...")
-        checkpoint = torch.load(embeddings_file)
-        self.field_embeddings = {k: v.to(self.device) for k, v in checkpoint['field_embeddings'].items()}
-        print("Precomputed embeddings loaded successfully.")
+        self.field_names = self.embedding_store.field_names
+        self.field_index = {field: i for i, field in enumerate(self.field_names)}
+        self.fuse_float32 = fuse_float32
+        self.field_matrix, self.fused_matrix = self.load_field_matrix()
+        self.num_courses = self.embedding_store.num_rows
+        self.catalog_version = self.embedding_store.catalog_version
+        # Catalog versions already reported as not matching the embeddings
+        self._mismatched_catalog_versions = set()
+        print(f"Precomputed embeddings loaded successfully: {self.embedding_store}")
 
         # Query-field mapping
         self.query_field_mapping = {
@@ -27,6 +248,11 @@ class CourseRerankerWithFieldMapping:
             "program": ["tags"],
         }
 
+        # Query fields applied as exact filters -> filter index name
+        self.query_filter_mapping = {
+            "grade": "grade",
+        }
+
         # Field weights for keywords
         self.keywords_weights = {
             'name': 0.4,
@@ -36,47 +262,217 @@ class CourseRerankerWithFieldMapping:
             'tags': 0.15
         }
 
-    def score_courses(self, search_query: Dict[str, str], courses_df: pd.DataFrame) -> pd.DataFrame:
+        # Filter index of the catalog the embeddings belong to, rebuilt when another catalog is passed
+        self._filter_index: Optional[CourseFilterIndex] = None
+        self._filter_index_source: Optional[CourseCatalog] = None
+        self._filter_index_lock = threading.Lock()
+
+        # LRU cache of query string embeddings, popular values (e.g. department names) skip the model entirely
+        self.query_embedding_cache_size = query_embedding_cache_size
+        self._query_embedding_cache: 'OrderedDict[str, torch.Tensor]' = OrderedDict()
+        self._query_embedding_cache_lock = threading.Lock()
+
+    def load_field_matrix(self) -> Tuple[List[Any], Optional[FusedFieldMatrix]]:
         """
-        Score courses based on the search query using precomputed embeddings and filtering.
+        Get the embeddings of every field, in `field_names` order, and the fused dense fields.
+
+        By default every field is scored from the memory-mapped store as stored and nothing is fused. With
+        `fuse_float32`, the dense fields are upcast once into a `FusedFieldMatrix` (None in the per-field list) and
+        the factorized fields are kept as float32 unique values.
+        """
+        if not self.fuse_float32:
+            return [self.load_field(field) for field in self.field_names], None
+
+        store = self.embedding_store
+        dense_fields = [field for field in self.field_names if not store.is_factorized(field)]
+        fused_matrix = None
+        if dense_fields:
+            fused_matrix = FusedFieldMatrix(
+                build_field_matrix({field: torch.from_numpy(store.float_embeddings(field)) for field in dense_fields},
+                                   dense_fields),
+                [self.field_index[field] for field in dense_fields],
+            ).to(self.device)
+        field_matrix = [
+            None if field in dense_fields else FactorizedEmbeddings(
+                torch.from_numpy(store.float_embeddings(field)), store.index_tensor(field)).to(self.device)
+            for field in self.field_names
+        ]
+        return field_matrix, fused_matrix
+
+    def load_field(self, field: str):
+        """
+        Get the embeddings of a field from the store, int8 fields are scored against their values and scaled per
+        row, factorized fields through their unique values.
+        """
+        embeddings = self.embedding_store.field_tensor(field)
+        scales = self.embedding_store.scales_tensor(field)
+        if scales is not None:
+            embeddings = QuantizedEmbeddings(embeddings, scales)
+        if self.embedding_store.is_factorized(field):
+            embeddings = FactorizedEmbeddings(embeddings, self.embedding_store.index_tensor(field))
+        return embeddings.to(self.device)
+
+    def encode_queries(self, query_values: List[str]) -> Dict[str, torch.Tensor]:
+        """
+        Encode query strings with a single batched forward pass, reusing cached embeddings.
 
         Args:
-            search_query (Dict[str, str]): The search query with fields as keys.
-            courses_df (pd.DataFrame): The courses DataFrame to filter and score.
+            query_values (List[str]): The query strings, duplicates are encoded once.
 
         Returns:
-            pd.DataFrame: Filtered and sorted DataFrame with relevance scores.
+            Dict[str, torch.Tensor]: The embedding of each query string.
+        """
+        embeddings = {}
+        missing_values = []
+        with self._query_embedding_cache_lock:
+            for value in dict.fromkeys(query_values):
+                if value in self._query_embedding_cache:
+                    self._query_embedding_cache.move_to_end(value)
+                    embeddings[value] = self._query_embedding_cache[value]
+                else:
+                    missing_values.append(value)
+
+        if missing_values:
+            print(f"Encoding {len(missing_values)} query value(s) in one batch")
+            encoded = self.model.encode(missing_values, convert_to_tensor=True)
+            with self._query_embedding_cache_lock:
+                for value, embedding in zip(missing_values, encoded):
+                    embeddings[value] = embedding
+                    self._query_embedding_cache[value] = embedding
+                    self._query_embedding_cache.move_to_end(value)
+                while len(self._query_embedding_cache) > self.query_embedding_cache_size:
+                    self._query_embedding_cache.popitem(last=False)
+
+        return embeddings
+
+    def resolve_catalog(self, catalog: CourseCatalog) -> CourseCatalog:
+        """
+        Get the catalog to score: the given catalog if the embeddings were computed for it, otherwise the catalog
+        snapshot the embeddings were loaded with, so a catalog reloaded after `update_courses.py` is never scored
+        against the embeddings of other rows. The mismatch is reported once per catalog version.
+
+        Raises:
+            ValueError: If a catalog without version (e.g. a DataFrame) does not have one row per embedding.
+        """
+        if catalog.version is None:
+            if len(catalog) != self.num_courses:
+                raise ValueError(f"The catalog has {len(catalog)} courses but the embeddings have "
+                                 f"{self.num_courses}, please rerun the precompute script.")
+            return catalog
+        if catalog.version == self.catalog_version:
+            return catalog
+
+        if catalog.version not in self._mismatched_catalog_versions:
+            self._mismatched_catalog_versions.add(catalog.version)
+            print(f"Warning: Embeddings were computed for catalog {str(self.catalog_version)[:12]}, but the current "
+                  f"catalog is {catalog.version[:12]}. Scoring catalog {str(self.catalog_version)[:12]} until the "
+                  f"precompute script is rerun and the ranker reloaded.")
+        return self.catalog
+
+    def get_filter_index(self, catalog: CourseCatalog) -> CourseFilterIndex:
+        """
+        Get the filter index of a catalog, building it on first use.
         """
-        df = courses_df.copy()
-        relevance_scores = torch.zeros(len(df), device=self.device)
+        with self._filter_index_lock:
+            if not catalog.is_same(self._filter_index_source):
+                print("Building course filter index...")
+                self._filter_index = CourseFilterIndex(catalog)
+                self._filter_index_source = catalog
+            return self._filter_index
 
+    def build_weight_matrix(self, search_query: Dict[str, str]) -> Tuple[List[str], torch.Tensor]:
+        """
+        Build the weight of each embedded field for each scored value of the query.
+
+        Keywords are scored against several fields with `keywords_weights`, the other query fields are scored
+        against their mapped fields with weight 1.
+
+        Args:
+            search_query (Dict[str, str]): The search query with fields as keys.
+
+        Returns:
+            Tuple[List[str], torch.Tensor]: The scored query values and the [query values x fields] weights.
+        """
+        query_values = []
+        weight_rows = []
         for query_field, query_value in search_query.items():
-            if not query_value:
+            if not query_value or query_field not in self.query_field_mapping:
                 continue
 
-            if query_field == "keywords":  # Weighted scoring for keywords
-                query_embedding = self.model.encode(query_value, convert_to_tensor=True)
-                for field, weight in self.keywords_weights.items():
-                    if field in self.field_embeddings:
-                        print(f"Scoring {field} for 'keywords' with weight {weight}")
-                        field_scores = util.cos_sim(query_embedding, self.field_embeddings[field])
-                        relevance_scores += weight * field_scores.squeeze()
-            elif query_field == "grade":  # Filter directly for grade
-                print(f"Filtering for grade: {query_value}")
-                df = df[df['grade'] == query_value]
-            else:  # Direct scoring for other fields
-                mapped_fields = self.query_field_mapping.get(query_field, [])
-                query_embedding = self.model.encode(query_value, convert_to_tensor=True)
-                for field in mapped_fields:
-                    if field in self.field_embeddings:
-                        print(f"Scoring {field} for query field: {query_field}")
-                        field_scores = util.cos_sim(query_embedding, self.field_embeddings[field])
-                        relevance_scores += field_scores.squeeze()
-
-        # Assign scores and sort results
-        df = df.reset_index(drop=True)
-        df['relevance_score'] = relevance_scores[:len(df)].cpu().numpy()
-        return df.sort_values('relevance_score', ascending=False)
+            if query_field == "keywords":
+                field_weights = self.keywords_weights
+            else:
+                field_weights = {field: 1.0 for field in self.query_field_mapping[query_field]}
+
+            weights = torch.zeros(len(self.field_names))
+            for field, weight in field_weights.items():
+                if field in self.field_index:
+                    weights[self.field_index[field]] += weight
+            print(f"Scoring {query_field} with field weights {field_weights}")
+
+            query_values.append(str(query_value))
+            weight_rows.append(weights)
+
+        if not weight_rows:
+            return [], torch.zeros((0, len(self.field_names)), device=self.device)
+        return query_values, torch.stack(weight_rows).to(self.device)
+
+    def score_courses(
+        self,
+        search_query: Dict[str, str],
+        courses: Optional[Union[CourseCatalog, pd.DataFrame]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> RankedCourses:
+        """
+        Score courses based on the search query using precomputed embeddings and filtering.
+
+        Exact filters (the query fields in `query_filter_mapping` plus the explicit `filters`) are resolved into
+        candidate rows with the filter index first, and only the candidates are scored.
+
+        Args:
+            search_query (Dict[str, str]): The search query with fields as keys.
+            courses (Optional[Union[CourseCatalog, pd.DataFrame]]): The courses to filter and score. Its rows must be
+                in the order of the precomputed embeddings. Defaults to the shared course catalog. A catalog of
+                another version than the embeddings is replaced by the catalog they were computed for, see
+                `resolve_catalog`.
+            filters (Optional[Dict[str, Any]]): Additional exact filters, e.g. {'compulsory': True} or
+                {'department': ['電機系', '資工碩']}. See `CourseFilterIndex.INDEXED_FIELDS` for the supported keys.
+
+        Returns:
+            RankedCourses: The ranked candidate courses.
+        """
+        catalog = get_course_catalog().catalog if courses is None else as_course_catalog(courses)
+        catalog = self.resolve_catalog(catalog)
+
+        # Resolve exact filters into candidate rows
+        all_filters = dict(filters or {})
+        for query_field, index_field in self.query_filter_mapping.items():
+            if search_query.get(query_field):
+                all_filters[index_field] = search_query[query_field]
+        candidate_rows = None
+        if all_filters:
+            print(f"Filtering with: {all_filters}")
+            candidate_rows = self.get_filter_index(catalog).candidates(all_filters)
+
+        # Encode all scored query values at once, the fused fields are scored with a single matmul
+        query_values, weight_matrix = self.build_weight_matrix(search_query)
+        query_embeddings = self.encode_queries(query_values)
+        if query_values:
+            query_matrix = torch.stack([query_embeddings[value] for value in query_values]).to(self.device)
+        else:
+            query_matrix = torch.zeros((0, self.embedding_store.dim), device=self.device)
+
+        field_matrix, fused_matrix = self.field_matrix, self.fused_matrix
+        if candidate_rows is not None:
+            print(f"Scoring {len(candidate_rows)} of {len(catalog)} courses")
+            rows = torch.from_numpy(candidate_rows).to(self.device)
+            field_matrix = [None if field_embeddings is None else field_embeddings[rows]
+                            for field_embeddings in field_matrix]
+            fused_matrix = None if fused_matrix is None else fused_matrix[rows]
+        relevance_scores = score_field_matrix(field_matrix, query_matrix, weight_matrix, fused_matrix)
+
+        return RankedCourses(catalog, relevance_scores.cpu().numpy(), row_ids=candidate_rows)
+
 
 if __name__ == "__main__":
     # Sample query
@@ -85,8 +481,8 @@ if __name__ == "__main__":
     }
 
     # Initialize and use the reranker with precomputed embeddings
-    reranker = CourseRerankerWithFieldMapping(embeddings_file='../data/precomputed_field_embeddings.pt')
-    scored_courses = reranker.score_courses(test_query, pd.read_csv('../data/courses.csv'))
+    reranker = CourseRerankerWithFieldMapping(embeddings_dir='src/data/field_embeddings')
+    scored_courses = reranker.score_courses(test_query)
 
     # Display top results
-    print(scored_courses[['name', 'teacher', 'department', 'description', 'relevance_score']].head())
+    print(scored_courses.top_courses(5)[['name', 'teacher', 'department', 'description', 'relevance_score']])
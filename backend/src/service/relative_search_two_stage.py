@@ -0,0 +1,93 @@
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+import torch
+
+from .course_catalog import get_course_catalog
+from .relative_search import CourseReranker
+from .relative_search_bi_encoder import CourseRerankerWithFieldMapping
+from ..types.course_catalog import CourseCatalog, as_course_catalog
+from ..types.ranked_courses import RankedCourses
+
+
+class TwoStageCourseRanker:
+    """
+    Two-stage retrieval: the bi-encoder with precomputed embeddings picks the top-K candidates, and only those
+    are reranked by the cross-encoder.
+
+    The merged ranking lists the K candidates in cross-encoder order, followed by the remaining courses in
+    bi-encoder order.
+    """
+
+    def __init__(
+        self,
+        bi_encoder: CourseRerankerWithFieldMapping,
+        cross_encoder: CourseReranker,
+        candidate_k: int = 100,
+    ):
+        """
+        Args:
+            bi_encoder (CourseRerankerWithFieldMapping): The first stage ranker.
+            cross_encoder (CourseReranker): The second stage ranker.
+            candidate_k (int): Number of first stage candidates reranked by the cross-encoder.
+        """
+        self.bi_encoder = bi_encoder
+        self.cross_encoder = cross_encoder
+        self.candidate_k = candidate_k
+
+    def encode_queries(self, query_values: List[str]) -> Dict[str, torch.Tensor]:
+        """
+        Encode query strings with the bi-encoder model.
+        """
+        return self.bi_encoder.encode_queries(query_values)
+
+    def score_courses(
+        self,
+        search_query: Dict[str, str],
+        courses: Optional[Union[CourseCatalog, pd.DataFrame]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> RankedCourses:
+        """
+        Score courses with the bi-encoder, then rerank the top-K candidates with the cross-encoder.
+
+        Args:
+            search_query (Dict[str, str]): The search query with fields as keys.
+            courses (Optional[Union[CourseCatalog, pd.DataFrame]]): The courses. Defaults to the shared course
+                catalog.
+            filters (Optional[Dict[str, Any]]): Additional exact filters applied by the bi-encoder.
+
+        Returns:
+            RankedCourses: The merged ranking. The scores are the cross-encoder scores for the reranked
+            candidates and the bi-encoder scores for the other courses.
+        """
+        catalog = get_course_catalog().catalog if courses is None else as_course_catalog(courses)
+
+        # Stage 1: cheap scoring of every (filtered) course
+        first_stage = self.bi_encoder.score_courses(search_query, catalog, filters=filters)
+        first_stage_rows = first_stage.top_rows()
+        candidate_rows = np.sort(first_stage_rows[:self.candidate_k])
+        print(f"Reranking {len(candidate_rows)} of {len(first_stage)} candidates with the cross-encoder")
+
+        # Stage 2: expensive scoring of the top-K candidates only, in the catalog the bi-encoder scored (the catalog
+        # of its embeddings when the given one does not match them)
+        catalog = first_stage.catalog
+        second_stage = self.cross_encoder.score_courses(search_query, catalog, row_ids=candidate_rows)
+
+        # Merge: reranked candidates first, then the rest of the first stage ranking
+        reranked_rows = second_stage.top_rows()
+        remaining_rows = first_stage_rows[self.candidate_k:]
+        merged_rows = np.concatenate([reranked_rows, remaining_rows])
+        merged_scores = np.concatenate([second_stage.top_scores(), first_stage.top_scores()[self.candidate_k:]])
+
+        # RankedCourses expects the rows sorted, so the rank order is passed explicitly as positions in the
+        # sorted arrays
+        sort_positions = np.argsort(merged_rows, kind='stable')
+        rank_order = np.empty_like(sort_positions)
+        rank_order[sort_positions] = np.arange(len(sort_positions))
+        return RankedCourses(
+            catalog,
+            merged_scores[sort_positions],
+            row_ids=merged_rows[sort_positions],
+            order=rank_order,
+        )
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+# Number of recent message embeddings kept, so the lookup and the caching of a turn embed its message once
+MESSAGE_EMBEDDING_CACHE_SIZE = 64
+
+
+class FinalResponseCacheEntry:
+    def __init__(self, response: Dict[str, str], top_k_ids: List[str], message_embedding: Optional[np.ndarray]):
+        self.response = response
+        self.top_k_ids = top_k_ids
+        self.message_embedding = message_embedding
+
+
+class FinalResponseCache:
+    """
+    Cache in front of the final response generation.
+
+    An exact hit requires the same query dict and the same top-k course IDs. Optionally, a near-duplicate hit is
+    returned when the last user message is semantically close to a cached one (cosine similarity of the message
+    embeddings above a threshold) and the top-k course IDs largely overlap. Entries are evicted by LRU, and the
+    whole cache is invalidated when the course catalog version changes.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 512,
+        embed_fn: Optional[Callable[[str], Any]] = None,
+        similarity_threshold: Optional[float] = None,
+        min_top_k_overlap: float = 0.8,
+    ):
+        """
+        Args:
+            max_size (int): Maximum number of cached responses.
+            embed_fn (Optional[Callable[[str], Any]]): Function returning the embedding of a message, e.g. the
+                `encode` method of the already-loaded sentence transformer. Required for near-duplicate hits.
+            similarity_threshold (Optional[float]): Minimum cosine similarity of the last user messages for a
+                near-duplicate hit. None disables near-duplicate hits.
+            min_top_k_overlap (float): Minimum fraction of shared top-k course IDs for a near-duplicate hit.
+        """
+        self.max_size = max_size
+        self.embed_fn = embed_fn
+        self.similarity_threshold = similarity_threshold
+        self.min_top_k_overlap = min_top_k_overlap
+
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, FinalResponseCacheEntry]' = OrderedDict()
+        self._catalog_version: Optional[str] = None
+        self._message_embeddings: 'OrderedDict[str, np.ndarray]' = OrderedDict()
+
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def near_duplicate_enabled(self) -> bool:
+        return self.embed_fn is not None and self.similarity_threshold is not None
+
+    @staticmethod
+    def build_key(query_dict: Dict[str, str], top_k_ids: List[str]) -> str:
+        """
+        Build the exact-match key of a query dict and its top-k course IDs.
+        """
+        payload = json.dumps([query_dict, top_k_ids], ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _embed(self, message: str) -> Optional[np.ndarray]:
+        """
+        Get the normalized embedding of a message. The recent embeddings are kept, so a miss in `get` followed by
+        `put` for the same turn runs the model once.
+        """
+        if not self.near_duplicate_enabled:
+            return None
+        with self._lock:
+            if message in self._message_embeddings:
+                self._message_embeddings.move_to_end(message)
+                return self._message_embeddings[message]
+
+        # Encode outside the lock, the model call is the slow part
+        embedding = self.embed_fn(message)
+        if hasattr(embedding, 'cpu'):  # torch tensor
+            embedding = embedding.cpu().numpy()
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(embedding)
+        embedding = embedding / norm if norm > 0 else embedding
+        with self._lock:
+            self._message_embeddings[message] = embedding
+            self._message_embeddings.move_to_end(message)
+            while len(self._message_embeddings) > MESSAGE_EMBEDDING_CACHE_SIZE:
+                self._message_embeddings.popitem(last=False)
+        return embedding
+
+    def _check_catalog_version(self, catalog_version: Optional[str]):
+        """
+        Drop all entries if the catalog version has changed. Must be called with the lock held.
+        """
+        if catalog_version != self._catalog_version:
+            if self._entries:
+                self.invalidations += 1
+                print(f"Final response cache invalidated, {len(self._entries)} entries dropped")
+            self._entries.clear()
+            self._catalog_version = catalog_version
+
+    def _find_near_duplicate(self, top_k_ids: List[str], message_embedding: np.ndarray) -> Optional[str]:
+        """
+        Find the most similar cached entry satisfying the thresholds. Must be called with the lock held.
+        """
+        top_k_set = set(top_k_ids)
+        best_key, best_similarity = None, self.similarity_threshold
+        for key, entry in self._entries.items():
+            if entry.message_embedding is None:
+                continue
+            overlap = len(top_k_set.intersection(entry.top_k_ids)) / max(len(top_k_set), len(entry.top_k_ids), 1)
+            if overlap < self.min_top_k_overlap:
+                continue
+            similarity = float(np.dot(message_embedding, entry.message_embedding))
+            if similarity >= best_similarity:
+                best_key, best_similarity = key, similarity
+        return best_key
+
+    def get(
+        self,
+        query_dict: Dict[str, str],
+        top_k_ids: List[str],
+        last_user_message: str,
+        catalog_version: Optional[str] = None,
+    ) -> Optional[Dict[str, str]]:
+        """
+        Get a cached final response.
+
+        Args:
+            query_dict (Dict[str, str]): The structured query used for retrieval.
+            top_k_ids (List[str]): The IDs of the top-k retrieved courses shown to the LLM.
+            last_user_message (str): The last message from the user.
+            catalog_version (Optional[str]): Version of the course catalog the courses were retrieved from.
+
+        Returns:
+            Optional[Dict[str, str]]: A copy of the cached response, or None on a miss.
+        """
+        key = self.build_key(query_dict, top_k_ids)
+        with self._lock:
+            self._check_catalog_version(catalog_version)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return dict(self._entries[key].response)
+
+        if not self.near_duplicate_enabled:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        message_embedding = self._embed(last_user_message)
+        with self._lock:
+            near_key = self._find_near_duplicate(top_k_ids, message_embedding)
+            if near_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(near_key)
+            self.near_hits += 1
+            return dict(self._entries[near_key].response)
+
+    def put(
+        self,
+        query_dict: Dict[str, str],
+        top_k_ids: List[str],
+        last_user_message: str,
+        response: Dict[str, str],
+        catalog_version: Optional[str] = None,
+    ):
+        """
+        Cache a successful final response. Error responses are ignored.
+        """
+        if 'response' not in response:
+            return
+
+        key = self.build_key(query_dict, top_k_ids)
+        message_embedding = self._embed(last_user_message)
+        with self._lock:
+            self._check_catalog_version(catalog_version)
+            self._entries[key] = FinalResponseCacheEntry(dict(response), list(top_k_ids), message_embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the hit/miss counters of the cache.
+        """
+        with self._lock:
+            lookups = self.exact_hits + self.near_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxSize': self.max_size,
+                'exactHits': self.exact_hits,
+                'nearHits': self.near_hits,
+                'misses': self.misses,
+                'hitRate': (self.exact_hits + self.near_hits) / lookups if lookups else 0.0,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,204 @@
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+
+class CourseRecord:
+    """
+    One course of a `CourseCatalog`, e.g. a course shown in the final response prompt.
+
+    It only holds the row and a tuple of references to the values of that row, the column names are shared with
+    the catalog. A ranked course carries its relevance score as an extra `relevance_score` field.
+    """
+
+    __slots__ = ('row', 'relevance_score', '_columns', '_values')
+
+    def __init__(
+        self,
+        row: int,
+        columns: Mapping[str, int],
+        values: tuple,
+        relevance_score: Optional[float] = None,
+    ):
+        self.row = row
+        self.relevance_score = relevance_score
+        self._columns = columns
+        self._values = values
+
+    def keys(self) -> List[str]:
+        """
+        Get the field names, in catalog column order followed by `relevance_score` for a ranked course.
+        """
+        keys = list(self._columns)
+        if self.relevance_score is not None:
+            keys.append('relevance_score')
+        return keys
+
+    def get(self, column: str, default: Any = None) -> Any:
+        if column == 'relevance_score' and self.relevance_score is not None:
+            return self.relevance_score
+        position = self._columns.get(column)
+        return default if position is None else self._values[position]
+
+    def __getitem__(self, column: str) -> Any:
+        if column not in self._columns and not (column == 'relevance_score' and self.relevance_score is not None):
+            raise KeyError(column)
+        return self.get(column)
+
+    def __contains__(self, column: str) -> bool:
+        return column in self._columns or (column == 'relevance_score' and self.relevance_score is not None)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {column: self.get(column) for column in self.keys()}
+
+    def __str__(self):
+        return f"CourseRecord(row={self.row}, id={self.get('id')}, name={self.get('name')})"
+
+
+class CourseCatalog:
+    """
+    Read-only, array-backed course catalog.
+
+    Every column is an immutable numpy array indexed by the integer row id of a course, the row order being the
+    order of the precomputed embeddings. Rankers score rows and only the handful of courses a request shows are
+    materialized, as `CourseRecord`s, so no DataFrame is copied or walked row by row per request.
+    """
+
+    def __init__(self, columns: Mapping[str, Any], version: Optional[str] = None):
+        """
+        Args:
+            columns (Mapping[str, Any]): Column name to the values of every course, all of the same length.
+            version (Optional[str]): The catalog version, the content hash of the catalog file.
+
+        Raises:
+            ValueError: If the columns do not have the same length.
+        """
+        self.version = version
+        self._columns: Dict[str, np.ndarray] = {}
+        for column, values in columns.items():
+            array = np.asarray(values).view()
+            array.flags.writeable = False
+            self._columns[column] = array
+        self._column_positions = {column: position for position, column in enumerate(self._columns)}
+        self._arrays = tuple(self._columns.values())
+
+        lengths = {len(array) for array in self._arrays}
+        if len(lengths) > 1:
+            raise ValueError(f"Catalog columns have different lengths: {sorted(lengths)}")
+        self.num_rows = lengths.pop() if lengths else 0
+
+        self._id_to_row: Optional[Dict[Any, int]] = None
+
+    @staticmethod
+    def from_dataframe(courses_df: pd.DataFrame, version: Optional[str] = None) -> 'CourseCatalog':
+        """
+        Build a catalog from a DataFrame. The columns are read-only views of the DataFrame data, nothing is copied.
+        """
+        return CourseCatalog({column: courses_df[column].to_numpy() for column in courses_df.columns}, version)
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self._columns)
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._columns['id']
+
+    @property
+    def id_to_row(self) -> Dict[Any, int]:
+        """
+        Map of course id to row id, built on first use. The first row wins for a duplicate id.
+        """
+        if self._id_to_row is None:
+            id_to_row = {}
+            for row, course_id in enumerate(self.ids.tolist()):
+                id_to_row.setdefault(course_id, row)
+            self._id_to_row = id_to_row
+        return self._id_to_row
+
+    def row_of(self, course_id: Any) -> Optional[int]:
+        """
+        Get the row id of a course, None if the course is not in the catalog.
+        """
+        return self.id_to_row.get(course_id)
+
+    def rows_of(self, course_ids: Iterable[Any]) -> np.ndarray:
+        """
+        Get the row ids of courses, -1 for the courses that are not in the catalog.
+        """
+        id_to_row = self.id_to_row
+        return np.asarray([id_to_row.get(course_id, -1) for course_id in course_ids], dtype=np.int64)
+
+    def id_of(self, row: int) -> Any:
+        return self.ids[row]
+
+    def ids_of(self, rows: Union[Sequence[int], np.ndarray]) -> List[Any]:
+        return self.ids[np.asarray(rows, dtype=np.int64)].tolist()
+
+    def column(self, column: str) -> np.ndarray:
+        return self._columns[column]
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self._columns[column]
+
+    def __contains__(self, column: str) -> bool:
+        return column in self._columns
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def record(self, row: int, relevance_score: Optional[float] = None) -> CourseRecord:
+        """
+        Materialize one course.
+        """
+        return CourseRecord(int(row), self._column_positions, tuple(array[row] for array in self._arrays),
+                            relevance_score)
+
+    def records(
+        self,
+        rows: Union[Sequence[int], np.ndarray],
+        relevance_scores: Optional[Sequence[float]] = None,
+    ) -> List[CourseRecord]:
+        """
+        Materialize the courses of the given rows, in the given order.
+        """
+        if relevance_scores is None:
+            return [self.record(row) for row in rows]
+        return [self.record(row, score) for row, score in zip(rows, relevance_scores)]
+
+    def __iter__(self) -> Iterator[CourseRecord]:
+        return (self.record(row) for row in range(self.num_rows))
+
+    def to_dataframe(self, rows: Optional[Union[Sequence[int], np.ndarray]] = None) -> pd.DataFrame:
+        """
+        Copy the catalog, or only the given rows of it, into a DataFrame.
+        """
+        if rows is None:
+            return pd.DataFrame(dict(self._columns))
+        rows = np.asarray(rows, dtype=np.int64)
+        return pd.DataFrame({column: array[rows] for column, array in self._columns.items()})
+
+    def is_same(self, other: Optional['CourseCatalog']) -> bool:
+        """
+        Check whether another catalog holds the same courses, so data derived from it (tokenized texts, filter
+        index) can be reused.
+        """
+        if other is None:
+            return False
+        if other is self:
+            return True
+        return self.version is not None and self.version == other.version and len(self) == len(other)
+
+    def __str__(self):
+        version = self.version[:12] if self.version else None
+        return f"CourseCatalog(version={version}, courses={len(self)}, columns={len(self._columns)})"
+
+
+def as_course_catalog(courses: Union[CourseCatalog, pd.DataFrame]) -> CourseCatalog:
+    """
+    Get a catalog from a `CourseCatalog` or a courses DataFrame, the latter is wrapped without copying its data.
+    """
+    if isinstance(courses, CourseCatalog):
+        return courses
+    return CourseCatalog.from_dataframe(courses)
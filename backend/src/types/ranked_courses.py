@@ -0,0 +1,104 @@
+from typing import List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from .course_catalog import CourseCatalog, CourseRecord, as_course_catalog
+
+
+class RankedCourses:
+    """
+    Lightweight result of a ranker.
+
+    It only holds the relevance scores of the candidate rows and a reference to the (shared, read-only) catalog.
+    The top-k rows are found with a partial selection, the full ordering is only sorted when a caller asks for it,
+    and course records are materialized on demand for the handful of courses a request actually shows.
+
+    Unless an explicit order is given, courses are ordered by descending score and ties are broken by catalog
+    row order.
+    """
+
+    def __init__(
+        self,
+        catalog: Union[CourseCatalog, pd.DataFrame],
+        scores: np.ndarray,
+        row_ids: Optional[np.ndarray] = None,
+        order: Optional[np.ndarray] = None,
+    ):
+        """
+        Args:
+            catalog (Union[CourseCatalog, pd.DataFrame]): The catalog the scores refer to.
+            scores (np.ndarray): The relevance score of each candidate row.
+            row_ids (Optional[np.ndarray]): The catalog row of each score, sorted ascending. None means all rows.
+            order (Optional[np.ndarray]): Positions of the candidates in rank order, for rankings that are not
+                ordered by a single score (e.g. merged multi-stage rankings). Defaults to ordering by score.
+        """
+        self.catalog = as_course_catalog(catalog)
+        self.scores = np.asarray(scores, dtype=np.float32)
+        self.row_ids = np.arange(len(self.catalog)) if row_ids is None else np.asarray(row_ids, dtype=np.int64)
+        if len(self.scores) != len(self.row_ids):
+            raise ValueError(f"Got {len(self.scores)} scores for {len(self.row_ids)} rows")
+
+        self._full_order: Optional[np.ndarray] = None if order is None else np.asarray(order, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.row_ids)
+
+    def _order(self, k: Optional[int] = None) -> np.ndarray:
+        """
+        Get the positions (into `scores`) of the k best candidates, or of all candidates if k is None.
+        """
+        n = len(self.scores)
+        if self._full_order is not None:
+            return self._full_order if k is None else self._full_order[:k]
+
+        if k is None or k >= n:
+            # Stable sort on the negated scores keeps the catalog order for ties
+            self._full_order = np.argsort(-self.scores, kind='stable')
+            return self._full_order if k is None else self._full_order[:k]
+
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+
+        # Partial selection: find the k-th best score, then sort the few candidates at or above it
+        kth_score = np.partition(self.scores, n - k)[n - k]
+        candidates = np.flatnonzero(self.scores >= kth_score)
+        return candidates[np.argsort(-self.scores[candidates], kind='stable')][:k]
+
+    def top_rows(self, k: Optional[int] = None) -> np.ndarray:
+        """
+        Get the catalog rows of the k best courses, or of all candidates if k is None.
+        """
+        return self.row_ids[self._order(k)]
+
+    def top_scores(self, k: Optional[int] = None) -> np.ndarray:
+        """
+        Get the scores of the k best courses, or of all candidates if k is None.
+        """
+        return self.scores[self._order(k)]
+
+    def ranked_ids(self, k: Optional[int] = None) -> List[str]:
+        """
+        Get the IDs of the k best courses, or the full ranking if k is None.
+        """
+        return self.catalog.ids_of(self.top_rows(k))
+
+    def top_records(self, k: int) -> List[CourseRecord]:
+        """
+        Materialize the k best courses as records carrying their relevance score.
+        """
+        order = self._order(k)
+        return self.catalog.records(self.row_ids[order], self.scores[order])
+
+    def top_courses(self, k: int) -> pd.DataFrame:
+        """
+        Materialize the k best courses as a DataFrame with a `relevance_score` column.
+        Only these k rows are copied from the catalog.
+        """
+        order = self._order(k)
+        top_df = self.catalog.to_dataframe(self.row_ids[order])
+        top_df['relevance_score'] = self.scores[order]
+        return top_df
+
+    def __str__(self):
+        return f"RankedCourses(candidates={len(self)}, catalog={len(self.catalog)})"